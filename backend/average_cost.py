@@ -0,0 +1,176 @@
+"""
+Costo promedio ponderado de los productos (`purchase_price`)
+
+Cada compra y cada devolución a proveedor actualiza stock y costo del
+producto en la misma actualización (pipeline), dentro de un solo
+bulk_write por documento:
+
+    costo nuevo = (stock x costo actual + cantidad x costo unitario) / (stock + cantidad)
+
+calculado con los valores guardados, así dos compras simultáneas del mismo
+producto no se pisan. El stock negativo cuenta como cero (esas unidades ya
+se vendieron sin costo registrado). Una devolución a proveedor es una
+cantidad negativa; si deja el producto sin existencias el costo no cambia.
+Sus unidades se descuentan antes con la actualización condicional del modo
+estricto (nunca más de las que hay) y aquí solo se recalcula el costo.
+
+`backfill_average_cost` recalcula el costo de los productos reproduciendo
+las compras históricas en orden junto con el resto de movimientos.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from catalog_sync import sync_stamp
+from migrations import MIGRATION_BATCH
+from stock_snapshots import movement_totals
+from timestamps import legacy_reads, to_datetime
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_ID = "average_cost"
+# Movements that carry their own unit cost
+COSTED_MOVEMENTS = ["purchase", "supplier_return"]
+
+
+def average_cost(stock: float, cost: float, quantity: float, unit_cost: float) -> float:
+    """Costo promedio después de sumar `quantity` unidades a `unit_cost` (misma regla que cost_update)"""
+    on_hand = max(stock, 0)
+    units = on_hand + quantity
+    value = on_hand * cost + quantity * unit_cost
+    if units > 0 and value >= 0:
+        return round(value / units, 2)
+    return unit_cost if quantity > 0 else cost
+
+
+def cost_update(quantity: int, unit_cost: float, version: int, stock_applied: bool = False) -> list:
+    """
+    Pipeline que suma `quantity` al stock y recalcula `purchase_price`
+
+    Con stock_applied el stock guardado ya incluye `quantity` y solo se
+    recalcula el costo.
+    """
+    stock = {"$ifNull": ["$stock", 0]}
+    on_hand = {"$max": [{"$subtract": [stock, quantity]} if stock_applied else stock, 0]}
+    units = {"$add": [on_hand, quantity]}
+    value = {"$add": [{"$multiply": [on_hand, {"$ifNull": ["$purchase_price", 0]}]}, quantity * unit_cost]}
+    # Every expression of a $set stage reads the document before the stage
+    fields = {
+        "purchase_price": {"$cond": [
+            {"$and": [{"$gt": [units, 0]}, {"$gte": [value, 0]}]},
+            {"$round": [{"$divide": [value, units]}, 2]},
+            unit_cost if quantity > 0 else "$purchase_price",
+        ]},
+        "sync_version": version,
+    }
+    if not stock_applied:
+        fields["stock"] = {"$add": [stock, quantity]}
+    return [{"$set": fields}]
+
+
+async def apply_costed_stock(db: AsyncIOMotorDatabase, lines: Iterable[Tuple[str, int, float]],
+                             stock_applied: bool = False):
+    """
+    Aplicar (barcode, cantidad, costo unitario) a stock y costo en un solo bulk_write
+
+    Con stock_applied las cantidades ya se descontaron del stock (una sola
+    línea por producto) y solo cambia el costo.
+    """
+    version = sync_stamp()
+    operations = [
+        UpdateOne({"barcode": barcode}, cost_update(quantity, float(unit_cost), version, stock_applied))
+        for barcode, quantity, unit_cost in lines
+    ]
+    if operations:
+        # Ordered: repeated lines of a product build on each other
+        await db.products.bulk_write(operations, ordered=True)
+
+
+async def _replay_costs(db: AsyncIOMotorDatabase, cutoff: datetime, batch_size: int) -> Dict[str, float]:
+    """Costo promedio de cada producto comprado antes de `cutoff`"""
+    # Units without movements (initial stock, imports) keep the cost entered with the product
+    ledger = await movement_totals(db, None, cutoff)
+    stock: Dict[str, float] = {}
+    cost: Dict[str, float] = {}
+    async for product in db.products.find({}, {"_id": 0, "barcode": 1, "stock": 1, "purchase_price": 1}):
+        barcode = product["barcode"]
+        stock[barcode] = product.get("stock", 0) - ledger.get(barcode, 0)
+        cost[barcode] = float(product.get("purchase_price") or 0)
+
+    purchases = db.purchases.find(
+        {"created_at": {"$lt": cutoff}}, {"_id": 0, "created_at": 1, "items": 1}
+    ).sort([("created_at", 1), ("_id", 1)]).batch_size(batch_size).__aiter__()
+    movements = db.inventory_movements.find(
+        {"created_at": {"$lt": cutoff}, "movement_type": {"$ne": "purchase"}},
+        {"_id": 0, "barcode": 1, "quantity": 1, "movement_type": 1, "unit_cost": 1, "created_at": 1}
+    ).sort([("created_at", 1), ("_id", 1)]).batch_size(batch_size).__aiter__()
+
+    async def _next(iterator):
+        try:
+            return await iterator.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    purchased = set()
+    purchase, movement = await _next(purchases), await _next(movements)
+    while purchase or movement:
+        if movement and (not purchase or to_datetime(movement["created_at"]) <= to_datetime(purchase["created_at"])):
+            barcode = movement["barcode"]
+            if movement["movement_type"] in COSTED_MOVEMENTS and movement.get("unit_cost") is not None:
+                cost[barcode] = average_cost(stock.get(barcode, 0), cost.get(barcode, 0),
+                                             movement["quantity"], float(movement["unit_cost"]))
+                purchased.add(barcode)
+            stock[barcode] = stock.get(barcode, 0) + movement["quantity"]
+            movement = await _next(movements)
+        else:
+            # Purchase movements have no cost: the purchase lines replace them
+            for item in purchase["items"]:
+                barcode = item["barcode"]
+                cost[barcode] = average_cost(stock.get(barcode, 0), cost.get(barcode, 0),
+                                             item["quantity"], float(item["unit_cost"]))
+                stock[barcode] = stock.get(barcode, 0) + item["quantity"]
+                purchased.add(barcode)
+            purchase = await _next(purchases)
+
+    return {barcode: cost[barcode] for barcode in purchased}
+
+
+async def backfill_average_cost(db: AsyncIOMotorDatabase, batch_size: int = MIGRATION_BATCH,
+                                dry_run: bool = False) -> dict:
+    """
+    Recalcular `purchase_price` desde las compras históricas
+
+    Productos con compras posteriores al inicio de la ejecución se dejan como
+    están: su costo ya lo mantiene la actualización incremental.
+    """
+    if legacy_reads():
+        raise RuntimeError("Convierta primero las fechas (scripts/migrate.py dates): el historial se recorre por fecha")
+
+    cutoff = datetime.now(timezone.utc)
+    costs = await _replay_costs(db, cutoff, batch_size)
+    recent = set(await db.inventory_movements.distinct(
+        "barcode", {"created_at": {"$gte": cutoff}, "movement_type": {"$in": COSTED_MOVEMENTS}}
+    ))
+    if recent:
+        logger.info(f"{len(recent)} productos comprados durante el recálculo conservan su costo")
+
+    version = sync_stamp()
+    operations = [
+        UpdateOne({"barcode": barcode, "purchase_price": {"$ne": value}},
+                  {"$set": {"purchase_price": value, "sync_version": version}})
+        for barcode, value in costs.items() if barcode not in recent
+    ]
+    updated = 0
+    for start in range(0, len(operations), batch_size):
+        if dry_run:
+            updated += len(operations[start:start + batch_size])
+            continue
+        result = await db.products.bulk_write(operations[start:start + batch_size], ordered=False)
+        updated += result.modified_count
+
+    if not dry_run:
+        await db.migrations.update_one(
+            {"_id": MIGRATION_ID}, {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+        )
+    return {"products": updated}
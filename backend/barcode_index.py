@@ -0,0 +1,99 @@
+"""
+Índice en memoria código de barras -> producto para el escaneo en el POS
+
+Guarda cada producto ya serializado a JSON para responder sin consultar
+Mongo ni validar con pydantic en cada escaneo. Las escrituras locales lo
+actualizan directamente; un refresco periódico basado en `sync_version`
+recoge los cambios hechos por otros procesos.
+
+Los `watchers` (p. ej. low_stock.LowStockSet) reciben los mismos cambios
+con el documento original: `reset(productos)`, `update(producto)` y
+`discard(barcode)`.
+"""
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, Optional, Sequence
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from catalog_sync import sync_stamp, SYNC_SAFETY_MS
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_PROJECTION = {"_id": 0, "search_tokens": 0, "barcode_norm": 0, "name_norm": 0}
+
+
+class BarcodeIndex:
+    """Productos por código de barras, serializados con `encode`"""
+
+    def __init__(self, encode: Callable[[dict], bytes], watchers: Sequence = ()):
+        self._encode = encode
+        self._watchers = watchers
+        self._products: Dict[str, bytes] = {}
+        self._synced_at = 0
+
+    def __len__(self):
+        return len(self._products)
+
+    def get(self, barcode: str) -> Optional[bytes]:
+        return self._products.get(barcode)
+
+    def put(self, product: dict):
+        for watcher in self._watchers:
+            watcher.update(product)
+        try:
+            self._products[product["barcode"]] = self._encode(product)
+        except Exception as e:
+            # Invalid documents are served from Mongo as before
+            self._products.pop(product.get("barcode"), None)
+            logger.warning(f"Producto {product.get('barcode')} no indexado: {e}")
+
+    def remove(self, barcode: str):
+        self._products.pop(barcode, None)
+        for watcher in self._watchers:
+            watcher.discard(barcode)
+
+    async def load(self, db: AsyncIOMotorDatabase):
+        """Cargar todos los productos (al iniciar)"""
+        synced_at = sync_stamp()
+        products = {}
+        documents = []
+        async for product in db.products.find({}, PRODUCT_PROJECTION):
+            documents.append(product)
+            try:
+                products[product["barcode"]] = self._encode(product)
+            except Exception as e:
+                logger.warning(f"Producto {product.get('barcode')} no indexado: {e}")
+        self._products = products
+        for watcher in self._watchers:
+            watcher.reset(documents)
+        self._synced_at = synced_at
+
+    async def reload(self, db: AsyncIOMotorDatabase, barcodes: Iterable[str]):
+        """Volver a leer productos concretos después de una escritura (una sola consulta)"""
+        barcodes = set(barcodes)
+        found = set()
+        async for product in db.products.find({"barcode": {"$in": list(barcodes)}}, PRODUCT_PROJECTION):
+            self.put(product)
+            found.add(product["barcode"])
+        for barcode in barcodes - found:
+            self.remove(barcode)
+
+    async def refresh(self, db: AsyncIOMotorDatabase):
+        """Aplicar cambios de otros procesos desde el último refresco"""
+        since = self._synced_at - SYNC_SAFETY_MS
+        synced_at = sync_stamp()
+        async for tombstone in db.catalog_tombstones.find(
+            {"collection": "products", "sync_version": {"$gt": since}}, {"_id": 0, "key": 1}
+        ):
+            self.remove(tombstone["key"])
+        async for product in db.products.find({"sync_version": {"$gt": since}}, PRODUCT_PROJECTION):
+            self.put(product)
+        self._synced_at = synced_at
+
+    async def run_refresh(self, db: AsyncIOMotorDatabase, interval: float):
+        """Tarea de fondo: refrescar cada `interval` segundos"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(db)
+            except Exception as e:
+                logger.error(f"Error refrescando índice de códigos de barras: {e}")
@@ -0,0 +1,67 @@
+"""
+Caché en proceso con ETag para listados de catálogo que cambian poco
+"""
+import hashlib
+import os
+import time
+from fastapi import Request
+from fastapi.responses import Response
+
+# Cached bodies are reloaded after this many seconds even without local
+# writes, which bounds staleness when several worker processes serve the API
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", 30))
+
+
+class CatalogCache:
+    """
+    Cuerpos JSON serializados por colección con su ETag
+
+    Los endpoints de escritura llaman a invalidate(); las lecturas con
+    If-None-Match vigente responden 304 sin consultar Mongo. Cada
+    invalidate() sube la generación de la colección: una carga que empezó
+    antes no se guarda, así un cuerpo anterior a la escritura no queda en
+    caché durante todo el TTL.
+    """
+
+    def __init__(self, ttl=CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}  # key -> (etag, body, loaded_at)
+        self._generations = {}  # collection -> invalidations so far
+
+    def invalidate(self, collection):
+        """Descartar las entradas de una colección (incluye variantes como 'payment_methods:active')"""
+        self._generations[collection] = self._generations.get(collection, 0) + 1
+        for key in [k for k in self._entries if k == collection or k.startswith(collection + ":")]:
+            del self._entries[key]
+
+    async def respond(self, request: Request, key, load):
+        """
+        Responder un listado cacheado
+
+        load: corrutina que devuelve el cuerpo JSON (bytes) leyendo de Mongo
+        """
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[2] > self.ttl:
+            collection = key.split(":", 1)[0]
+            generation = self._generations.get(collection, 0)
+            body = await load()
+            # Content hash: identical bodies keep their ETag across reloads and processes
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            entry = (etag, body, time.monotonic())
+            # A write invalidated the collection while loading: serve, but do not keep
+            if self._generations.get(collection, 0) == generation:
+                self._entries[key] = entry
+
+        etag, body, _ = entry
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        tags = _parse_if_none_match(request.headers.get("if-none-match"))
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+
+def _parse_if_none_match(value):
+    if not value:
+        return set()
+    # Weak validators (W/"...") match too for GET revalidation
+    return {tag.strip().removeprefix("W/") for tag in value.split(",")}
@@ -0,0 +1,174 @@
+"""
+Sincronización incremental del catálogo para terminales POS
+
+Cada documento de las colecciones de catálogo lleva `sync_version`
+(milisegundos desde epoch del momento de la última escritura). Los borrados
+dejan una lápida en `catalog_tombstones`. Un terminal guarda el `token`
+devuelto por /api/sync/catalog y lo envía en la siguiente llamada para
+recibir solo los cambios: primero aplica los borrados y luego las altas
+y modificaciones. El token es opaco: además de la versión, mientras hay más
+páginas guarda si la sincronización es completa y hasta qué documento
+(sync_version, clave) llegó cada colección.
+"""
+import base64
+import time
+from datetime import datetime, timezone
+from bson import json_util
+from bson.errors import InvalidBSON
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+# Collection -> natural key used by terminals
+SYNC_COLLECTIONS = {
+    "products": "barcode",
+    "categories": "name",
+    "price_lists": "name",
+    "tax_rates": "name",
+    "payment_methods": "name",
+    "clients": "document_number",
+}
+
+# Internal fields not sent to terminals
+SYNC_EXCLUDED_FIELDS = {
+    "products": ["search_tokens", "barcode_norm", "name_norm"],
+}
+
+# Writes stamp their version right before hitting Mongo; tokens lag this much
+# behind the clock so a slow concurrent write is never skipped (at worst it
+# is sent twice, and upserts are idempotent)
+SYNC_SAFETY_MS = 5000
+
+# Tombstones older than this are purged; older tokens get a full resync
+TOMBSTONE_RETENTION_DAYS = 90
+
+
+def sync_stamp() -> int:
+    """Versión de sincronización para una escritura que ocurre ahora"""
+    return int(time.time() * 1000)
+
+
+async def record_tombstones(db: AsyncIOMotorDatabase, collection: str, keys):
+    """Registrar el borrado de uno o varios documentos del catálogo"""
+    version = sync_stamp()
+    now = datetime.now(timezone.utc)
+    docs = [{"collection": collection, "key": key, "sync_version": version, "deleted_at": now} for key in keys]
+    if docs:
+        await db.catalog_tombstones.insert_many(docs)
+
+
+async def setup_catalog_sync(db: AsyncIOMotorDatabase):
+    """Crear índices y versionar documentos anteriores a la sincronización"""
+    version = sync_stamp()
+    for collection, key in SYNC_COLLECTIONS.items():
+        # Pages follow (sync_version, key)
+        await db[collection].create_index([("sync_version", 1), (key, 1)])
+        await db[collection].update_many(
+            {"sync_version": {"$exists": False}},
+            {"$set": {"sync_version": version}}
+        )
+    await db.catalog_tombstones.create_index([("collection", 1), ("sync_version", 1), ("_id", 1)])
+    await db.catalog_tombstones.create_index(
+        "deleted_at", expireAfterSeconds=TOMBSTONE_RETENTION_DAYS * 24 * 3600
+    )
+
+
+def encode_token(state: dict) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(state).encode()).decode()
+
+
+def decode_token(token: str) -> dict:
+    """
+    Estado de sincronización de un token
+
+    Los tokens anteriores eran solo la versión (un entero); se siguen aceptando.
+    """
+    if token.isdigit():
+        return {"since": int(token), "full": None, "after": {}}
+    try:
+        state = json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, InvalidBSON):
+        state = None
+    if not isinstance(state, dict) or not isinstance(state.get("since"), int):
+        raise HTTPException(status_code=400, detail="Token de sincronización inválido")
+    return {"since": state["since"], "full": bool(state.get("full")), "after": state.get("after") or {}}
+
+
+async def _fetch_after(collection, query, key, since, after, limit, projection):
+    """
+    Documentos con sync_version > since en orden (sync_version, key), hasta `limit`
+
+    `after` es la posición [sync_version, key] del último documento ya
+    enviado de esta colección, así una página nunca repite la anterior
+    aunque muchos documentos compartan versión (importaciones, migraciones).
+    Devuelve (docs, truncated).
+    """
+    if after:
+        version, last_key = after
+        position = {"$or": [
+            {"sync_version": {"$gt": version}},
+            {"sync_version": version, key: {"$gt": last_key}},
+        ]}
+    else:
+        position = {"sync_version": {"$gt": since}}
+    docs = await collection.find(
+        {**query, **position}, projection
+    ).sort([("sync_version", 1), (key, 1)]).limit(limit + 1).to_list(limit + 1)
+    return docs[:limit], len(docs) > limit
+
+
+async def get_catalog_changes(db: AsyncIOMotorDatabase, token: str, limit: int) -> dict:
+    """
+    Obtener altas, modificaciones y borrados posteriores al token
+
+    Sin token (o con uno más antiguo que la retención de lápidas) se
+    devuelve el catálogo completo con full=True: el terminal debe reemplazar
+    su copia local. Con has_more=True el token devuelto continúa la misma
+    sincronización (completa o incremental) en la página siguiente; solo el
+    token propio de un terminal, no uno de continuación, provoca una
+    sincronización completa.
+    """
+    state = decode_token(token) if token else {"since": 0, "full": None, "after": {}}
+    since, full, after = state["since"], state["full"], state["after"]
+    if full is None:
+        retention_start = sync_stamp() - TOMBSTONE_RETENTION_DAYS * 24 * 3600 * 1000
+        full = since <= 0 or since < retention_start
+    if full:
+        since = 0
+
+    next_since = max(sync_stamp() - SYNC_SAFETY_MS, since)
+    has_more = False
+    positions = {}
+    changes = {}
+
+    for collection, key in SYNC_COLLECTIONS.items():
+        projection = {"_id": 0, **{field: 0 for field in SYNC_EXCLUDED_FIELDS.get(collection, [])}}
+        upserts, truncated = await _fetch_after(
+            db[collection], {}, key, since, after.get(collection), limit, projection
+        )
+        positions[collection] = [upserts[-1]["sync_version"], upserts[-1][key]] if upserts else after.get(collection)
+        has_more = has_more or truncated
+
+        deleted = []
+        if not full:
+            stream = f"{collection}:deleted"
+            tombstones, tombstones_truncated = await _fetch_after(
+                db.catalog_tombstones, {"collection": collection}, "_id", since, after.get(stream), limit,
+                {"key": 1, "sync_version": 1}
+            )
+            deleted = [t["key"] for t in tombstones]
+            positions[stream] = [tombstones[-1]["sync_version"], tombstones[-1]["_id"]] if tombstones else after.get(stream)
+            has_more = has_more or tombstones_truncated
+
+        changes[collection] = {"key": key, "upserts": upserts, "deleted": deleted}
+
+    if has_more:
+        # Same sync, next page: keep the starting point and where each collection stopped
+        next_token = {"since": since, "full": full, "after": {k: v for k, v in positions.items() if v}}
+    else:
+        next_token = {"since": next_since}
+    return {
+        "token": encode_token(next_token),
+        "full": full,
+        "has_more": has_more,
+        "changes": changes,
+    }
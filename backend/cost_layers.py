@@ -0,0 +1,312 @@
+"""
+Capas de costo FIFO por producto y valoración del inventario
+
+Un documento por producto en `cost_layers` (`_id` = código de barras):
+
+- layers: [{qty, cost}] en orden de entrada; las salidas consumen desde el
+  principio. Entradas seguidas al mismo costo se juntan en una sola capa.
+- backorder: unidades vendidas sin capa (stock negativo); la siguiente
+  entrada las cubre antes de crear una capa nueva
+- last_cost: costo de la última capa consumida. Una devolución de cliente
+  vuelve a entrar con ese costo al principio de la cola (lo más probable es
+  que venga de la última venta).
+
+Una devolución a proveedor retira primero las unidades de las capas con su
+mismo costo unitario, como lo hace el costo promedio, así los dos métodos
+de valoración coinciden.
+
+Cada operación es una actualización pipeline por producto y todas las de
+una compra, factura o devolución van en un solo bulk_write.
+
+La valoración (FIFO o costo promedio) se calcula con una agregación en
+Mongo: totales con $group y una fila por producto, sin recorrer los
+documentos en Python.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from migrations import MIGRATION_BATCH
+
+MIGRATION_ID = "cost_layers"
+
+_LAYERS = {"$ifNull": ["$layers", []]}
+_BACKORDER = {"$ifNull": ["$backorder", 0]}
+
+
+def _layer(quantity, cost) -> dict:
+    return {"qty": quantity, "cost": cost}
+
+
+def _layer_field(layer, field: str):
+    return {"$getField": {"field": field, "input": layer}}
+
+
+def _layers_between(start, end) -> dict:
+    """layers[start:end]"""
+    return {"$map": {"input": {"$range": [start, end]}, "in": {"$arrayElemAt": [_LAYERS, "$$this"]}}}
+
+
+def receive_update(quantity: int, cost: float) -> list:
+    """Entrada de `quantity` unidades a `cost` al final de la cola"""
+    added = {"$subtract": [quantity, {"$min": [_BACKORDER, quantity]}]}
+    last = {"$arrayElemAt": [_LAYERS, -1]}
+    return [{"$set": {
+        "layers": {"$cond": [
+            {"$lte": [added, 0]},
+            _LAYERS,
+            {"$cond": [
+                {"$eq": [_layer_field(last, "cost"), cost]},
+                # Same cost as the newest layer: grow it instead of adding one
+                {"$concatArrays": [
+                    _layers_between(0, {"$subtract": [{"$size": _LAYERS}, 1]}),
+                    [_layer({"$add": [_layer_field(last, "qty"), added]}, cost)],
+                ]},
+                {"$concatArrays": [_LAYERS, [_layer(added, cost)]]},
+            ]},
+        ]},
+        "backorder": {"$max": [{"$subtract": [_BACKORDER, quantity]}, 0]},
+        "last_cost": {"$ifNull": ["$last_cost", cost]},
+    }}]
+
+
+def consume_update(quantity) -> list:
+    """Salida de `quantity` unidades (número o expresión) desde las capas más antiguas"""
+    return [
+        {"$set": {"_fifo": {"$reduce": {
+            "input": _LAYERS,
+            "initialValue": {"left": quantity, "layers": [], "cost": "$last_cost"},
+            "in": {"$let": {
+                "vars": {"take": {"$min": ["$$value.left", "$$this.qty"]}},
+                "in": {
+                    "left": {"$subtract": ["$$value.left", "$$take"]},
+                    "layers": {"$cond": [
+                        {"$gt": ["$$this.qty", "$$take"]},
+                        {"$concatArrays": ["$$value.layers", [_layer({"$subtract": ["$$this.qty", "$$take"]}, "$$this.cost")]]},
+                        "$$value.layers",
+                    ]},
+                    "cost": {"$cond": [{"$gt": ["$$take", 0]}, "$$this.cost", "$$value.cost"]},
+                },
+            }},
+        }}}},
+        {"$set": {
+            "layers": "$_fifo.layers",
+            "backorder": {"$add": [_BACKORDER, "$_fifo.left"]},
+            "last_cost": "$_fifo.cost",
+        }},
+        {"$unset": "_fifo"},
+    ]
+
+
+def supplier_return_update(quantity: int, cost: float) -> list:
+    """
+    Devolución a proveedor: salen primero las unidades de las capas con su
+    mismo costo (como en el costo promedio) y el resto desde las más antiguas
+    """
+    return [
+        {"$set": {"_matched": {"$reduce": {
+            "input": _LAYERS,
+            "initialValue": {"left": quantity, "layers": []},
+            "in": {"$let": {
+                "vars": {"take": {"$cond": [
+                    {"$eq": ["$$this.cost", cost]}, {"$min": ["$$value.left", "$$this.qty"]}, 0,
+                ]}},
+                "in": {
+                    "left": {"$subtract": ["$$value.left", "$$take"]},
+                    "layers": {"$cond": [
+                        {"$gt": ["$$this.qty", "$$take"]},
+                        {"$concatArrays": ["$$value.layers", [_layer({"$subtract": ["$$this.qty", "$$take"]}, "$$this.cost")]]},
+                        "$$value.layers",
+                    ]},
+                },
+            }},
+        }}}},
+        {"$set": {"layers": "$_matched.layers"}},
+    ] + consume_update("$_matched.left") + [{"$unset": "_matched"}]
+
+
+def restore_update(quantity: int) -> list:
+    """Devolución de cliente: `quantity` unidades al principio de la cola a `last_cost`"""
+    added = {"$subtract": [quantity, {"$min": [_BACKORDER, quantity]}]}
+    first = {"$arrayElemAt": [_LAYERS, 0]}
+    cost = {"$ifNull": ["$last_cost", _layer_field(first, "cost"), 0]}
+    return [{"$set": {
+        "layers": {"$cond": [
+            {"$lte": [added, 0]},
+            _LAYERS,
+            {"$cond": [
+                {"$eq": [_layer_field(first, "cost"), cost]},
+                {"$concatArrays": [
+                    [_layer({"$add": [_layer_field(first, "qty"), added]}, cost)],
+                    _layers_between(1, {"$size": _LAYERS}),
+                ]},
+                {"$concatArrays": [[_layer(added, cost)], _LAYERS]},
+            ]},
+        ]},
+        "backorder": {"$max": [{"$subtract": [_BACKORDER, quantity]}, 0]},
+    }}]
+
+
+async def _write(db: AsyncIOMotorDatabase, operations: list):
+    if operations:
+        # Ordered: repeated lines of a product build on each other
+        await db.cost_layers.bulk_write(operations, ordered=True)
+
+
+async def receive_layers(db: AsyncIOMotorDatabase, lines: Iterable[Tuple[str, int, float]]):
+    """Registrar entradas (barcode, cantidad, costo unitario), p. ej. una compra"""
+    await _write(db, [
+        UpdateOne({"_id": barcode}, receive_update(quantity, float(cost)), upsert=True)
+        for barcode, quantity, cost in lines if quantity > 0
+    ])
+
+
+async def consume_layers(db: AsyncIOMotorDatabase, quantities: Dict[str, int]):
+    """Registrar ventas {barcode: unidades}"""
+    await _write(db, [
+        UpdateOne({"_id": barcode}, consume_update(quantity), upsert=True)
+        for barcode, quantity in quantities.items() if quantity > 0
+    ])
+
+
+async def return_layers(db: AsyncIOMotorDatabase, lines: Iterable[Tuple[str, int, float]]):
+    """Registrar devoluciones a proveedor (barcode, cantidad, costo unitario)"""
+    await _write(db, [
+        UpdateOne({"_id": barcode}, supplier_return_update(quantity, float(cost)), upsert=True)
+        for barcode, quantity, cost in lines if quantity > 0
+    ])
+
+
+async def restore_layers(db: AsyncIOMotorDatabase, quantities: Dict[str, int]):
+    """Registrar devoluciones de clientes {barcode: unidades}"""
+    await _write(db, [
+        UpdateOne({"_id": barcode}, restore_update(quantity), upsert=True)
+        for barcode, quantity in quantities.items() if quantity > 0
+    ])
+
+
+def _valuation_rows(method: str, category: Optional[str]) -> tuple:
+    """(colección, pipeline) con una fila {barcode, name, category, units, value} por producto"""
+    if method == "fifo":
+        pipeline = [
+            {"$project": {
+                "units": {"$sum": "$layers.qty"},
+                "value": {"$sum": {"$map": {"input": "$layers", "in": {"$multiply": ["$$this.qty", "$$this.cost"]}}}},
+            }},
+            {"$match": {"units": {"$gt": 0}}},
+            {"$lookup": {"from": "products", "localField": "_id", "foreignField": "barcode", "as": "product",
+                         "pipeline": [{"$project": {"_id": 0, "name": 1, "category": 1}}]}},
+            {"$project": {
+                "_id": 0, "barcode": "$_id", "units": 1, "value": 1,
+                "name": {"$first": "$product.name"}, "category": {"$first": "$product.category"},
+            }},
+        ]
+        collection = "cost_layers"
+    else:
+        units = {"$max": [{"$ifNull": ["$stock", 0]}, 0]}
+        pipeline = [
+            {"$match": {"stock": {"$gt": 0}}},
+            {"$project": {
+                "_id": 0, "barcode": 1, "name": 1, "category": 1, "units": units,
+                "value": {"$multiply": [units, {"$ifNull": ["$purchase_price", 0]}]},
+            }},
+        ]
+        collection = "products"
+    if category is not None:
+        pipeline.append({"$match": {"category": category}})
+    return collection, pipeline
+
+
+async def valuation(db: AsyncIOMotorDatabase, method: str, category: Optional[str] = None) -> dict:
+    """Valor del inventario por producto y total, por FIFO o costo promedio"""
+    collection, rows = _valuation_rows(method, category)
+    totals = await db[collection].aggregate(rows + [
+        {"$group": {"_id": None, "products": {"$sum": 1}, "units": {"$sum": "$units"}, "value": {"$sum": "$value"}}},
+    ]).to_list(1)
+    items = await db[collection].aggregate(rows + [
+        {"$set": {
+            "value": {"$round": ["$value", 2]},
+            "unit_cost": {"$round": [{"$divide": ["$value", "$units"]}, 2]},
+        }},
+        {"$sort": {"barcode": 1}},
+    ], allowDiskUse=True).to_list(None)
+    summary = totals[0] if totals else {"products": 0, "units": 0, "value": 0}
+    return {
+        "method": method,
+        "category": category,
+        "generated_at": datetime.now(timezone.utc),
+        "total_products": summary["products"],
+        "total_units": summary["units"],
+        "total_value": round(summary["value"], 2),
+        "items": items,
+    }
+
+
+async def seed_cost_layers(db: AsyncIOMotorDatabase, batch_size: int = MIGRATION_BATCH,
+                           dry_run: bool = False) -> dict:
+    """
+    Dar capa a las unidades que ninguna capa explica: el stock anterior a las capas
+
+    Desde esta versión cada venta o compra ya escribe en `cost_layers`, así
+    que un producto puede tener documento (p. ej. solo un `backorder` por
+    ventas sin capa) antes de la migración. Las unidades sin explicar son
+    stock - (capas - backorder); lo que queda de ellas después de cubrir el
+    backorder entra como la capa más antigua a `purchase_price`. Ventas y
+    compras mueven stock y capas por igual, así que ese número no cambia si
+    llegan durante la migración: el $merge lo aplica sobre el documento
+    vigente. Si las capas superan el stock, la diferencia se consume desde
+    las más antiguas. Repetirla no cambia nada.
+    """
+    tracked = {"$sum": {"$map": {"input": {"$ifNull": ["$existing.layers", []]}, "in": "$$this.qty"}}}
+    untracked = {"$add": [
+        {"$subtract": [{"$ifNull": ["$stock", 0]}, tracked]}, {"$ifNull": ["$existing.backorder", 0]},
+    ]}
+    cost = {"$ifNull": ["$purchase_price", 0]}
+    pipeline = [
+        {"$lookup": {"from": "cost_layers", "localField": "barcode", "foreignField": "_id", "as": "existing"}},
+        {"$set": {"existing": {"$first": "$existing"}}},
+        {"$project": {"_id": "$barcode", "_untracked": untracked, "_cost": cost, "last_cost": cost}},
+        # Layers and backorder already explain the stock
+        {"$match": {"_untracked": {"$ne": 0}}},
+    ]
+    pending = await db.products.aggregate(pipeline + [{"$count": "products"}]).to_list(1)
+    seeded = {"cost_layers": pending[0]["products"] if pending else 0}
+    if dry_run:
+        return seeded
+
+    # Applied to the document as it is when merged, not as it was read
+    seed = {"$subtract": ["$_untracked", _BACKORDER]}
+    apply_seed = [
+        {"$set": {
+            "layers": {"$cond": [{"$gt": [seed, 0]}, {"$concatArrays": [[_layer(seed, "$_cost")], _LAYERS]}, _LAYERS]},
+            "backorder": {"$max": [{"$multiply": [seed, -1]}, 0]},
+            "last_cost": {"$ifNull": ["$last_cost", "$_cost"]},
+        }},
+        {"$unset": ["_untracked", "_cost"]},
+    ]
+    await db.products.aggregate(pipeline + [{"$merge": {
+        "into": "cost_layers",
+        "on": "_id",
+        "whenMatched": [
+            {"$set": {"_untracked": "$$new._untracked", "_cost": "$$new._cost",
+                      "last_cost": {"$ifNull": ["$last_cost", "$$new.last_cost"]}}},
+        ] + apply_seed,
+        "whenNotMatched": "insert",
+    }}], allowDiskUse=True).to_list(None)
+    # New documents were inserted as computed; finish them the same way
+    await db.cost_layers.update_many({"_untracked": {"$exists": True}}, apply_seed)
+
+    # Layers above the stock: consume the excess FIFO instead of leaving a backorder next to layers
+    excess = await db.cost_layers.find(
+        {"backorder": {"$gt": 0}, "layers.0": {"$exists": True}}, {"backorder": 1}
+    ).to_list(None)
+    for start in range(0, len(excess), batch_size):
+        await _write(db, [
+            UpdateOne({"_id": doc["_id"], "backorder": doc["backorder"]},
+                      [{"$set": {"backorder": 0}}] + consume_update(doc["backorder"]))
+            for doc in excess[start:start + batch_size]
+        ])
+    await db.migrations.update_one(
+        {"_id": MIGRATION_ID}, {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    return seeded
@@ -0,0 +1,170 @@
+"""
+Cabecera Idempotency-Key para los POST que crean documentos
+
+Los terminales reintentan cuando la red falla; con la misma clave el
+reintento recibe la respuesta guardada de la primera ejecución en lugar de
+crear otra factura, devolución, compra o abono.
+
+- Sin cabecera la petición pasa directo (sin coste).
+- La clave se asocia al usuario (el `sub` del token, no el token: un
+  reintento con el token renovado sigue siendo el mismo), la ruta y un hash
+  del cuerpo; reutilizarla con otro cuerpo responde 422.
+- Duplicados simultáneos en el mismo proceso esperan al primero (un lock
+  por clave) y reciben su respuesta; en otro proceso reciben 409 con
+  Retry-After mientras la primera sigue en curso.
+- Las respuestas se guardan en `idempotency_keys` y caducan por índice TTL.
+  Los errores 5xx, 401 y 403 no se guardan: el reintento se ejecuta.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Dict, Iterable, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", 24))
+# A pending key older than this belongs to a request that died mid-way
+PENDING_TIMEOUT = timedelta(seconds=60)
+MAX_KEY_LENGTH = 255
+
+_UNSTORED_STATUS = {401, 403}
+
+
+async def setup_idempotency(db: AsyncIOMotorDatabase):
+    await db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_HOURS * 3600)
+
+
+class IdempotencyMiddleware:
+    """Middleware ASGI: aplica Idempotency-Key a los POST de `paths` (regex)"""
+
+    def __init__(self, app, db: AsyncIOMotorDatabase, paths: Iterable[str],
+                 identity: Callable[[str], Optional[str]]):
+        self.app = app
+        self.db = db
+        self.paths = [re.compile(path) for path in paths]
+        # Authorization header -> user id, None if the token is not valid
+        self.identity = identity
+        self._locks: Dict[str, list] = {}  # key -> [lock, waiters]
+
+    @asynccontextmanager
+    async def locks(self, key):
+        """Un asyncio.Lock por clave, descartado cuando nadie lo espera"""
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        key = headers.get(IDEMPOTENCY_HEADER)
+        if key is None or not any(path.match(scope["path"]) for path in self.paths):
+            return await self.app(scope, receive, send)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return await _send_json(send, 400, {"detail": "Idempotency-Key inválida"})
+
+        user = self.identity(headers.get(b"authorization", b"").decode("latin-1"))
+        if user is None:
+            # The endpoint answers 401; nothing to store
+            return await self.app(scope, receive, send)
+        body = await _read_body(receive)
+        store_id = hashlib.sha256(
+            b"\n".join([user.encode(), scope["path"].encode(), key])
+        ).hexdigest()
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        async with self.locks(store_id):
+            stored = await self._begin(store_id, fingerprint)
+            if stored is not None:
+                return await self._replay(send, stored, fingerprint)
+            await self._execute(scope, body, send, store_id)
+
+    async def _begin(self, store_id, fingerprint):
+        """Registrar la clave como en curso; devuelve el documento si ya existía"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db.idempotency_keys.insert_one(
+                {"_id": store_id, "fingerprint": fingerprint, "state": "pending", "created_at": now}
+            )
+            return None
+        except DuplicateKeyError:
+            pass
+        # Take over a key abandoned by a crashed request
+        taken = await self.db.idempotency_keys.find_one_and_update(
+            {"_id": store_id, "state": "pending", "created_at": {"$lt": now - PENDING_TIMEOUT}},
+            {"$set": {"fingerprint": fingerprint, "created_at": now}}
+        )
+        if taken:
+            return None
+        return await self.db.idempotency_keys.find_one({"_id": store_id}) or {"state": "pending"}
+
+    async def _replay(self, send, stored, fingerprint):
+        if stored.get("fingerprint") not in (None, fingerprint):
+            return await _send_json(send, 422, {"detail": "Idempotency-Key ya usada con otro contenido"})
+        if stored["state"] == "pending":
+            return await _send_json(send, 409, {"detail": "La solicitud original sigue en curso"},
+                                    [(b"retry-after", b"1")])
+        headers = [(name, value) for name, value in stored["headers"]] + [(REPLAYED_HEADER.lower().encode(), b"true")]
+        await send({"type": "http.response.start", "status": stored["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": stored["body"]})
+
+    async def _execute(self, scope, body, send, store_id):
+        response = {"status": 500, "headers": [], "body": []}
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if body_sent:
+                return {"type": "http.disconnect"}
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[name, value] for name, value in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            status = response["status"]
+            if status >= 500 or status in _UNSTORED_STATUS:
+                await self.db.idempotency_keys.delete_one({"_id": store_id, "state": "pending"})
+            else:
+                await self.db.idempotency_keys.update_one({"_id": store_id}, {"$set": {
+                    "state": "done",
+                    "status": status,
+                    "headers": response["headers"],
+                    "body": b"".join(response["body"]),
+                }})
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send_json(send, status, content, extra_headers=()):
+    body = json.dumps(content).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status, "headers": headers + list(extra_headers)})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,63 @@
+"""
+Detalle de factura con abonos y devoluciones en una sola consulta
+
+La factura, su historial de abonos (`fio_payments`) y sus devoluciones
+(`returns`) se leen con una agregación `$lookup` en lugar de tres consultas
+seguidas. `InvoiceDetailLoader` guarda el resultado durante la petición, así
+un mismo número de factura nunca se carga dos veces.
+"""
+import asyncio
+from typing import Dict, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pos_sync import INVOICE_PROJECTION
+
+DETAIL_HISTORY_LIMIT = 1000
+
+
+async def setup_invoice_detail(db: AsyncIOMotorDatabase):
+    await db.invoices.create_index("invoice_number")
+    await db.fio_payments.create_index([("invoice_number", 1), ("created_at", -1)])
+    await db.returns.create_index([("invoice_number", 1), ("created_at", -1)])
+
+
+def _history(collection: str, field: str) -> dict:
+    return {"$lookup": {
+        "from": collection,
+        "localField": "invoice_number",
+        "foreignField": "invoice_number",
+        "pipeline": [
+            {"$sort": {"created_at": -1}},
+            {"$limit": DETAIL_HISTORY_LIMIT},
+            {"$project": {"_id": 0}},
+        ],
+        "as": field,
+    }}
+
+
+async def load_invoice_detail(db: AsyncIOMotorDatabase, invoice_number: str) -> Optional[dict]:
+    """Factura con `payments_history` y `returns_history` (más recientes primero)"""
+    pipeline = [
+        {"$match": {"invoice_number": invoice_number}},
+        {"$limit": 1},
+        {"$project": INVOICE_PROJECTION},
+        _history("fio_payments", "payments_history"),
+        _history("returns", "returns_history"),
+    ]
+    docs = await db.invoices.aggregate(pipeline).to_list(1)
+    return docs[0] if docs else None
+
+
+class InvoiceDetailLoader:
+    """Cargador de detalles para una petición (ver la dependencia en server.py)"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self._loads: Dict[str, asyncio.Future] = {}
+
+    async def load(self, invoice_number: str) -> Optional[dict]:
+        """Detalle de la factura o None; devuelve una copia que se puede modificar"""
+        if invoice_number not in self._loads:
+            # Concurrent loads of the same invoice share one query
+            self._loads[invoice_number] = asyncio.ensure_future(load_invoice_detail(self.db, invoice_number))
+        detail = await self._loads[invoice_number]
+        return dict(detail) if detail else None
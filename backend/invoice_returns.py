@@ -0,0 +1,169 @@
+"""
+Cantidades devueltas por línea de factura
+
+Cada línea de `items` lleva `returned_qty`. Una devolución se valida y se
+aplica con una sola actualización condicional de la factura:
+
+- el filtro exige que, por cada producto, lo vendido menos lo ya devuelto
+  alcance para la cantidad pedida (varias líneas del mismo producto suman)
+- la actualización (pipeline) reparte la cantidad entre esas líneas en
+  orden y recalcula total, estado y saldo a partir de los valores guardados
+
+Dos devoluciones simultáneas no pueden pasar las dos si juntas exceden lo
+vendido: la segunda ya no cumple el filtro.
+
+`migrate_returned_qty` calcula `returned_qty` de las facturas anteriores a
+partir de sus devoluciones; hasta entonces se asume 0. Las facturas nuevas
+y las ya migradas llevan `returns_migrated`: una devolución aplicada a una
+factura anterior antes de la migración escribe `returned_qty` en sus
+líneas, pero la migración la recalcula igual desde todas sus devoluciones.
+"""
+from decimal import Decimal
+from typing import Dict, List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from migrations import MigrationStep, run_migration, MIGRATION_BATCH
+from money import ZERO
+
+MIGRATION_ID = "returned_qty"
+
+
+def _available(line: str):
+    return {"$subtract": [f"{line}.quantity", {"$ifNull": [f"{line}.returned_qty", 0]}]}
+
+
+def _returnable_expr(barcode: str) -> dict:
+    """Unidades que aún se pueden devolver de `barcode` (todas sus líneas)"""
+    return {"$sum": {"$map": {
+        "input": {"$filter": {"input": "$items", "as": "line", "cond": {"$eq": ["$$line.barcode", barcode]}}},
+        "as": "line",
+        "in": _available("$$line"),
+    }}}
+
+
+def _allocate_items(quantities: Dict[str, int]) -> dict:
+    """`items` con la devolución repartida entre las líneas de cada producto, en orden"""
+    requested = {"$switch": {
+        "branches": [{"case": {"$eq": ["$$line.barcode", barcode]}, "then": quantity}
+                     for barcode, quantity in quantities.items()],
+        "default": 0,
+    }}
+    return {"$map": {
+        "input": {"$range": [0, {"$size": "$items"}]},
+        "as": "index",
+        "in": {"$let": {
+            "vars": {"line": {"$arrayElemAt": ["$items", "$$index"]}},
+            "in": {"$let": {
+                "vars": {
+                    # Units still owed after the earlier lines of the same product
+                    "left": {"$subtract": [requested, {"$sum": {"$map": {
+                        "input": {"$filter": {
+                            "input": {"$slice": ["$items", "$$index"]},
+                            "as": "prior",
+                            "cond": {"$eq": ["$$prior.barcode", "$$line.barcode"]},
+                        }},
+                        "as": "prior",
+                        "in": _available("$$prior"),
+                    }}}]},
+                },
+                "in": {"$mergeObjects": ["$$line", {"returned_qty": {"$add": [
+                    {"$ifNull": ["$$line.returned_qty", 0]},
+                    {"$max": [0, {"$min": [_available("$$line"), "$$left"]}]},
+                ]}}]},
+            }},
+        }},
+    }}
+
+
+async def apply_return(db: AsyncIOMotorDatabase, invoice_number: str, quantities: Dict[str, int],
+                       total_return: Decimal, session=None) -> bool:
+    """
+    Registrar en la factura una devolución de {barcode: unidades}
+
+    Devuelve False (sin modificar nada) si la factura no existe o si algún
+    producto no tiene unidades suficientes por devolver. `session` permite
+    hacerlo dentro de una transacción junto con el documento de devolución.
+    """
+    por_cobrar = {"$eq": ["$payment_status", "por_cobrar"]}
+    settled = {"$and": [por_cobrar, {"$lte": [{"$subtract": ["$new_total", "$paid"]}, 0]}]}
+    result = await db.invoices.update_one(
+        {
+            "invoice_number": invoice_number,
+            "$expr": {"$and": [{"$gte": [_returnable_expr(barcode), quantity]}
+                               for barcode, quantity in quantities.items()]},
+        },
+        [
+            {"$set": {
+                "items": _allocate_items(quantities),
+                "new_total": {"$subtract": ["$total", total_return]},
+                "paid": {"$ifNull": ["$amount_paid", ZERO]},
+            }},
+            {"$set": {
+                "status": {"$cond": [{"$lte": ["$new_total", 0]}, "returned", "partial_return"]},
+                "total": {"$max": ["$new_total", ZERO]},
+                # Credit invoices: balance is what remains of the new total after abonos
+                "balance": {"$cond": [
+                    settled, ZERO,
+                    {"$cond": [por_cobrar, {"$subtract": ["$new_total", "$paid"]}, "$balance"]},
+                ]},
+                "amount_paid": {"$cond": [
+                    {"$and": [settled, {"$gt": ["$paid", "$new_total"]}]},
+                    {"$max": ["$new_total", ZERO]},
+                    "$amount_paid",
+                ]},
+                "payment_status": {"$cond": [settled, "pagado", "$payment_status"]},
+            }},
+            {"$unset": ["new_total", "paid"]},
+        ],
+        session=session,
+    )
+    return result.matched_count == 1
+
+
+def returnable_lines(invoice: dict) -> List[dict]:
+    """Vendido, devuelto y disponible por producto (en el orden de la factura)"""
+    lines = {}
+    for item in invoice.get("items", []):
+        line = lines.setdefault(item["barcode"], {
+            "barcode": item["barcode"],
+            "product_name": item["product_name"],
+            "unit_price": item["unit_price"],
+            "quantity": 0,
+            "returned_qty": 0,
+        })
+        line["quantity"] += item["quantity"]
+        line["returned_qty"] += item.get("returned_qty", 0)
+    for line in lines.values():
+        line["returnable"] = line["quantity"] - line["returned_qty"]
+    return list(lines.values())
+
+
+def _allocate(items: List[dict], returned: Dict[str, int]) -> List[dict]:
+    left = dict(returned)
+    allocated = []
+    for item in items:
+        quantity = max(0, min(item["quantity"], left.get(item["barcode"], 0)))
+        left[item["barcode"]] = left.get(item["barcode"], 0) - quantity
+        allocated.append({**item, "returned_qty": quantity})
+    return allocated
+
+
+async def migrate_returned_qty(db: AsyncIOMotorDatabase, batch_size: int = MIGRATION_BATCH,
+                               dry_run: bool = False) -> dict:
+    """Calcular `returned_qty` de las facturas existentes (ver migrations.run_migration)"""
+    returned: Dict[str, Dict[str, int]] = {}
+    async for row in db.returns.aggregate([
+        {"$unwind": "$items"},
+        {"$group": {"_id": {"invoice": "$invoice_number", "barcode": "$items.barcode"},
+                    "quantity": {"$sum": "$items.quantity"}}},
+    ]):
+        returned.setdefault(row["_id"]["invoice"], {})[row["_id"]["barcode"]] = row["quantity"]
+
+    def convert(doc):
+        return {"items": _allocate(doc["items"], returned.get(doc["invoice_number"], {})), "returns_migrated": True}
+
+    steps = {"invoices": MigrationStep(
+        pending={"returns_migrated": {"$ne": True}},
+        projection={"invoice_number": 1, "items": 1},
+        convert=convert,
+    )}
+    return await run_migration(db, MIGRATION_ID, steps, batch_size, dry_run)
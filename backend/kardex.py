@@ -0,0 +1,199 @@
+"""
+Kardex (tarjeta de existencias) por producto
+
+Para cada producto: saldo inicial al comienzo del periodo (foto de stock más
+movimientos, ver stock_snapshots), cada movimiento del periodo con su saldo
+acumulado y el saldo final. Los movimientos se leen con un cursor ordenado
+por (barcode, created_at, _id) y el saldo se calcula al pasar, sin cargar el
+periodo en memoria.
+
+Formatos: JSON (un arreglo que se va escribiendo) y NDJSON salen como flujo
+mientras se leen los movimientos. XLSX no: un libro es un zip que solo se
+puede cerrar al final, así que openpyxl (modo write-only, en un hilo por
+lotes) escribe las filas a disco y la respuesta empieza cuando el archivo
+está completo; la memoria no crece con las filas, pero el primer byte llega
+después de recorrer todo el periodo.
+
+Requiere las fechas nativas (scripts/migrate.py dates): con fechas en texto
+el orden por created_at pondría los movimientos antiguos antes que los
+nuevos sin importar la fecha.
+"""
+import asyncio
+import tempfile
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from zoneinfo import ZoneInfo
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from openpyxl import Workbook
+from pydantic_core import to_json
+from list_query import NDJSON_MEDIA_TYPE
+from stock_snapshots import stock_at
+from timestamps import instant_range_query, legacy_reads, to_datetime, REPORT_TIMEZONE
+
+KARDEX_BATCH = 1000
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+XLSX_MAX_ROWS = 1_048_575  # Excel sheet limit minus the header row
+XLSX_COLUMNS = ["Código", "Producto", "Fecha", "Tipo", "Referencia", "Entrada", "Salida", "Saldo"]
+
+
+async def _next(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+def require_native_dates():
+    """409 mientras haya fechas en texto: el kardex recorre los movimientos por fecha"""
+    if legacy_reads():
+        raise HTTPException(
+            status_code=409,
+            detail="Convierta primero las fechas (scripts/migrate.py dates): el kardex recorre el historial por fecha"
+        )
+
+
+async def kardex_rows(
+    db: AsyncIOMotorDatabase,
+    barcodes: Optional[List[str]],
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> AsyncIterator[dict]:
+    """
+    Filas del kardex de `barcodes` (todos los productos si es None) en [start, end)
+
+    Cada producto abre con una fila `opening` y cierra con una `closing`.
+    """
+    single = barcodes[0] if barcodes and len(barcodes) == 1 else None
+    opening: Dict[str, int] = {}
+    if start:
+        _, opening = await stock_at(db, start, single)
+
+    product_query = {"barcode": {"$in": barcodes}} if barcodes is not None else {}
+    names = {
+        product["barcode"]: product.get("name")
+        async for product in db.products.find(product_query, {"_id": 0, "barcode": 1, "name": 1})
+    }
+    targets = set(barcodes) if barcodes is not None else set(names) | {code for code, units in opening.items() if units}
+    targets = deque(sorted(targets))
+
+    query = instant_range_query("created_at", start, end)
+    if barcodes is not None:
+        query["barcode"] = {"$in": barcodes}
+    movements = db.inventory_movements.find(query, {"_id": 0}) \
+        .sort([("barcode", 1), ("created_at", 1), ("_id", 1)]).batch_size(KARDEX_BATCH).__aiter__()
+    movement = await _next(movements)
+
+    while targets or movement:
+        # Movements of products no longer in the catalog get their own section
+        if movement and (not targets or movement["barcode"] < targets[0]):
+            barcode = movement["barcode"]
+        else:
+            barcode = targets.popleft()
+        if targets and targets[0] == barcode:
+            targets.popleft()
+
+        # A deleted product with only an opening balance has no movement of its own here
+        own = movement if movement and movement["barcode"] == barcode else {}
+        name = names.get(barcode) or own.get("product_name")
+        balance = opening.get(barcode, 0)
+        yield _row(barcode, name, start, "opening", None, 0, balance)
+        while movement and movement["barcode"] == barcode:
+            quantity = movement["quantity"]
+            balance += quantity
+            yield _row(barcode, name, to_datetime(movement["created_at"]), movement["movement_type"],
+                       movement.get("reference"), quantity, balance)
+            movement = await _next(movements)
+        yield _row(barcode, name, end, "closing", None, 0, balance)
+
+
+def _row(barcode, name, date, movement_type, reference, quantity, balance) -> dict:
+    return {
+        "barcode": barcode,
+        "product_name": name,
+        "date": date,
+        "movement_type": movement_type,
+        "reference": reference,
+        "quantity_in": max(quantity, 0),
+        "quantity_out": max(-quantity, 0),
+        "balance": balance,
+    }
+
+
+def stream_json(rows: AsyncIterator[dict], ndjson: bool = False) -> StreamingResponse:
+    """Filas como un arreglo JSON (o NDJSON) escrito por lotes"""
+    async def body():
+        chunk = []
+        first = True
+        async for row in rows:
+            chunk.append(to_json(row))
+            if len(chunk) == KARDEX_BATCH:
+                yield _join(chunk, first, ndjson)
+                chunk = []
+                first = False
+        yield _join(chunk, first, ndjson) + (b"" if ndjson else b"]")
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE if ndjson else "application/json")
+
+
+def _join(chunk: List[bytes], first: bool, ndjson: bool) -> bytes:
+    if ndjson:
+        return b"".join(line + b"\n" for line in chunk)
+    if not chunk:
+        return b"[" if first else b""
+    return (b"[" if first else b",") + b",".join(chunk)
+
+
+def _local(date: Optional[datetime]) -> Optional[datetime]:
+    # Excel has no time zones: write local report time
+    return date.astimezone(ZoneInfo(REPORT_TIMEZONE)).replace(tzinfo=None) if date else None
+
+
+def _xlsx_values(row: dict) -> list:
+    return [row["barcode"], row["product_name"], _local(row["date"]), row["movement_type"], row["reference"],
+            row["quantity_in"], row["quantity_out"], row["balance"]]
+
+
+async def stream_xlsx(rows: AsyncIterator[dict], filename: str) -> StreamingResponse:
+    """Escribir las filas en un libro XLSX en disco (fuera del event loop) y enviarlo al terminar"""
+    workbook = Workbook(write_only=True)
+    sheets = []
+
+    def append(batch: Iterable[dict]):
+        for row in batch:
+            if not sheets or sheets[-1][1] == XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Kardex {len(sheets) + 1}")
+                sheet.append(XLSX_COLUMNS)
+                sheets.append([sheet, 0])
+            sheets[-1][0].append(_xlsx_values(row))
+            sheets[-1][1] += 1
+
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) == KARDEX_BATCH:
+            await asyncio.to_thread(append, batch)
+            batch = []
+    await asyncio.to_thread(append, batch)
+    if not sheets:
+        workbook.create_sheet("Kardex 1").append(XLSX_COLUMNS)
+
+    output = tempfile.TemporaryFile()
+    await asyncio.to_thread(workbook.save, output)
+    output.seek(0)
+
+    async def body():
+        try:
+            while True:
+                data = await asyncio.to_thread(output.read, 64 * 1024)
+                if not data:
+                    break
+                yield data
+        finally:
+            output.close()
+
+    return StreamingResponse(body(), media_type=XLSX_MEDIA_TYPE, headers={
+        "Content-Disposition": f"attachment; filename={filename}"
+    })
@@ -0,0 +1,246 @@
+"""
+Paginación por cursor y selección de campos para los listados de la API
+
+Todos los listados aceptan los mismos parámetros:
+
+- limit: máximo de documentos por página
+- cursor: valor de la cabecera X-Next-Cursor de la página anterior
+- fields: campos separados por comas (p. ej. fields=invoice_number,total);
+  se convierten en una proyección de Mongo y la respuesta se valida con un
+  modelo que solo contiene esos campos
+
+El cuerpo sigue siendo una lista JSON; si hay más resultados la respuesta
+incluye X-Next-Cursor. El cursor guarda los valores de ordenación del último
+documento (más `_id` como desempate), así cada página es un rango del índice
+en lugar de un skip.
+
+Con `Accept: application/x-ndjson` el rango completo (o hasta `limit`, si se
+indica) se envía como un documento JSON por línea directamente desde el cursor
+de Mongo, sin validación pydantic y con memoria constante.
+"""
+import base64
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+from bson import json_util
+from bson.errors import InvalidBSON
+from fastapi import HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, TypeAdapter, create_model
+from pydantic_core import to_json
+from timestamps import legacy_reads
+from money import money_as_float, MONEY_FIELDS
+
+LIST_MAX_LIMIT = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Documents per chunk written to the socket when streaming
+NDJSON_CHUNK = 500
+
+ASCENDING = 1
+DESCENDING = -1
+
+# Sort order of each paginated collection; `_id` is appended as tie-breaker
+LIST_SORTS = {
+    "products": [("barcode", ASCENDING)],
+    "clients": [("document_number", ASCENDING)],
+    "invoices": [("created_at", DESCENDING)],
+    "returns": [("created_at", DESCENDING)],
+    "purchases": [("created_at", DESCENDING)],
+    "supplier_returns": [("created_at", DESCENDING)],
+    "inventory_movements": [("created_at", DESCENDING)],
+    "stock_levels": [("barcode", ASCENDING)],
+    "stock_drift": [("barcode", ASCENDING)],
+    "stock_transfers": [("created_at", DESCENDING)],
+    "users_extended": [("email", ASCENDING)],
+}
+
+
+class ListParams:
+    """Parámetros comunes de los listados (usar con Depends)"""
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=LIST_MAX_LIMIT),
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+    ):
+        self.limit = limit
+        self.cursor = cursor
+        self.fields = fields
+
+    @property
+    def page_limit(self) -> int:
+        return self.limit or LIST_MAX_LIMIT
+
+
+def _index_keys(sort) -> List[Tuple[str, int]]:
+    return list(sort) + [("_id", sort[-1][1])]
+
+
+async def setup_list_indexes(db):
+    """Índices que cubren el orden de cada listado paginado"""
+    for collection, sort in LIST_SORTS.items():
+        await db[collection].create_index(_index_keys(sort))
+    # Kardex-style filter: movements of one product, newest first
+    await db.inventory_movements.create_index([("barcode", ASCENDING)] + _index_keys(LIST_SORTS["inventory_movements"]))
+
+
+def parse_fields(model, fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Validar `fields` contra el modelo; None si no se pidió selección"""
+    if not fields:
+        return None
+    requested = tuple(sorted({f.strip() for f in fields.split(",") if f.strip()}))
+    unknown = [f for f in requested if f not in model.model_fields]
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos no válidos: {', '.join(unknown)}. Disponibles: {', '.join(model.model_fields)}"
+        )
+    return requested
+
+
+@lru_cache(maxsize=256)
+def _list_adapter(model, fields: Optional[Tuple[str, ...]]) -> TypeAdapter:
+    if fields is not None:
+        model = create_model(
+            f"{model.__name__}Fields",
+            __config__=ConfigDict(extra="ignore"),
+            **{name: (model.model_fields[name].annotation, model.model_fields[name]) for name in fields}
+        )
+    return TypeAdapter(List[model])
+
+
+def render_list(model, docs, fields: Optional[Tuple[str, ...]], next_cursor: Optional[str] = None) -> Response:
+    """Validar y serializar un listado (solo los campos seleccionados)"""
+    adapter = _list_adapter(model, fields)
+    body = adapter.dump_json(adapter.validate_python(docs))
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def encode_cursor(doc, sort) -> str:
+    values = [doc.get(field) for field, _ in sort] + [doc["_id"]]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort) -> list:
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, InvalidBSON):
+        values = None
+    if not isinstance(values, list) or len(values) != len(sort) + 1:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return values
+
+
+def cursor_query(values, sort) -> dict:
+    """Documentos estrictamente posteriores al cursor en el orden dado"""
+    keys = _index_keys(sort)
+    branches = []
+    for i, (field, direction) in enumerate(keys):
+        branch = {keys[j][0]: values[j] for j in range(i)}
+        branch[field] = {"$gt" if direction == ASCENDING else "$lt": values[i]}
+        branches.append(branch)
+    # During the date migration text dates sort below every native date, so
+    # they still follow a date cursor in descending order
+    first_field, first_direction = keys[0]
+    if legacy_reads() and isinstance(values[0], datetime) and first_direction == DESCENDING:
+        branches.append({first_field: {"$type": "string"}})
+    return {"$or": branches}
+
+
+async def paginate(
+    collection,
+    query: dict,
+    model,
+    params: ListParams,
+    exclude: Sequence[str] = (),
+) -> Response:
+    """
+    Leer una página de `collection` en el orden de LIST_SORTS
+
+    exclude: campos internos que nunca se envían (p. ej. hashed_password)
+    """
+    sort = LIST_SORTS[collection.name]
+    fields = parse_fields(model, params.fields)
+    limit = params.page_limit
+
+    docs = await collection.find(
+        _list_query(query, params, sort), _list_projection(fields, sort, exclude)
+    ).sort(_index_keys(sort)).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1], sort)
+
+    return render_list(model, docs, fields, next_cursor)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def stream_ndjson(
+    collection,
+    query: dict,
+    model,
+    params: ListParams,
+    exclude: Sequence[str] = (),
+) -> StreamingResponse:
+    """
+    Enviar los documentos como NDJSON en el orden de LIST_SORTS
+
+    Los valores se escriben tal como están guardados (fechas incluidas), pero
+    solo los campos del modelo (o los de `fields`), como en el listado
+    normal: un campo interno nuevo nunca se envía por olvido. `exclude`
+    quita además campos internos que el modelo sí declara.
+    """
+    sort = LIST_SORTS[collection.name]
+    fields = parse_fields(model, params.fields) or tuple(model.model_fields)
+    fields = tuple(field for field in fields if field not in exclude)
+    if not fields:
+        raise HTTPException(status_code=400, detail=f"Campos no válidos: {params.fields}")
+    projection = _list_projection(fields, sort, exclude, with_id=False)
+    cursor = collection.find(_list_query(query, params, sort), projection) \
+        .sort(_index_keys(sort)).batch_size(NDJSON_CHUNK)
+    if params.limit:
+        cursor = cursor.limit(params.limit)
+    # to_json writes Decimal as a string; amounts stay JSON numbers as in list mode
+    money_collection = collection.name in MONEY_FIELDS
+
+    async def lines():
+        chunk = []
+        async for doc in cursor:
+            if money_collection:
+                money_as_float(doc, collection.name)
+            chunk.append(to_json(doc, fallback=str))
+            if len(chunk) == NDJSON_CHUNK:
+                yield b"\n".join(chunk) + b"\n"
+                chunk = []
+        if chunk:
+            yield b"\n".join(chunk) + b"\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def _list_query(query, params: ListParams, sort) -> dict:
+    if params.cursor:
+        return {"$and": [query, cursor_query(decode_cursor(params.cursor, sort), sort)]}
+    return query
+
+
+def _list_projection(fields, sort, exclude, with_id=True) -> Optional[dict]:
+    if fields is not None:
+        # Sort keys are needed to build the next cursor
+        projection = {field: 1 for field in fields}
+        if with_id:
+            projection.update({field: 1 for field, _ in sort})
+        else:
+            projection["_id"] = 0
+        return projection
+    projection = {field: 0 for field in exclude}
+    if not with_id:
+        projection["_id"] = 0
+    return projection or None
@@ -0,0 +1,68 @@
+"""
+Productos bajo su stock mínimo
+
+Cada producto tiene `min_stock` (por defecto LOW_STOCK_THRESHOLD, el antiguo
+límite fijo de 10) y `reorder_qty`, la cantidad que se suele pedir. El
+conjunto de productos bajo mínimo se mantiene en memoria a partir del
+índice de códigos de barras: toda escritura de stock (ventas, devoluciones,
+compras, sincronización del POS) ya recarga ahí los productos que tocó, y el
+refresco periódico trae los cambios de otros procesos. Consultarlo no toca
+Mongo.
+"""
+import os
+from typing import Dict, Iterable, List, Optional
+
+LOW_STOCK_THRESHOLD = int(os.environ.get("LOW_STOCK_THRESHOLD", 10))
+
+
+def min_stock(product: dict) -> int:
+    value = product.get("min_stock")
+    return LOW_STOCK_THRESHOLD if value is None else value
+
+
+def is_low(product: dict) -> bool:
+    return product.get("stock", 0) < min_stock(product)
+
+
+class LowStockSet:
+    """Productos con stock < min_stock, por código de barras"""
+
+    def __init__(self):
+        self._products: Dict[str, dict] = {}
+
+    def __len__(self):
+        return len(self._products)
+
+    def reset(self, products: Iterable[dict]):
+        self._products = {product["barcode"]: _entry(product) for product in products if is_low(product)}
+
+    def update(self, product: dict):
+        if is_low(product):
+            self._products[product["barcode"]] = _entry(product)
+        else:
+            self._products.pop(product["barcode"], None)
+
+    def discard(self, barcode: str):
+        self._products.pop(barcode, None)
+
+    def items(self, category: Optional[str] = None) -> List[dict]:
+        """Productos bajo mínimo, los de mayor faltante primero"""
+        products = [p for p in self._products.values() if category is None or p["category"] == category]
+        return sorted(products, key=lambda p: (-p["shortage"], p["barcode"]))
+
+
+def _entry(product: dict) -> dict:
+    minimum = min_stock(product)
+    stock = product.get("stock", 0)
+    reorder_qty = product.get("reorder_qty") or 0
+    return {
+        "barcode": product["barcode"],
+        "name": product.get("name"),
+        "category": product.get("category"),
+        "stock": stock,
+        "min_stock": minimum,
+        "reorder_qty": reorder_qty,
+        "shortage": minimum - stock,
+        # Order the usual quantity, or at least enough to reach the minimum
+        "suggested_qty": max(reorder_qty, minimum - stock),
+    }
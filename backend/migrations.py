@@ -0,0 +1,90 @@
+"""
+Migraciones de datos en línea, por lotes y reanudables
+
+Cada migración recorre sus colecciones por `_id` y guarda el último `_id`
+procesado en la colección `migrations`, así una ejecución interrumpida
+continúa donde quedó. Las actualizaciones incluyen los valores originales
+en el filtro para no pisar una escritura concurrente.
+"""
+from datetime import datetime, timezone
+from typing import Callable, Dict, NamedTuple, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+MIGRATION_BATCH = 1000
+
+
+class MigrationStep(NamedTuple):
+    """
+    Conversión de una colección
+
+    pending: filtro de los documentos que aún no están convertidos
+    projection: campos que necesita `convert`
+    convert: documento -> {campo: valor nuevo} (vacío si no hay cambios)
+    """
+    pending: dict
+    projection: dict
+    convert: Callable[[dict], dict]
+
+
+async def migration_completed(db: AsyncIOMotorDatabase, migration_id: str) -> bool:
+    state = await db.migrations.find_one({"_id": migration_id}, {"completed_at": 1})
+    return bool(state and state.get("completed_at"))
+
+
+async def run_migration(
+    db: AsyncIOMotorDatabase,
+    migration_id: str,
+    steps: Dict[str, MigrationStep],
+    batch_size: int = MIGRATION_BATCH,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """
+    Aplicar `steps` (colección -> paso) y devolver los documentos convertidos
+
+    Al terminar una pasada completa sin pendientes se marca `completed_at`;
+    si quedan pendientes (escritos durante la ejecución por servidores con
+    el código anterior) la siguiente ejecución vuelve a empezar.
+    """
+    state = await db.migrations.find_one({"_id": migration_id}) or {}
+    converted = {}
+
+    for collection, step in steps.items():
+        last_id = state.get("progress", {}).get(collection)
+        converted[collection] = 0
+
+        while True:
+            query = {**step.pending, "_id": {"$gt": last_id}} if last_id is not None else step.pending
+            docs = await db[collection].find(query, step.projection) \
+                .sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+
+            updates = []
+            for doc in docs:
+                changes = step.convert(doc)
+                if changes:
+                    original = {field: doc.get(field) for field in changes}
+                    updates.append(UpdateOne({"_id": doc["_id"], **original}, {"$set": changes}))
+
+            if updates and not dry_run:
+                await db[collection].bulk_write(updates, ordered=False)
+            converted[collection] += len(updates)
+            last_id = docs[-1]["_id"]
+
+            if not dry_run:
+                await db.migrations.update_one(
+                    {"_id": migration_id},
+                    {"$set": {f"progress.{collection}": last_id}},
+                    upsert=True
+                )
+
+    if not dry_run:
+        remaining = 0
+        for collection, step in steps.items():
+            remaining += await db[collection].count_documents(step.pending)
+        update = {"$unset": {"progress": ""}}
+        if remaining == 0:
+            update["$set"] = {"completed_at": datetime.now(timezone.utc)}
+        await db.migrations.update_one({"_id": migration_id}, update, upsert=True)
+    return converted
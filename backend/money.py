@@ -0,0 +1,119 @@
+"""
+Importes exactos: Decimal en Python y Decimal128 en Mongo
+
+Las facturas, devoluciones, compras y abonos guardaban sus importes como
+float, con lo que las sumas acumulaban errores de redondeo. Ahora cada
+importe se redondea a centavos con `to_money` al entrar y se guarda como
+Decimal128; el codec del cliente de Mongo lo devuelve como Decimal, así que
+sumas y comparaciones (p. ej. saldo <= 0) son exactas. La API sigue
+respondiendo números JSON.
+
+`migrate_money` convierte los documentos existentes. Mientras tanto
+`to_money` también acepta los float antiguos.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterable
+from bson.codec_options import TypeCodec, TypeRegistry
+from bson.decimal128 import Decimal128
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from migrations import MigrationStep, run_migration, MIGRATION_BATCH
+
+CENT = Decimal("0.01")
+ZERO = Decimal("0.00")
+
+MIGRATION_ID = "decimal_money"
+
+# Amount fields per collection: top level and inside each of `items`
+MONEY_FIELDS = {
+    "invoices": (["subtotal", "total_tax", "total", "amount_paid", "balance"],
+                 ["unit_price", "subtotal", "tax_amount", "total"]),
+    "returns": (["total"], ["unit_price", "total"]),
+    "purchases": (["total"], ["unit_cost", "total"]),
+    "supplier_returns": (["total"], ["unit_cost", "total"]),
+    "fio_payments": (["amount"], []),
+}
+
+
+class DecimalCodec(TypeCodec):
+    """Decimal <-> Decimal128 al leer y escribir en Mongo"""
+    python_type = Decimal
+    bson_type = Decimal128
+
+    def transform_python(self, value):
+        return Decimal128(value)
+
+    def transform_bson(self, value):
+        return value.to_decimal()
+
+
+MONEY_TYPE_REGISTRY = TypeRegistry([DecimalCodec()])
+
+
+def to_money(value) -> Decimal:
+    """Importe (float, int, texto o Decimal) redondeado a centavos"""
+    if value is None:
+        return ZERO
+    if not isinstance(value, Decimal):
+        # str() keeps the shortest repr: 0.1 + 0.2 -> '0.30000000000000004' -> 0.30
+        value = Decimal(str(value))
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def money_sum(values: Iterable) -> Decimal:
+    return sum((to_money(value) for value in values), ZERO)
+
+
+def money_fields(doc: dict, collection: str) -> dict:
+    """Copia de `doc` con sus importes (e `items`) como Decimal"""
+    fields, item_fields = MONEY_FIELDS[collection]
+    doc = {**doc, **{field: to_money(doc[field]) for field in fields if field in doc}}
+    if item_fields and "items" in doc:
+        doc["items"] = [
+            {**item, **{field: to_money(item[field]) for field in item_fields if field in item}}
+            for item in doc["items"]
+        ]
+    return doc
+
+
+def money_as_float(doc: dict, collection: str) -> dict:
+    """Importes como float para codificadores JSON que escriben Decimal como texto"""
+    fields, item_fields = MONEY_FIELDS[collection]
+    for field in fields:
+        if isinstance(doc.get(field), Decimal):
+            doc[field] = float(doc[field])
+    for item in doc.get("items", ()) if item_fields else ():
+        for field in item_fields:
+            if isinstance(item.get(field), Decimal):
+                item[field] = float(item[field])
+    return doc
+
+
+def _pending(fields, item_fields) -> dict:
+    legacy = {"$type": ["double", "int", "long"]}
+    return {"$or": [{field: legacy} for field in fields] + [{f"items.{field}": legacy} for field in item_fields]}
+
+
+def _convert_money(collection):
+    fields, item_fields = MONEY_FIELDS[collection]
+
+    def convert(doc):
+        converted = money_fields(doc, collection)
+        return {
+            field: converted[field]
+            for field in fields + (["items"] if item_fields else [])
+            if field in doc and (field == "items" or not isinstance(doc[field], Decimal))
+        }
+    return convert
+
+
+async def migrate_money(db: AsyncIOMotorDatabase, batch_size: int = MIGRATION_BATCH, dry_run: bool = False) -> dict:
+    """Convertir los importes float a Decimal128 (ver migrations.run_migration)"""
+    steps = {
+        collection: MigrationStep(
+            pending=_pending(fields, item_fields),
+            projection={field: 1 for field in fields + (["items"] if item_fields else [])},
+            convert=_convert_money(collection),
+        )
+        for collection, (fields, item_fields) in MONEY_FIELDS.items()
+    }
+    return await run_migration(db, MIGRATION_ID, steps, batch_size, dry_run)
@@ -0,0 +1,280 @@
+"""
+Sincronización de ventas hechas sin conexión en el POS
+
+Cada venta trae un `client_sale_id` generado por el terminal. El lote se
+valida con una consulta por colección (clientes, formas de pago y
+productos), los números de factura salen de una sola reserva del contador
+y facturas, stock y movimientos se escriben con operaciones masivas.
+
+Reintentar es seguro: un índice único sobre `client_sale_id` hace que la
+inserción de la factura decida qué ventas son nuevas, y solo esas mueven
+stock. Las ventas ya sincronizadas se informan como `duplicate` con su
+número de factura.
+
+Las facturas se guardan con `stock_applied: false` y reclamadas por la
+petición que las insertó; el flag se marca después de descontar stock,
+niveles, capas y escribir los movimientos. Si el proceso muere entre los
+dos pasos, la siguiente sincronización (de cualquier terminal) reclama las
+facturas cuyo reclamo venció (STOCK_APPLY_LEASE) y aplica su stock. Sin
+transacciones, una caída a mitad del paso de stock puede aplicar parte dos
+veces; la conciliación diaria lo reporta.
+
+Los movimientos llevan la hora en que se escriben, no la de venta
+(`created_at` de la factura) ni la de sincronización: las fotos diarias de
+stock no se reescriben, y un movimiento fechado en un día ya cerrado (una
+venta antigua, o una factura reclamada días después de una caída) no
+entraría en ellas. Los campos del reclamo (INVOICE_INTERNAL_FIELDS) no se
+envían al leer facturas.
+
+Las ventas ya ocurrieron en la tienda, así que descuentan el stock aunque
+esté activo STRICT_STOCK.
+"""
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from catalog_sync import sync_stamp
+from cost_layers import consume_layers
+from stock_levels import DEFAULT_LOCATION, adjust_levels, unknown_locations
+from money import money_fields, money_sum, ZERO
+from sequences import INVOICE_SEQUENCE, format_invoice_number, reserve_numbers
+from stock import basket_quantities
+
+DUPLICATE_KEY = 11000
+# A sync that claimed invoices and has not applied their stock after this long is presumed dead
+STOCK_APPLY_LEASE = timedelta(minutes=10)
+# Bookkeeping kept on invoices (stock claim, returned_qty migration); never sent to clients
+INVOICE_INTERNAL_FIELDS = ["stock_applied", "stock_claim", "stock_claim_at", "returns_migrated"]
+INVOICE_PROJECTION = {"_id": 0, **{field: 0 for field in INVOICE_INTERNAL_FIELDS}}
+
+
+async def setup_pos_sync(db: AsyncIOMotorDatabase):
+    await db.invoices.create_index(
+        "client_sale_id", unique=True, partialFilterExpression={"client_sale_id": {"$type": "string"}}
+    )
+    # Only synced invoices whose stock is still pending
+    await db.invoices.create_index(
+        [("stock_claim_at", 1)], partialFilterExpression={"stock_applied": False}
+    )
+
+
+async def _prefetch(db: AsyncIOMotorDatabase, sales: List[dict]):
+    documents = {sale["client_document"] for sale in sales}
+    methods = {sale["payment_method"] for sale in sales if sale.get("payment_method")}
+    barcodes = {item["barcode"] for sale in sales for item in sale["items"]}
+    locations = {sale.get("location") or DEFAULT_LOCATION for sale in sales}
+
+    clients = {
+        client["document_number"]: f"{client['first_name']} {client['last_name']}"
+        async for client in db.clients.find(
+            {"document_number": {"$in": list(documents)}},
+            {"_id": 0, "document_number": 1, "first_name": 1, "last_name": 1}
+        )
+    }
+    active_methods = {
+        method["name"]
+        async for method in db.payment_methods.find({"name": {"$in": list(methods)}, "is_active": True}, {"_id": 0, "name": 1})
+    }
+    known_barcodes = {
+        product["barcode"]
+        async for product in db.products.find({"barcode": {"$in": list(barcodes)}}, {"_id": 0, "barcode": 1})
+    }
+    unknown = set(await unknown_locations(db, locations))
+    return clients, active_methods, known_barcodes, unknown
+
+
+def _validate(sale: dict, clients: Dict[str, str], active_methods: set, known_barcodes: set, unknown_locations: set):
+    """Mensaje de error de la venta, o None si es válida"""
+    if sale["payment_status"] not in ["pagado", "por_cobrar"]:
+        return "Estado de pago inválido. Use 'pagado' o 'por_cobrar'"
+    if sale["payment_status"] == "pagado":
+        if not sale.get("payment_method"):
+            return "La forma de pago es obligatoria cuando el estado es 'pagado'"
+        if sale["payment_method"] not in active_methods:
+            return "La forma de pago seleccionada no existe o no está activa"
+    if sale["client_document"] not in clients:
+        return "Client not found"
+    if (sale.get("location") or DEFAULT_LOCATION) in unknown_locations:
+        return f"Ubicación no encontrada: {sale['location']}"
+    missing = sorted({item["barcode"] for item in sale["items"]} - known_barcodes)
+    if missing:
+        return f"Productos no encontrados: {', '.join(missing)}"
+    return None
+
+
+def _invoice(sale: dict, invoice_number: str, client_name: str, created_by: str, synced_at: datetime) -> dict:
+    items = [{**money_fields(item, "invoices"), "returned_qty": 0} for item in sale["items"]]
+    total = money_sum(item["total"] for item in items)
+    paid = sale["payment_status"] == "pagado"
+    sold_at = sale.get("sold_at")
+    if sold_at and not sold_at.tzinfo:
+        sold_at = sold_at.replace(tzinfo=timezone.utc)
+    return {
+        "invoice_number": invoice_number,
+        "client_sale_id": sale["client_sale_id"],
+        "client_document": sale["client_document"],
+        "client_name": client_name,
+        "items": items,
+        "returns_migrated": True,
+        "subtotal": money_sum(item["subtotal"] for item in items),
+        "total_tax": money_sum(item["tax_amount"] for item in items),
+        "total": total,
+        "created_by": created_by,
+        "created_at": sold_at or synced_at,
+        "synced_at": synced_at,
+        "status": "completed",
+        "payment_status": sale["payment_status"],
+        "payment_method": sale["payment_method"] if paid else None,
+        "amount_paid": total if paid else ZERO,
+        "balance": ZERO if paid else total,
+        "location": sale.get("location") or DEFAULT_LOCATION,
+        "stock_applied": False,
+    }
+
+
+async def sync_sales(db: AsyncIOMotorDatabase, sales: List[dict], created_by: str) -> List[dict]:
+    """
+    Registrar un lote de ventas offline
+
+    Devuelve un resultado por venta, en el mismo orden:
+    {client_sale_id, status: created | duplicate | error, invoice_number | detail}
+    """
+    ids = [sale["client_sale_id"] for sale in sales]
+    synced = {
+        invoice["client_sale_id"]: invoice["invoice_number"]
+        async for invoice in db.invoices.find(
+            {"client_sale_id": {"$in": ids}}, {"_id": 0, "client_sale_id": 1, "invoice_number": 1}
+        )
+    }
+    clients, active_methods, known_barcodes, unknown = await _prefetch(db, sales)
+
+    results = []
+    valid = []
+    seen = set()
+    errors = {}
+    for sale in sales:
+        sale_id = sale["client_sale_id"]
+        result = {"client_sale_id": sale_id}
+        results.append(result)
+        if sale_id in synced or sale_id in seen:
+            # Repeated inside the batch: same outcome as its first copy
+            if sale_id in errors:
+                result.update(status="error", detail=errors[sale_id])
+            continue
+        seen.add(sale_id)
+        errors[sale_id] = _validate(sale, clients, active_methods, known_barcodes, unknown)
+        if errors[sale_id]:
+            result.update(status="error", detail=errors[sale_id])
+        else:
+            del errors[sale_id]
+            valid.append(sale)
+
+    invoices = []
+    synced_at = datetime.now(timezone.utc)
+    claim = uuid.uuid4().hex
+    if valid:
+        numbers = await reserve_numbers(db, INVOICE_SEQUENCE, len(valid))
+        invoices = [
+            {
+                **_invoice(sale, format_invoice_number(number), clients[sale["client_document"]], created_by, synced_at),
+                # Claimed from the start: no other sync applies their stock
+                "stock_claim": claim,
+                "stock_claim_at": synced_at,
+            }
+            for sale, number in zip(valid, numbers)
+        ]
+        try:
+            await db.invoices.insert_many(invoices, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+            # A concurrent retry of the same batch inserted these first
+            lost = {error["index"] for error in e.details["writeErrors"]}
+            invoices = [invoice for index, invoice in enumerate(invoices) if index not in lost]
+        # Numbers of sales lost to a concurrent retry stay unused
+
+    created = {invoice["client_sale_id"]: invoice for invoice in invoices}
+    await _apply_pending_stock(db, claim, synced_at, bool(invoices))
+
+    pending = [sale_id for sale_id in ids if sale_id not in synced and sale_id not in created]
+    if pending:
+        async for invoice in db.invoices.find(
+            {"client_sale_id": {"$in": pending}}, {"_id": 0, "client_sale_id": 1, "invoice_number": 1}
+        ):
+            synced[invoice["client_sale_id"]] = invoice["invoice_number"]
+
+    reported = set()
+    for result in results:
+        sale_id = result["client_sale_id"]
+        if result.get("status") == "error":
+            continue
+        if sale_id in created and sale_id not in reported:
+            result.update(status="created", invoice_number=created[sale_id]["invoice_number"])
+            reported.add(sale_id)
+        else:
+            invoice_number = created[sale_id]["invoice_number"] if sale_id in created else synced[sale_id]
+            result.update(status="duplicate", invoice_number=invoice_number)
+    return results
+
+
+async def _apply_pending_stock(db: AsyncIOMotorDatabase, claim: str, now: datetime, claimed: bool):
+    """
+    Aplicar el stock de las facturas reclamadas con `claim`
+
+    Antes reclama las de sincronizaciones que no terminaron (reclamo vencido).
+    """
+    result = await db.invoices.update_many(
+        {"stock_applied": False, "stock_claim_at": {"$lt": now - STOCK_APPLY_LEASE}},
+        {"$set": {"stock_claim": claim, "stock_claim_at": now}}
+    )
+    if not claimed and not result.modified_count:
+        return
+    invoices = await db.invoices.find(
+        {"stock_applied": False, "stock_claim": claim},
+        {"_id": 0, "invoice_number": 1, "items": 1, "location": 1, "created_by": 1}
+    ).to_list(None)
+    if not invoices:
+        return
+    await _apply_stock(db, invoices)
+    await db.invoices.update_many(
+        {"stock_applied": False, "stock_claim": claim},
+        {"$set": {"stock_applied": True}, "$unset": {"stock_claim": "", "stock_claim_at": ""}}
+    )
+
+
+async def _apply_stock(db: AsyncIOMotorDatabase, invoices: List[dict]):
+    """Descontar el stock (una actualización por producto) y registrar los movimientos"""
+    quantities: Dict[str, int] = {}
+    levels: Dict[tuple, int] = {}
+    for invoice in invoices:
+        for barcode, quantity in basket_quantities(invoice["items"]).items():
+            quantities[barcode] = quantities.get(barcode, 0) + quantity
+            key = (barcode, invoice["location"])
+            levels[key] = levels.get(key, 0) - quantity
+
+    version = sync_stamp()
+    await db.products.bulk_write([
+        UpdateOne({"barcode": barcode}, {"$inc": {"stock": -quantity}, "$set": {"sync_version": version}})
+        for barcode, quantity in quantities.items()
+    ], ordered=False)
+    await adjust_levels(db, levels)
+    await consume_layers(db, quantities)
+
+    written_at = datetime.now(timezone.utc)
+    await db.inventory_movements.insert_many([
+        {
+            "barcode": item["barcode"],
+            "product_name": item["product_name"],
+            "movement_type": "sale",
+            "quantity": -item["quantity"],
+            "reference": invoice["invoice_number"],
+            "location": invoice["location"],
+            "created_by": invoice["created_by"],
+            # Write time, not sale or sync time: closed days' snapshots are not rewritten
+            "created_at": written_at,
+        }
+        for invoice in invoices
+        for item in invoice["items"]
+    ], ordered=False)
@@ -0,0 +1,96 @@
+"""
+Búsqueda indexada de productos por nombre y código de barras
+
+Cada producto guarda `search_tokens` (palabras del nombre normalizadas:
+minúsculas y sin tildes), `name_norm` (el nombre completo normalizado) y
+`barcode_norm`. Las búsquedas usan expresiones anchadas al inicio
+(^prefijo) sobre esos campos indexados, que Mongo resuelve como un rango del
+índice en lugar de recorrer la colección.
+"""
+import re
+import unicodedata
+from typing import List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+BACKFILL_BATCH = 1000
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_text(text) -> str:
+    """Minúsculas, sin tildes y con separadores reducidos a un espacio"""
+    decomposed = unicodedata.normalize("NFKD", str(text or "").lower())
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", stripped).strip()
+
+
+def search_fields(barcode, name) -> dict:
+    """Campos de búsqueda a guardar junto al producto"""
+    return {
+        "search_tokens": sorted(set(normalize_text(name).split())),
+        "name_norm": normalize_text(name),
+        "barcode_norm": normalize_text(barcode).replace(" ", ""),
+    }
+
+
+async def setup_product_search(db: AsyncIOMotorDatabase):
+    """Crear índices y completar los campos de búsqueda de productos existentes"""
+    await db.products.create_index("barcode")
+    await db.products.create_index("barcode_norm")
+    await db.products.create_index("search_tokens")
+    await db.products.create_index("name_norm")
+
+    cursor = db.products.find({"name_norm": {"$exists": False}}, {"_id": 1, "barcode": 1, "name": 1})
+    batch = []
+    async for product in cursor:
+        batch.append(UpdateOne(
+            {"_id": product["_id"]},
+            {"$set": search_fields(product.get("barcode", ""), product.get("name", ""))}
+        ))
+        if len(batch) == BACKFILL_BATCH:
+            await db.products.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.products.bulk_write(batch, ordered=False)
+
+
+async def search_products(db: AsyncIOMotorDatabase, q: str, limit: int) -> List[dict]:
+    """
+    Buscar productos por prefijo de código o de palabras del nombre
+
+    Orden: código exacto, prefijo de código, nombre que empieza por la
+    búsqueda, resto de coincidencias por nombre (alfabético).
+    """
+    query_norm = normalize_text(q)
+    terms = query_norm.split()
+    if not terms:
+        return []
+
+    projection = {"_id": 0, "search_tokens": 0, "barcode_norm": 0, "name_norm": 0}
+    ranked = {}
+
+    def add(products, rank):
+        for product in products:
+            barcode = product["barcode"]
+            if barcode not in ranked or ranked[barcode][0] > rank:
+                ranked[barcode] = (rank, product)
+
+    exact = await db.products.find_one({"barcode": q.strip()}, projection)
+    if exact:
+        add([exact], 0)
+
+    barcode_prefix = "^" + re.escape(query_norm.replace(" ", ""))
+    add(await db.products.find({"barcode_norm": {"$regex": barcode_prefix}}, projection)
+        .limit(limit).to_list(limit), 1)
+
+    # Each rank gets its own query, sorted like the results: a limit applied
+    # in index order could drop names starting with the query
+    name_prefix = {"name_norm": {"$regex": "^" + re.escape(query_norm)}}
+    add(await db.products.find(name_prefix, projection).sort("name_norm", 1).limit(limit).to_list(limit), 2)
+
+    name_query = {"$and": [{"search_tokens": {"$regex": "^" + re.escape(term)}} for term in terms]}
+    add(await db.products.find(name_query, projection).sort("name_norm", 1).limit(limit).to_list(limit), 3)
+
+    results = sorted(ranked.values(), key=lambda r: (r[0], normalize_text(r[1].get("name"))))
+    return [product for _, product in results[:limit]]
@@ -0,0 +1,236 @@
+"""
+Sugerencias de compra según la velocidad de venta
+
+Para cada producto se calcula la venta diaria promedio y su desviación
+estándar en los últimos `days` días completos (zona REPORT_TIMEZONE), a
+partir de las ventas menos las devoluciones de `inventory_movements`. Mongo
+agrupa los movimientos por (producto, día) y el cursor resultante se
+convierte en una matriz productos x días con NumPy, así el cálculo no
+recorre los movimientos en Python.
+
+Con el tiempo de entrega del proveedor (`lead_time_days`, el de la última
+compra del producto) se obtiene:
+
+- punto de pedido = venta diaria x entrega + stock de seguridad
+  (z x desviación x raíz de la entrega), y nunca menos que `min_stock`
+- cantidad sugerida = lo necesario para cubrir entrega + periodo de revisión
+  (REORDER_REVIEW_DAYS) más el stock de seguridad, al menos `reorder_qty`
+
+Solo se sugieren productos bajo su punto de pedido, agrupados por proveedor.
+
+Los días cerrados no cambian (los movimientos se escriben con la hora
+actual), así que la velocidad se calcula una vez por día y ventana. Los
+productos (stock, mínimos) se mantienen en memoria como observador del
+índice de códigos de barras, igual que el conjunto de bajo mínimo, y el
+proveedor de cada producto solo se actualiza con las compras nuevas. El
+resultado completo se guarda hasta que cambia un producto, llega una compra
+o cambia el catálogo de proveedores; después de una venta solo se releen
+los tiempos de entrega (pocos proveedores) y se repite la parte en NumPy.
+"""
+import asyncio
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Iterable, Optional
+from zoneinfo import ZoneInfo
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from low_stock import min_stock
+from stock_snapshots import last_midnight
+from timestamps import date_expr, instant_range_query, REPORT_TIMEZONE
+
+SUGGESTION_WINDOW_DAYS = int(os.environ.get("SUGGESTION_WINDOW_DAYS", 30))
+DEFAULT_LEAD_TIME_DAYS = int(os.environ.get("DEFAULT_LEAD_TIME_DAYS", 7))
+REORDER_REVIEW_DAYS = int(os.environ.get("REORDER_REVIEW_DAYS", 7))
+# Safety stock factor; 1.65 covers demand on ~95% of lead times
+REORDER_SERVICE_Z = float(os.environ.get("REORDER_SERVICE_Z", 1.65))
+
+DEMAND_MOVEMENTS = ["sale", "return"]
+
+
+async def setup_purchase_suggestions(db: AsyncIOMotorDatabase):
+    await db.inventory_movements.create_index([("movement_type", 1), ("created_at", 1)])
+
+
+def _days_before(instant: datetime, days: int, tz: str = REPORT_TIMEZONE) -> datetime:
+    # Noon avoids landing on a DST gap
+    local = instant.astimezone(ZoneInfo(tz)).replace(hour=12) - timedelta(days=days)
+    return last_midnight(local, tz)
+
+
+async def sales_velocity(db: AsyncIOMotorDatabase, start: datetime, end: datetime, days: int) -> tuple:
+    """
+    Venta diaria por producto en [start, end), `days` días locales
+
+    Devuelve ({barcode: fila}, promedio, desviación) con una fila por producto
+    vendido en el periodo. Los días sin venta cuentan como cero.
+    """
+    match = {"movement_type": {"$in": DEMAND_MOVEMENTS}, **instant_range_query("created_at", start, end)}
+    cursor = db.inventory_movements.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "barcode": "$barcode",
+                "day": {"$dateDiff": {"startDate": start, "endDate": date_expr("created_at"),
+                                      "unit": "day", "timezone": REPORT_TIMEZONE}},
+            },
+            "quantity": {"$sum": "$quantity"},
+        }},
+    ], allowDiskUse=True)
+
+    index: Dict[str, int] = {}
+    rows, day, quantity = [], [], []
+    async for group in cursor:
+        rows.append(index.setdefault(group["_id"]["barcode"], len(index)))
+        day.append(group["_id"]["day"])
+        quantity.append(group["quantity"])
+
+    # Sales are negative movements: demand is the opposite of the net quantity
+    cells = np.asarray(rows, dtype=np.int64) * days + np.asarray(day, dtype=np.int64)
+    daily = np.bincount(cells, weights=-np.asarray(quantity, dtype=np.float64),
+                        minlength=len(index) * days).reshape(len(index), days)
+    mean = np.maximum(daily.mean(axis=1), 0)
+    std = daily.std(axis=1, ddof=1) if days > 1 else np.zeros(len(index))
+    return index, mean, std
+
+
+async def product_suppliers(db: AsyncIOMotorDatabase, after=None) -> Dict[str, str]:
+    """Proveedor de la última compra de cada producto (de las compras con _id > after)"""
+    return {
+        row["_id"]: row["supplier_name"]
+        async for row in db.purchases.aggregate([
+            {"$match": {"_id": {"$gt": after}} if after else {}},
+            {"$sort": {"created_at": -1}},
+            {"$unwind": "$items"},
+            {"$group": {"_id": "$items.barcode", "supplier_name": {"$first": "$supplier_name"}}},
+        ], allowDiskUse=True)
+    }
+
+
+_PRODUCT_FIELDS = ("barcode", "name", "stock", "min_stock", "reorder_qty")
+
+
+class PurchaseSuggestions:
+    """
+    Sugerencias de compra en memoria, recalculadas cuando cambian los datos
+
+    Observador del índice de códigos de barras (reset / update / discard).
+    """
+
+    def __init__(self):
+        self._velocity: Dict[int, tuple] = {}  # days -> (start, velocity)
+        self._results: Dict[int, tuple] = {}  # days -> (data version, result)
+        self._products: Dict[str, dict] = {}
+        self._products_version = 0  # bumped by every product change
+        self._suppliers: Dict[str, str] = {}
+        self._last_purchase = None
+        self._lock = asyncio.Lock()
+
+    def reset(self, products: Iterable[dict]):
+        self._products = {product["barcode"]: _entry(product) for product in products}
+        self._products_version += 1
+
+    def update(self, product: dict):
+        self._products[product["barcode"]] = _entry(product)
+        self._products_version += 1
+
+    def discard(self, barcode: str):
+        if self._products.pop(barcode, None) is not None:
+            self._products_version += 1
+
+    async def _refresh_suppliers(self, db: AsyncIOMotorDatabase):
+        """Aplicar las compras nuevas desde la última consulta"""
+        latest = await db.purchases.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        latest = latest and latest["_id"]
+        if latest != self._last_purchase:
+            self._suppliers.update(await product_suppliers(db, self._last_purchase))
+            self._last_purchase = latest
+
+    async def get(self, db: AsyncIOMotorDatabase, days: int = SUGGESTION_WINDOW_DAYS) -> dict:
+        async with self._lock:
+            end = last_midnight()
+            await self._refresh_suppliers(db)
+            # Cheap index lookup: a new supplier may change lead times
+            supplier = await db.suppliers.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            version = (end, self._products_version, self._last_purchase, supplier and supplier["_id"])
+            cached = self._results.get(days)
+            if cached and cached[0] == version:
+                return cached[1]
+            result = await self._compute(db, days, end)
+            self._results[days] = (version, result)
+            return result
+
+    async def _compute(self, db: AsyncIOMotorDatabase, days: int, end: datetime) -> dict:
+        start = _days_before(end, days)
+        cached = self._velocity.get(days)
+        if not cached or cached[0] != start:
+            cached = (start, await sales_velocity(db, start, end, days))
+            self._velocity[days] = cached
+        index, mean, std = cached[1]
+
+        suppliers = self._suppliers
+        lead_times = {
+            supplier["name"]: supplier.get("lead_time_days", DEFAULT_LEAD_TIME_DAYS)
+            async for supplier in db.suppliers.find({}, {"_id": 0, "name": 1, "lead_time_days": 1})
+        }
+        products = list(self._products.values())
+
+        row = np.array([index.get(p["barcode"], -1) for p in products], dtype=np.int64)
+        sold = row >= 0
+        velocity = np.zeros(len(products))
+        deviation = np.zeros(len(products))
+        velocity[sold] = mean[row[sold]]
+        deviation[sold] = std[row[sold]]
+
+        stock = np.array([p.get("stock", 0) for p in products], dtype=np.float64)
+        minimum = np.array([min_stock(p) for p in products], dtype=np.float64)
+        reorder_qty = np.array([p.get("reorder_qty") or 0 for p in products], dtype=np.float64)
+        lead = np.array([
+            lead_times.get(suppliers.get(p["barcode"]), DEFAULT_LEAD_TIME_DAYS) for p in products
+        ], dtype=np.float64)
+
+        cover = lead + REORDER_REVIEW_DAYS
+        reorder_point = np.maximum(velocity * lead + REORDER_SERVICE_Z * deviation * np.sqrt(lead), minimum)
+        target = np.maximum(velocity * cover + REORDER_SERVICE_Z * deviation * np.sqrt(cover), minimum)
+        suggested = np.where(stock < reorder_point, np.maximum(np.ceil(target - stock), reorder_qty), 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            days_of_stock = np.where(velocity > 0, np.maximum(stock, 0) / velocity, np.inf)
+
+        groups: Dict[Optional[str], dict] = {}
+        for i in np.flatnonzero(suggested > 0):
+            product = products[i]
+            supplier_name = suppliers.get(product["barcode"])
+            group = groups.setdefault(supplier_name, {
+                "supplier_name": supplier_name,
+                "lead_time_days": int(lead[i]),
+                "total_units": 0,
+                "items": [],
+            })
+            group["total_units"] += int(suggested[i])
+            group["items"].append({
+                "barcode": product["barcode"],
+                "name": product.get("name"),
+                "stock": int(stock[i]),
+                "daily_velocity": round(float(velocity[i]), 2),
+                "daily_std": round(float(deviation[i]), 2),
+                "days_of_stock": round(float(days_of_stock[i]), 1) if velocity[i] > 0 else None,
+                "reorder_point": int(np.ceil(reorder_point[i])),
+                "suggested_qty": int(suggested[i]),
+            })
+        for group in groups.values():
+            # Products about to run out first
+            group["items"].sort(key=lambda item: (
+                item["days_of_stock"] if item["days_of_stock"] is not None else float("inf"), item["barcode"]
+            ))
+
+        return {
+            "window_days": days,
+            "start": start,
+            "end": end,
+            "computed_at": datetime.now(timezone.utc),
+            # Products never purchased (no supplier) go last
+            "suppliers": sorted(groups.values(), key=lambda g: (g["supplier_name"] is None, g["supplier_name"] or "")),
+        }
+
+
+def _entry(product: dict) -> dict:
+    return {field: product[field] for field in _PRODUCT_FIELDS if field in product}
@@ -0,0 +1,41 @@
+"""
+Numeración consecutiva de documentos
+
+Los números de factura y de traslado se toman de un contador en la
+colección `counters` con un solo `$inc` atómico, que puede reservar un
+bloque completo (p. ej. para un lote de ventas sincronizadas). Antes el
+número salía de la última factura guardada, y dos ventas simultáneas
+podían recibir el mismo.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+INVOICE_SEQUENCE = "invoice_number"
+TRANSFER_SEQUENCE = "transfer_number"
+
+
+def format_invoice_number(number: int) -> str:
+    return f"INV-{number:06d}"
+
+
+def format_transfer_number(number: int) -> str:
+    return f"TRF-{number:06d}"
+
+
+async def setup_sequences(db: AsyncIOMotorDatabase):
+    """Alinear el contador de facturas con la última factura existente"""
+    last_invoice = await db.invoices.find_one(
+        {"invoice_number": {"$regex": r"^INV-\d+$"}}, {"_id": 0, "invoice_number": 1},
+        sort=[("invoice_number", -1)]
+    )
+    last_num = int(last_invoice["invoice_number"].split("-")[1]) if last_invoice else 0
+    # $max never moves the counter back, so restarts are harmless
+    await db.counters.update_one({"_id": INVOICE_SEQUENCE}, {"$max": {"seq": last_num}}, upsert=True)
+
+
+async def reserve_numbers(db: AsyncIOMotorDatabase, sequence: str, count: int = 1) -> range:
+    """Reservar `count` números consecutivos de `sequence`"""
+    counter = await db.counters.find_one_and_update(
+        {"_id": sequence}, {"$inc": {"seq": count}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return range(counter["seq"] - count + 1, counter["seq"] + 1)
@@ -1,30 +1,74 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
-from ticket_generator import TicketPDFGenerator
+from fastapi.responses import StreamingResponse, Response
+from concurrent.futures.process import BrokenProcessPool
+from ticket_pool import TicketRenderPool, TicketPoolBusy
+from ticket_layout import build_ticket_layout
+from ticket_escpos import render_escpos, render_text
+from ticket_archive import ZipStream
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr, ConfigDict, validator
+from pydantic_core import to_json
+from pydantic import BaseModel, Field, EmailStr, ConfigDict, TypeAdapter, validator
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import re
+import json
+import asyncio
 import pandas as pd
 import io
 import csv
 from server_rbac import create_rbac_router
+from catalog_sync import sync_stamp, record_tombstones, setup_catalog_sync, get_catalog_changes, SYNC_EXCLUDED_FIELDS
+from catalog_cache import CatalogCache
+from product_search import search_fields, search_products, setup_product_search
+from barcode_index import BarcodeIndex
+from low_stock import LowStockSet, LOW_STOCK_THRESHOLD
+from stock import (
+    STRICT_STOCK, InsufficientStock, basket_quantities, setup_stock, decrement_stock, restore_stock,
+    reserve, claim_reservation, release_reservation, restore_reservation, run_reservation_sweeper,
+    supports_transactions
+)
+from money import to_money, money_sum, money_fields, MONEY_TYPE_REGISTRY, ZERO
+from timestamps import to_datetime, date_range_query, parse_date_param, bucket_expr, load_migration_state
+from list_query import (
+    ListParams, paginate, parse_fields, render_list, setup_list_indexes,
+    wants_ndjson, stream_ndjson, NEXT_CURSOR_HEADER
+)
+from sequences import INVOICE_SEQUENCE, format_invoice_number, reserve_numbers, setup_sequences
+from pos_sync import INVOICE_INTERNAL_FIELDS, INVOICE_PROJECTION, setup_pos_sync, sync_sales
+from kardex import kardex_rows, require_native_dates, stream_json, stream_xlsx
+from stock_snapshots import setup_stock_snapshots, stock_at, reconcile, run_snapshot_scheduler
+from invoice_returns import apply_return, returnable_lines
+from invoice_detail import InvoiceDetailLoader, setup_invoice_detail
+from idempotency import IdempotencyMiddleware, setup_idempotency, REPLAYED_HEADER
+from average_cost import apply_costed_stock
+from stock_levels import (
+    DEFAULT_LOCATION, setup_stock_levels, unknown_locations, location_deltas, adjust_levels, transfer_stock,
+    levels_seeded
+)
+from stock_transfers import (
+    IN_TRANSIT, TRANSFER_MAX_LINES, setup_stock_transfers, create_transfer, dispatch_transfer,
+    receive_transfer, outstanding
+)
+from cost_layers import receive_layers, consume_layers, return_layers, restore_layers, valuation
+from purchase_suggestions import (
+    PurchaseSuggestions, setup_purchase_suggestions, SUGGESTION_WINDOW_DAYS, DEFAULT_LEAD_TIME_DAYS
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, type_registry=MONEY_TYPE_REGISTRY)
 db = client[os.environ['DB_NAME']]
 
 # Security
@@ -39,6 +83,26 @@ security = HTTPBearer()
 app = FastAPI(title="Boltrex API")
 api_router = APIRouter(prefix="/api")
 
+# Ticket rendering runs in worker processes so the event loop only does I/O
+ticket_pool = TicketRenderPool()
+TICKET_BATCH_CHUNK = 50  # invoices fetched and rendered per step in batch exports
+
+# Rarely-changing catalog listings served with ETags from memory
+catalog_cache = CatalogCache()
+
+# Products below min_stock, kept up to date by the barcode index
+low_stock_products = LowStockSet()
+# Reorder suggestions, refreshed from the barcode index's product changes
+purchase_suggestions = PurchaseSuggestions()
+# Barcode -> serialized product, for scanner lookups at checkout
+barcode_index = BarcodeIndex(
+    lambda product: Product.model_validate(product).model_dump_json().encode(),
+    watchers=[low_stock_products, purchase_suggestions]
+)
+BARCODE_INDEX_REFRESH = float(os.environ.get("BARCODE_INDEX_REFRESH", 5))
+# Largest batch accepted by POST /api/pos/sync
+POS_SYNC_MAX_SALES = int(os.environ.get("POS_SYNC_MAX_SALES", 1000))
+
 # ==================== MODELS ====================
 
 class UserRole(BaseModel):
@@ -104,6 +168,8 @@ class Product(BaseModel):
     tax_rate: float  # IVA percentage
     prices: List[ProductPrice] = []  # Multiple prices
     stock: int = 0
+    min_stock: int = LOW_STOCK_THRESHOLD  # Low stock below this
+    reorder_qty: int = 0  # Usual order quantity
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ProductCreate(BaseModel):
@@ -114,6 +180,11 @@ class ProductCreate(BaseModel):
     purchase_price: float
     tax_rate: float
     prices: List[ProductPrice] = []
+    min_stock: int = Field(LOW_STOCK_THRESHOLD, ge=0)
+    reorder_qty: int = Field(0, ge=0)
+
+class ProductLookup(BaseModel):
+    barcodes: List[str]
 
 class ProductUpdate(BaseModel):
     name: Optional[str] = None
@@ -122,6 +193,8 @@ class ProductUpdate(BaseModel):
     purchase_price: Optional[float] = None
     tax_rate: Optional[float] = None
     prices: Optional[List[ProductPrice]] = None
+    min_stock: Optional[int] = Field(None, ge=0)
+    reorder_qty: Optional[int] = Field(None, ge=0)
 
 class DocumentType(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -188,6 +261,7 @@ class Supplier(BaseModel):
     phone: Optional[str] = None
     email: Optional[EmailStr] = None
     address: Optional[str] = None
+    lead_time_days: int = DEFAULT_LEAD_TIME_DAYS  # Days from order to delivery
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class SupplierCreate(BaseModel):
@@ -196,6 +270,7 @@ class SupplierCreate(BaseModel):
     phone: Optional[str] = None
     email: Optional[EmailStr] = None
     address: Optional[str] = None
+    lead_time_days: int = Field(DEFAULT_LEAD_TIME_DAYS, ge=0)
 
 class TaxRate(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -258,12 +333,37 @@ class Invoice(BaseModel):
     payment_method: Optional[str] = None  # Name of payment method
     amount_paid: float = 0  # Amount paid so far
     balance: float = 0  # Remaining balance
+    client_sale_id: Optional[str] = None  # Offline sale id (POS sync)
+    location: str = DEFAULT_LOCATION  # Where the goods left from
+
+class ReservationItem(BaseModel):
+    barcode: str
+    quantity: int = Field(gt=0)
+
+class ReservationCreate(BaseModel):
+    basket_id: Optional[str] = None  # Replace this basket's reservation
+    items: List[ReservationItem]
 
 class InvoiceCreate(BaseModel):
     client_document: str
     items: List[InvoiceItem]
     payment_status: str = "pagado"  # pagado, por_cobrar
     payment_method: Optional[str] = None  # Required if payment_status is "pagado"
+    reservation_id: Optional[str] = None  # Basket reservation (strict stock mode)
+    location: Optional[str] = None  # Defaults to DEFAULT_LOCATION
+
+class OfflineSale(BaseModel):
+    """Venta registrada por el POS sin conexión"""
+    client_sale_id: str = Field(min_length=1)  # Generated by the terminal
+    client_document: str
+    items: List[InvoiceItem] = Field(min_length=1)
+    payment_status: str = "pagado"  # pagado, por_cobrar
+    payment_method: Optional[str] = None
+    sold_at: Optional[datetime] = None  # Time of sale on the terminal
+    location: Optional[str] = None  # Defaults to DEFAULT_LOCATION
+
+class PosSyncRequest(BaseModel):
+    sales: List[OfflineSale] = Field(max_length=POS_SYNC_MAX_SALES)
 
 # ==================== FIOS (CREDITS/PAYMENTS) MODELS ====================
 
@@ -305,23 +405,114 @@ class Purchase(BaseModel):
     supplier_name: str
     items: List[PurchaseItem]
     total: float
+    location: str = DEFAULT_LOCATION  # Where the goods were received
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class PurchaseCreate(BaseModel):
     supplier_name: str
     items: List[PurchaseItem]
+    location: Optional[str] = None  # Defaults to DEFAULT_LOCATION
+
+class SupplierReturn(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    supplier_name: str
+    items: List[PurchaseItem]
+    total: float
+    reason: Optional[str] = None
+    location: str = DEFAULT_LOCATION
+    created_by: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class SupplierReturnCreate(BaseModel):
+    supplier_name: str
+    items: List[PurchaseItem] = Field(min_length=1)
+    reason: Optional[str] = None
+    location: Optional[str] = None  # Defaults to DEFAULT_LOCATION
 
 class InventoryMovement(BaseModel):
     model_config = ConfigDict(extra="ignore")
     barcode: str
     product_name: str
-    movement_type: str  # purchase, sale, return, adjustment
+    movement_type: str  # purchase, sale, return, supplier_return, transfer_out, transfer_in, adjustment
     quantity: int  # positive for in, negative for out
     reference: Optional[str] = None  # invoice/purchase number
+    location: str = DEFAULT_LOCATION
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class StockDrift(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    barcode: str
+    product_name: Optional[str] = None
+    stock: int
+    expected: int
+    difference: int
+    levels: Optional[int] = None  # Sum of stock_levels, once every unit has a location
+    levels_difference: Optional[int] = None
+
+class Location(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    code: str
+    name: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class LocationCreate(BaseModel):
+    code: str = Field(min_length=1)
+    name: str
+
+class StockLevel(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    barcode: str
+    location: str
+    stock: int = 0
+    updated_at: Optional[datetime] = None
+
+class StockTransferItem(BaseModel):
+    barcode: str
+    quantity: int = Field(gt=0)
+
+class StockTransferCreate(BaseModel):
+    from_location: str
+    to_location: str
+    items: List[StockTransferItem] = Field(min_length=1)
+
+class TransferLine(BaseModel):
+    barcode: str
+    product_name: str
+    quantity: int
+    received_qty: int = 0
+
+class TransferReceipt(BaseModel):
+    receipt_id: str
+    received_at: datetime
+    received_by: str
+    items: List[StockTransferItem]
+
+class Transfer(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    transfer_number: str
+    from_location: str
+    to_location: str
+    status: str  # draft, in_transit, received
+    items: List[TransferLine]
+    notes: Optional[str] = None
+    receipts: List[TransferReceipt] = []
+    created_by: str
+    created_at: datetime
+    dispatched_at: Optional[datetime] = None
+    received_at: Optional[datetime] = None
+
+class TransferCreate(BaseModel):
+    from_location: str
+    to_location: str
+    items: List[StockTransferItem] = Field(min_length=1, max_length=TRANSFER_MAX_LINES)
+    notes: Optional[str] = None
+    dispatch: bool = False  # Dispatch right away instead of saving a draft
+
+class TransferReceive(BaseModel):
+    items: Optional[List[StockTransferItem]] = None  # None receives everything outstanding
+
 class ReturnItem(BaseModel):
     barcode: str
     product_name: str
@@ -334,12 +525,14 @@ class Return(BaseModel):
     invoice_number: str
     items: List[ReturnItem]
     total: float
+    location: str = DEFAULT_LOCATION
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ReturnCreate(BaseModel):
     invoice_number: str
     items: List[ReturnItem]
+    location: Optional[str] = None  # Defaults to the invoice's location
 
 # ==================== TICKET CONFIG MODELS ====================
 
@@ -378,6 +571,26 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+async def require_locations(*codes: str):
+    """400 si alguna ubicación no está registrada"""
+    unknown = await unknown_locations(db, codes)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Ubicación no encontrada: {', '.join(unknown)}")
+
+def invoice_details() -> InvoiceDetailLoader:
+    """Dependencia: FastAPI crea un cargador por petición y lo comparte entre sus dependencias"""
+    return InvoiceDetailLoader(db)
+
+def token_subject(authorization: str) -> Optional[str]:
+    """Usuario (`sub`) de una cabecera Authorization Bearer, o None si el token no es válido"""
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -409,7 +622,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         full_name=user.get("full_name") or f"{user.get('first_name', '')} {user.get('last_name', '')}",
         role=user.get("role", "vendedor"),
         is_active=user.get("is_active", True),
-        created_at=datetime.fromisoformat(user["created_at"]) if isinstance(user.get("created_at"), str) else user.get("created_at", datetime.now(timezone.utc))
+        created_at=to_datetime(user.get("created_at")) or datetime.now(timezone.utc)
     )
 
 # ==================== AUTH ROUTES ====================
@@ -432,8 +645,8 @@ async def register(user_data: UserCreate):
         "is_active": True,
         "roles": ["Vendedor"],  # Default role
         "hashed_password": hashed_password,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
     
     await db.users_extended.insert_one(user_dict)
@@ -519,6 +732,14 @@ async def get_me(current_user: User = Depends(get_current_user)):
         "permissions": permissions_dict
     }
 
+# ==================== CATALOG CACHE ====================
+
+async def load_catalog_json(model, collection, query: Optional[dict] = None) -> bytes:
+    """Leer un listado de catálogo y serializarlo a JSON validado con su modelo"""
+    docs = await collection.find(query or {}, {"_id": 0}).to_list(1000)
+    adapter = TypeAdapter(List[model])
+    return adapter.dump_json(adapter.validate_python(docs))
+
 # ==================== CATEGORIES ====================
 
 @api_router.post("/categories", response_model=Category)
@@ -528,37 +749,42 @@ async def create_category(category: CategoryCreate, current_user: User = Depends
         raise HTTPException(status_code=400, detail="Category already exists")
     
     cat_dict = category.model_dump()
-    cat_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    cat_dict["created_at"] = datetime.now(timezone.utc)
+    cat_dict["sync_version"] = sync_stamp()
     await db.categories.insert_one(cat_dict)
+    catalog_cache.invalidate("categories")
     return Category(**cat_dict)
 
 @api_router.get("/categories", response_model=List[Category])
-async def get_categories(current_user: User = Depends(get_current_user)):
-    categories = await db.categories.find({}, {"_id": 0}).to_list(1000)
-    for cat in categories:
-        if isinstance(cat.get('created_at'), str):
-            cat['created_at'] = datetime.fromisoformat(cat['created_at'])
-    return categories
+async def get_categories(request: Request, current_user: User = Depends(get_current_user)):
+    return await catalog_cache.respond(
+        request, "categories", lambda: load_catalog_json(Category, db.categories)
+    )
 
 @api_router.put("/categories/{name}", response_model=Category)
 async def update_category(name: str, category: CategoryCreate, current_user: User = Depends(get_current_user)):
     result = await db.categories.update_one(
         {"name": name},
-        {"$set": category.model_dump()}
+        {"$set": {**category.model_dump(), "sync_version": sync_stamp()}}
     )
+    catalog_cache.invalidate("categories")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    updated = await db.categories.find_one({"name": name}, {"_id": 0})
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
+    # Renamed: terminals must drop the old key
+    if category.name != name:
+        await record_tombstones(db, "categories", [name])
+    
+    updated = await db.categories.find_one({"name": category.name}, {"_id": 0})
     return Category(**updated)
 
 @api_router.delete("/categories/{name}")
 async def delete_category(name: str, current_user: User = Depends(get_current_user)):
     result = await db.categories.delete_one({"name": name})
+    catalog_cache.invalidate("categories")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    await record_tombstones(db, "categories", [name])
     return {"message": "Category deleted"}
 
 # ==================== PRICE LISTS ====================
@@ -566,17 +792,17 @@ async def delete_category(name: str, current_user: User = Depends(get_current_us
 @api_router.post("/price-lists", response_model=PriceList)
 async def create_price_list(price_list: PriceListCreate, current_user: User = Depends(get_current_user)):
     pl_dict = price_list.model_dump()
-    pl_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    pl_dict["created_at"] = datetime.now(timezone.utc)
+    pl_dict["sync_version"] = sync_stamp()
     await db.price_lists.insert_one(pl_dict)
+    catalog_cache.invalidate("price_lists")
     return PriceList(**pl_dict)
 
 @api_router.get("/price-lists", response_model=List[PriceList])
-async def get_price_lists(current_user: User = Depends(get_current_user)):
-    price_lists = await db.price_lists.find({}, {"_id": 0}).to_list(1000)
-    for pl in price_lists:
-        if isinstance(pl.get('created_at'), str):
-            pl['created_at'] = datetime.fromisoformat(pl['created_at'])
-    return price_lists
+async def get_price_lists(request: Request, current_user: User = Depends(get_current_user)):
+    return await catalog_cache.respond(
+        request, "price_lists", lambda: load_catalog_json(PriceList, db.price_lists)
+    )
 
 # ==================== PRODUCTS ====================
 
@@ -588,32 +814,68 @@ async def create_product(product: ProductCreate, current_user: User = Depends(ge
     
     prod_dict = product.model_dump()
     prod_dict["stock"] = 0
-    prod_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    prod_dict["created_at"] = datetime.now(timezone.utc)
+    prod_dict["sync_version"] = sync_stamp()
+    prod_dict.update(search_fields(product.barcode, product.name))
     await db.products.insert_one(prod_dict)
+    barcode_index.put(prod_dict)
     return Product(**prod_dict)
 
 @api_router.get("/products", response_model=List[Product])
-async def get_products(search: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    query = {}
+async def get_products(
+    search: Optional[str] = None,
+    params: ListParams = Depends(),
+    current_user: User = Depends(get_current_user)
+):
     if search:
-        query = {"$or": [
-            {"barcode": {"$regex": search, "$options": "i"}},
-            {"name": {"$regex": search, "$options": "i"}}
-        ]}
+        # Ranked search results are a single page
+        products = await search_products(db, search, params.page_limit)
+        return render_list(Product, products, parse_fields(Product, params.fields))
+    return await paginate(db.products, {}, Product, params, exclude=SYNC_EXCLUDED_FIELDS["products"])
+
+@api_router.get("/products/search", response_model=List[Product])
+async def search_products_endpoint(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """Buscar productos por código de barras o nombre (código exacto primero)"""
+    return await search_products(db, q, limit)
+
+@api_router.post("/products/lookup")
+async def lookup_products(lookup: ProductLookup, current_user: User = Depends(get_current_user)):
+    """Resolver una canasta de códigos de barras en una sola llamada"""
+    found = {}
+    misses = []
+    for barcode in dict.fromkeys(lookup.barcodes):
+        cached = barcode_index.get(barcode)
+        if cached is not None:
+            found[barcode] = cached
+        else:
+            misses.append(barcode)
+    
+    # Products not indexed yet (e.g. written by another process) in one query
+    if misses:
+        await barcode_index.reload(db, misses)
+        for barcode in misses:
+            cached = barcode_index.get(barcode)
+            if cached is not None:
+                found[barcode] = cached
     
-    products = await db.products.find(query, {"_id": 0}).to_list(1000)
-    for prod in products:
-        if isinstance(prod.get('created_at'), str):
-            prod['created_at'] = datetime.fromisoformat(prod['created_at'])
-    return products
+    missing = [barcode for barcode in misses if barcode not in found]
+    body = b'{"products":[' + b",".join(found.values()) + b'],"missing":' + json.dumps(missing).encode() + b"}"
+    return Response(body, media_type="application/json")
 
 @api_router.get("/products/{barcode}", response_model=Product)
 async def get_product(barcode: str, current_user: User = Depends(get_current_user)):
+    cached = barcode_index.get(barcode)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
+    
     product = await db.products.find_one({"barcode": barcode}, {"_id": 0})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    if isinstance(product.get('created_at'), str):
-        product['created_at'] = datetime.fromisoformat(product['created_at'])
+    barcode_index.put(product)
     return Product(**product)
 
 @api_router.put("/products/{barcode}", response_model=Product)
@@ -622,13 +884,15 @@ async def update_product(barcode: str, product_update: ProductUpdate, current_us
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
     
+    if "name" in update_data:
+        update_data.update(search_fields(barcode, update_data["name"]))
+    update_data["sync_version"] = sync_stamp()
     result = await db.products.update_one({"barcode": barcode}, {"$set": update_data})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
     
     updated = await db.products.find_one({"barcode": barcode}, {"_id": 0})
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
+    barcode_index.put(updated)
     return Product(**updated)
 
 @api_router.delete("/products/{barcode}")
@@ -636,6 +900,9 @@ async def delete_product(barcode: str, current_user: User = Depends(get_current_
     result = await db.products.delete_one({"barcode": barcode})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    barcode_index.remove(barcode)
+    await db.stock_levels.delete_many({"barcode": barcode})
+    await record_tombstones(db, "products", [barcode])
     return {"message": "Product deleted"}
 
 # ==================== DOCUMENT TYPES ====================
@@ -647,17 +914,16 @@ async def create_document_type(doc_type: DocumentTypeCreate, current_user: User
         raise HTTPException(status_code=400, detail="Document type already exists")
     
     dt_dict = doc_type.model_dump()
-    dt_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    dt_dict["created_at"] = datetime.now(timezone.utc)
     await db.document_types.insert_one(dt_dict)
+    catalog_cache.invalidate("document_types")
     return DocumentType(**dt_dict)
 
 @api_router.get("/document-types", response_model=List[DocumentType])
-async def get_document_types(current_user: User = Depends(get_current_user)):
-    doc_types = await db.document_types.find({}, {"_id": 0}).to_list(1000)
-    for dt in doc_types:
-        if isinstance(dt.get('created_at'), str):
-            dt['created_at'] = datetime.fromisoformat(dt['created_at'])
-    return doc_types
+async def get_document_types(request: Request, current_user: User = Depends(get_current_user)):
+    return await catalog_cache.respond(
+        request, "document_types", lambda: load_catalog_json(DocumentType, db.document_types)
+    )
 
 # ==================== CLIENTS ====================
 
@@ -671,12 +937,17 @@ async def create_client(client: ClientCreate, current_user: User = Depends(get_c
         raise HTTPException(status_code=400, detail="Client already exists")
     
     client_dict = client.model_dump()
-    client_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    client_dict["created_at"] = datetime.now(timezone.utc)
+    client_dict["sync_version"] = sync_stamp()
     await db.clients.insert_one(client_dict)
     return Client(**client_dict)
 
 @api_router.get("/clients", response_model=List[Client])
-async def get_clients(search: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_clients(
+    search: Optional[str] = None,
+    params: ListParams = Depends(),
+    current_user: User = Depends(get_current_user)
+):
     query = {}
     if search:
         query = {"$or": [
@@ -685,19 +956,13 @@ async def get_clients(search: Optional[str] = None, current_user: User = Depends
             {"last_name": {"$regex": search, "$options": "i"}}
         ]}
     
-    clients = await db.clients.find(query, {"_id": 0}).to_list(1000)
-    for client in clients:
-        if isinstance(client.get('created_at'), str):
-            client['created_at'] = datetime.fromisoformat(client['created_at'])
-    return clients
+    return await paginate(db.clients, query, Client, params)
 
 @api_router.get("/clients/{document_number}", response_model=Client)
 async def get_client(document_number: str, current_user: User = Depends(get_current_user)):
     client = await db.clients.find_one({"document_number": document_number}, {"_id": 0})
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
-    if isinstance(client.get('created_at'), str):
-        client['created_at'] = datetime.fromisoformat(client['created_at'])
     return Client(**client)
 
 @api_router.put("/clients/{document_number}", response_model=Client)
@@ -706,13 +971,12 @@ async def update_client(document_number: str, client_update: ClientUpdate, curre
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
     
+    update_data["sync_version"] = sync_stamp()
     result = await db.clients.update_one({"document_number": document_number}, {"$set": update_data})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Client not found")
     
     updated = await db.clients.find_one({"document_number": document_number}, {"_id": 0})
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
     return Client(**updated)
 
 # ==================== SUPPLIERS ====================
@@ -720,49 +984,65 @@ async def update_client(document_number: str, client_update: ClientUpdate, curre
 @api_router.post("/suppliers", response_model=Supplier)
 async def create_supplier(supplier: SupplierCreate, current_user: User = Depends(get_current_user)):
     supp_dict = supplier.model_dump()
-    supp_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    supp_dict["created_at"] = datetime.now(timezone.utc)
     await db.suppliers.insert_one(supp_dict)
+    catalog_cache.invalidate("suppliers")
     return Supplier(**supp_dict)
 
 @api_router.get("/suppliers", response_model=List[Supplier])
-async def get_suppliers(current_user: User = Depends(get_current_user)):
-    suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(1000)
-    for supp in suppliers:
-        if isinstance(supp.get('created_at'), str):
-            supp['created_at'] = datetime.fromisoformat(supp['created_at'])
-    return suppliers
+async def get_suppliers(request: Request, current_user: User = Depends(get_current_user)):
+    return await catalog_cache.respond(
+        request, "suppliers", lambda: load_catalog_json(Supplier, db.suppliers)
+    )
+
+# ==================== LOCATIONS ====================
+
+@api_router.post("/locations", response_model=Location)
+async def create_location(location: LocationCreate, current_user: User = Depends(get_current_user)):
+    loc_dict = location.model_dump()
+    loc_dict["created_at"] = datetime.now(timezone.utc)
+    try:
+        await db.locations.insert_one(loc_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="La ubicación ya existe")
+    catalog_cache.invalidate("locations")
+    return Location(**loc_dict)
+
+@api_router.get("/locations", response_model=List[Location])
+async def get_locations(request: Request, current_user: User = Depends(get_current_user)):
+    return await catalog_cache.respond(
+        request, "locations", lambda: load_catalog_json(Location, db.locations)
+    )
 
 # ==================== TAX RATES ====================
 
 @api_router.post("/tax-rates", response_model=TaxRate)
 async def create_tax_rate(tax_rate: TaxRateCreate, current_user: User = Depends(get_current_user)):
     if tax_rate.is_active:
-        await db.tax_rates.update_many({"is_active": True}, {"$set": {"is_active": False}})
+        await db.tax_rates.update_many({"is_active": True}, {"$set": {"is_active": False, "sync_version": sync_stamp()}})
     
     tr_dict = tax_rate.model_dump()
-    if tr_dict.get("effective_date"):
-        tr_dict["effective_date"] = tr_dict["effective_date"].isoformat()
-    else:
-        tr_dict["effective_date"] = datetime.now(timezone.utc).isoformat()
-    tr_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    if not tr_dict.get("effective_date"):
+        tr_dict["effective_date"] = datetime.now(timezone.utc)
+    tr_dict["created_at"] = datetime.now(timezone.utc)
+    tr_dict["sync_version"] = sync_stamp()
     
     await db.tax_rates.insert_one(tr_dict)
-    return TaxRate(**{**tr_dict, "effective_date": datetime.fromisoformat(tr_dict["effective_date"]), "created_at": datetime.fromisoformat(tr_dict["created_at"])})
+    catalog_cache.invalidate("tax_rates")
+    return TaxRate(**tr_dict)
 
 @api_router.get("/tax-rates", response_model=List[TaxRate])
-async def get_tax_rates(current_user: User = Depends(get_current_user)):
-    tax_rates = await db.tax_rates.find({}, {"_id": 0}).to_list(1000)
-    for tr in tax_rates:
-        if isinstance(tr.get('effective_date'), str):
-            tr['effective_date'] = datetime.fromisoformat(tr['effective_date'])
-        if isinstance(tr.get('created_at'), str):
-            tr['created_at'] = datetime.fromisoformat(tr['created_at'])
-    return tax_rates
+async def get_tax_rates(request: Request, current_user: User = Depends(get_current_user)):
+    return await catalog_cache.respond(
+        request, "tax_rates", lambda: load_catalog_json(TaxRate, db.tax_rates)
+    )
 
 @api_router.patch("/tax-rates/{name}/activate")
 async def activate_tax_rate(name: str, current_user: User = Depends(get_current_user)):
-    await db.tax_rates.update_many({"is_active": True}, {"$set": {"is_active": False}})
-    result = await db.tax_rates.update_one({"name": name}, {"$set": {"is_active": True}})
+    version = sync_stamp()
+    await db.tax_rates.update_many({"is_active": True}, {"$set": {"is_active": False, "sync_version": version}})
+    result = await db.tax_rates.update_one({"name": name}, {"$set": {"is_active": True, "sync_version": version}})
+    catalog_cache.invalidate("tax_rates")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Tax rate not found")
     return {"message": "Tax rate activated"}
@@ -777,27 +1057,25 @@ async def create_payment_method(payment_method: PaymentMethodCreate, current_use
         raise HTTPException(status_code=400, detail="Ya existe una forma de pago con ese nombre")
     
     pm_dict = payment_method.model_dump()
-    pm_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    pm_dict["created_at"] = datetime.now(timezone.utc)
+    pm_dict["sync_version"] = sync_stamp()
     await db.payment_methods.insert_one(pm_dict)
+    catalog_cache.invalidate("payment_methods")
     return PaymentMethod(**pm_dict)
 
 @api_router.get("/payment-methods", response_model=List[PaymentMethod])
-async def get_payment_methods(current_user: User = Depends(get_current_user)):
+async def get_payment_methods(request: Request, current_user: User = Depends(get_current_user)):
     """Listar todas las formas de pago"""
-    payment_methods = await db.payment_methods.find({}, {"_id": 0}).to_list(1000)
-    for pm in payment_methods:
-        if isinstance(pm.get('created_at'), str):
-            pm['created_at'] = datetime.fromisoformat(pm['created_at'])
-    return payment_methods
+    return await catalog_cache.respond(
+        request, "payment_methods", lambda: load_catalog_json(PaymentMethod, db.payment_methods)
+    )
 
 @api_router.get("/payment-methods/active", response_model=List[PaymentMethod])
-async def get_active_payment_methods(current_user: User = Depends(get_current_user)):
+async def get_active_payment_methods(request: Request, current_user: User = Depends(get_current_user)):
     """Listar solo formas de pago activas (para POS y Fios)"""
-    payment_methods = await db.payment_methods.find({"is_active": True}, {"_id": 0}).to_list(1000)
-    for pm in payment_methods:
-        if isinstance(pm.get('created_at'), str):
-            pm['created_at'] = datetime.fromisoformat(pm['created_at'])
-    return payment_methods
+    return await catalog_cache.respond(
+        request, "payment_methods:active", lambda: load_catalog_json(PaymentMethod, db.payment_methods, {"is_active": True})
+    )
 
 @api_router.put("/payment-methods/{name}", response_model=PaymentMethod)
 async def update_payment_method(name: str, payment_method: PaymentMethodUpdate, current_user: User = Depends(get_current_user)):
@@ -812,15 +1090,19 @@ async def update_payment_method(name: str, payment_method: PaymentMethodUpdate,
         if existing:
             raise HTTPException(status_code=400, detail="Ya existe una forma de pago con ese nombre")
     
+    update_data["sync_version"] = sync_stamp()
     result = await db.payment_methods.update_one({"name": name}, {"$set": update_data})
+    catalog_cache.invalidate("payment_methods")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Forma de pago no encontrada")
     
+    # Renamed: terminals must drop the old key
+    if update_data.get("name", name) != name:
+        await record_tombstones(db, "payment_methods", [name])
+    
     # Get updated (use new name if changed)
     new_name = update_data.get("name", name)
     updated = await db.payment_methods.find_one({"name": new_name}, {"_id": 0})
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
     return PaymentMethod(**updated)
 
 @api_router.delete("/payment-methods/{name}")
@@ -832,8 +1114,10 @@ async def delete_payment_method(name: str, current_user: User = Depends(get_curr
         raise HTTPException(status_code=400, detail="No se puede eliminar: esta forma de pago está siendo utilizada en facturas")
     
     result = await db.payment_methods.delete_one({"name": name})
+    catalog_cache.invalidate("payment_methods")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Forma de pago no encontrada")
+    await record_tombstones(db, "payment_methods", [name])
     return {"message": "Forma de pago eliminada"}
 
 # ==================== INVOICES (POS) ====================
@@ -857,14 +1141,6 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
         if not payment_method:
             raise HTTPException(status_code=400, detail="La forma de pago seleccionada no existe o no está activa")
     
-    # Get next invoice number
-    last_invoice = await db.invoices.find_one({}, {"_id": 0, "invoice_number": 1}, sort=[("created_at", -1)])
-    if last_invoice:
-        last_num = int(last_invoice["invoice_number"].split("-")[1])
-        invoice_number = f"INV-{last_num + 1:06d}"
-    else:
-        invoice_number = "INV-000001"
-    
     # Get client
     client = await db.clients.find_one({"document_number": invoice_data.client_document}, {"_id": 0})
     if not client:
@@ -872,44 +1148,70 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
     
     client_name = f"{client['first_name']} {client['last_name']}"
     
-    # Calculate totals
-    subtotal = sum(item.subtotal for item in invoice_data.items)
-    total_tax = sum(item.tax_amount for item in invoice_data.items)
-    total = sum(item.total for item in invoice_data.items)
+    location = invoice_data.location or DEFAULT_LOCATION
+    await require_locations(location)
+    
+    # Calculate totals (exact, in cents)
+    items = [{**money_fields(item.model_dump(), "invoices"), "returned_qty": 0} for item in invoice_data.items]
+    subtotal = money_sum(item["subtotal"] for item in items)
+    total_tax = money_sum(item["tax_amount"] for item in items)
+    total = money_sum(item["total"] for item in items)
     
     # Determine amount_paid and balance based on payment_status
     if invoice_data.payment_status == "pagado":
         amount_paid = total
-        balance = 0
+        balance = ZERO
     else:  # por_cobrar
-        amount_paid = 0
+        amount_paid = ZERO
         balance = total
     
+    # Strict stock: the whole basket is taken or none of it, from the product total
+    # and (once every unit has a location) from the sale's location
+    quantities = basket_quantities(invoice_data.items)
+    strict_location = location if STRICT_STOCK and levels_seeded() else None
+    if STRICT_STOCK:
+        held = await claim_reservation(db, invoice_data.reservation_id) if invoice_data.reservation_id else {}
+        try:
+            await decrement_stock(db, quantities, held, strict_location)
+        except InsufficientStock as e:
+            # Keep the basket's hold so the cashier can fix the basket and retry
+            await restore_reservation(db, invoice_data.reservation_id, held)
+            raise HTTPException(status_code=409, detail=f"Stock insuficiente: {e}")
+    
+    invoice_number = format_invoice_number((await reserve_numbers(db, INVOICE_SEQUENCE))[0])
     invoice_dict = {
         "invoice_number": invoice_number,
         "client_document": invoice_data.client_document,
         "client_name": client_name,
-        "items": [item.model_dump() for item in invoice_data.items],
+        "items": items,
+        "returns_migrated": True,
         "subtotal": subtotal,
         "total_tax": total_tax,
         "total": total,
         "created_by": current_user.email,
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "status": "completed",
         "payment_status": invoice_data.payment_status,
         "payment_method": invoice_data.payment_method if invoice_data.payment_status == "pagado" else None,
         "amount_paid": amount_paid,
-        "balance": balance
+        "balance": balance,
+        "location": location
     }
     
-    await db.invoices.insert_one(invoice_dict)
+    try:
+        await db.invoices.insert_one(invoice_dict)
+    except Exception:
+        if STRICT_STOCK:
+            await restore_stock(db, quantities, held, invoice_data.reservation_id, strict_location)
+        raise
     
     # Update inventory and create movements
     for item in invoice_data.items:
-        await db.products.update_one(
-            {"barcode": item.barcode},
-            {"$inc": {"stock": -item.quantity}}
-        )
+        if not STRICT_STOCK:
+            await db.products.update_one(
+                {"barcode": item.barcode},
+                {"$inc": {"stock": -item.quantity}, "$set": {"sync_version": sync_stamp()}}
+            )
         
         movement_dict = {
             "barcode": item.barcode,
@@ -917,124 +1219,121 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
             "movement_type": "sale",
             "quantity": -item.quantity,
             "reference": invoice_number,
+            "location": location,
             "created_by": current_user.email,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         await db.inventory_movements.insert_one(movement_dict)
     
-    return Invoice(**{**invoice_dict, "created_at": datetime.fromisoformat(invoice_dict["created_at"])})
+    if not strict_location:
+        await adjust_levels(db, location_deltas(location, quantities, -1))
+    await consume_layers(db, quantities)
+    await barcode_index.reload(db, [item.barcode for item in invoice_data.items])
+    
+    return Invoice(**invoice_dict)
 
 @api_router.get("/invoices", response_model=List[Invoice])
 async def get_invoices(
+    request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    params: ListParams = Depends(),
     current_user: User = Depends(get_current_user)
 ):
     query = {}
-    if start_date or end_date:
-        query["created_at"] = {}
-        if start_date:
-            query["created_at"]["$gte"] = start_date
-        if end_date:
-            query["created_at"]["$lte"] = end_date
-    
-    invoices = await db.invoices.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for inv in invoices:
-        if isinstance(inv.get('created_at'), str):
-            inv['created_at'] = datetime.fromisoformat(inv['created_at'])
-    return invoices
+    query.update(date_range_query("created_at", start_date, end_date))
+    
+    if wants_ndjson(request):
+        return stream_ndjson(db.invoices, query, Invoice, params, exclude=INVOICE_INTERNAL_FIELDS)
+    return await paginate(db.invoices, query, Invoice, params)
 
 @api_router.get("/invoices/{invoice_number}")
-async def get_invoice(invoice_number: str, current_user: User = Depends(get_current_user)):
-    invoice = await db.invoices.find_one({"invoice_number": invoice_number}, {"_id": 0})
+async def get_invoice(
+    invoice_number: str,
+    details: InvoiceDetailLoader = Depends(invoice_details),
+    current_user: User = Depends(get_current_user)
+):
+    # Invoice with payment history (abonos) and returns history (devoluciones)
+    invoice = await details.load(invoice_number)
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return invoice
+
+@api_router.get("/invoices/{invoice_number}/returnable")
+async def get_invoice_returnable(invoice_number: str, current_user: User = Depends(get_current_user)):
+    """Unidades vendidas, devueltas y disponibles para devolver por producto"""
+    invoice = await db.invoices.find_one({"invoice_number": invoice_number}, {"_id": 0, "status": 1, "items": 1})
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
-    if isinstance(invoice.get('created_at'), str):
-        invoice['created_at'] = invoice['created_at']
-    
-    # Get payment history (abonos)
-    payments = await db.fio_payments.find(
-        {"invoice_number": invoice_number}, 
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
-    
-    # Get returns history (devoluciones)
-    returns = await db.returns.find(
-        {"invoice_number": invoice_number}, 
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
-    
     return {
-        **invoice,
-        "payments_history": payments,
-        "returns_history": returns
+        "invoice_number": invoice_number,
+        "status": invoice.get("status"),
+        "items": returnable_lines(invoice)
     }
 
 # ==================== RETURNS ====================
 
 @api_router.post("/returns", response_model=Return)
 async def create_return(return_data: ReturnCreate, current_user: User = Depends(get_current_user)):
-    # Verify invoice exists
-    invoice = await db.invoices.find_one({"invoice_number": return_data.invoice_number})
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
+    if not return_data.items or any(item.quantity <= 0 for item in return_data.items):
+        raise HTTPException(status_code=400, detail="La devolución debe tener cantidades mayores a 0")
+    
+    items = [money_fields(item.model_dump(), "returns") for item in return_data.items]
+    total_return = money_sum(item["total"] for item in items)
+    quantities = basket_quantities(return_data.items)
+    if return_data.location:
+        await require_locations(return_data.location)
     
-    total_return = sum(item.total for item in return_data.items)
+    # Goods go back where they were sold from unless told otherwise
+    location = return_data.location or (await db.invoices.find_one(
+        {"invoice_number": return_data.invoice_number}, {"_id": 0, "location": 1}
+    ) or {}).get("location") or DEFAULT_LOCATION
     
     return_dict = {
         "invoice_number": return_data.invoice_number,
-        "items": [item.model_dump() for item in return_data.items],
+        "items": items,
         "total": total_return,
+        "location": location,
         "created_by": current_user.email,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
-    await db.returns.insert_one(return_dict)
-    
-    # Calculate new invoice totals after return
-    original_total = invoice.get("total", 0)
-    
-    # New total after return
-    new_total = original_total - total_return
-    
-    # Prepare update data
-    update_data = {}
-    
-    if new_total <= 0:
-        update_data["status"] = "returned"
-        update_data["total"] = 0
-    else:
-        update_data["status"] = "partial_return"
-        update_data["total"] = new_total
-    
-    # Handle "por_cobrar" invoices - update balance in Fios
-    if invoice.get("payment_status") == "por_cobrar":
-        amount_paid = invoice.get("amount_paid", 0)
-        
-        # Calculate new balance: new_total - amount_already_paid
-        new_balance = max(0, new_total - amount_paid)
-        
-        update_data["balance"] = new_balance
+    # Validate against the invoice lines and update returned_qty and totals in one
+    # write. The return document is stored with it: in one transaction when Mongo
+    # supports it, otherwise it goes in first and is removed if the invoice rejects it
+    if supports_transactions():
+        async def record(session):
+            if not await apply_return(db, return_data.invoice_number, quantities, total_return, session=session):
+                return False
+            await db.returns.insert_one(return_dict, session=session)
+            return True
         
-        # If balance is 0 or less, mark as paid
-        if new_balance <= 0:
-            update_data["payment_status"] = "pagado"
-            update_data["balance"] = 0
-            # If there was overpayment due to return, adjust amount_paid
-            if amount_paid > new_total:
-                update_data["amount_paid"] = max(0, new_total)
-    
-    # Update invoice
-    await db.invoices.update_one(
-        {"invoice_number": return_data.invoice_number},
-        {"$set": update_data}
-    )
+        async with await db.client.start_session() as session:
+            applied = await session.with_transaction(record)
+    else:
+        await db.returns.insert_one(return_dict)
+        applied = False
+        try:
+            applied = await apply_return(db, return_data.invoice_number, quantities, total_return)
+        finally:
+            if not applied:
+                await db.returns.delete_one({"_id": return_dict["_id"]})
+    if not applied:
+        invoice = await db.invoices.find_one({"invoice_number": return_data.invoice_number}, {"_id": 0, "items": 1})
+        if not invoice:
+            raise HTTPException(status_code=404, detail="Invoice not found")
+        returnable = {line["barcode"]: line["returnable"] for line in returnable_lines(invoice)}
+        exceeded = [
+            f"{barcode} ({returnable.get(barcode, 0)} disponibles)"
+            for barcode, quantity in quantities.items() if quantity > returnable.get(barcode, 0)
+        ]
+        raise HTTPException(status_code=400, detail=f"Cantidad a devolver excede lo vendido: {', '.join(exceeded)}")
     
     # Update inventory and create movements
     for item in return_data.items:
         await db.products.update_one(
             {"barcode": item.barcode},
-            {"$inc": {"stock": item.quantity}}
+            {"$inc": {"stock": item.quantity}, "$set": {"sync_version": sync_stamp()}}
         )
         
         movement_dict = {
@@ -1043,20 +1342,27 @@ async def create_return(return_data: ReturnCreate, current_user: User = Depends(
             "movement_type": "return",
             "quantity": item.quantity,
             "reference": return_data.invoice_number,
+            "location": location,
             "created_by": current_user.email,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         await db.inventory_movements.insert_one(movement_dict)
     
-    return Return(**{**return_dict, "created_at": datetime.fromisoformat(return_dict["created_at"])})
+    await adjust_levels(db, location_deltas(location, quantities))
+    await restore_layers(db, quantities)
+    await barcode_index.reload(db, [item.barcode for item in return_data.items])
+    
+    return Return(**return_dict)
 
 @api_router.get("/returns", response_model=List[Return])
-async def get_returns(current_user: User = Depends(get_current_user)):
-    returns = await db.returns.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for ret in returns:
-        if isinstance(ret.get('created_at'), str):
-            ret['created_at'] = datetime.fromisoformat(ret['created_at'])
-    return returns
+async def get_returns(
+    request: Request,
+    params: ListParams = Depends(),
+    current_user: User = Depends(get_current_user)
+):
+    if wants_ndjson(request):
+        return stream_ndjson(db.returns, {}, Return, params)
+    return await paginate(db.returns, {}, Return, params)
 
 # ==================== FIOS (CREDITS/PAYMENTS) ====================
 
@@ -1110,9 +1416,9 @@ async def get_fios_client_detail(client_document: str, current_user: User = Depe
     }, {"_id": 0}).sort("created_at", -1).to_list(1000)
     
     # Calculate totals
-    total_credit = sum(inv["total"] for inv in invoices)
-    total_paid = sum(inv["amount_paid"] for inv in invoices)
-    total_balance = sum(inv["balance"] for inv in invoices)
+    total_credit = money_sum(inv["total"] for inv in invoices)
+    total_paid = money_sum(inv.get("amount_paid") for inv in invoices)
+    total_balance = money_sum(inv.get("balance") for inv in invoices)
     
     return {
         "client": {
@@ -1132,19 +1438,22 @@ async def get_fios_client_detail(client_document: str, current_user: User = Depe
     }
 
 @api_router.get("/fios/invoice/{invoice_number}")
-async def get_fios_invoice_detail(invoice_number: str, current_user: User = Depends(get_current_user)):
+async def get_fios_invoice_detail(
+    invoice_number: str,
+    details: InvoiceDetailLoader = Depends(invoice_details),
+    current_user: User = Depends(get_current_user)
+):
     """Obtener detalle de una factura por cobrar específica"""
-    invoice = await db.invoices.find_one({"invoice_number": invoice_number}, {"_id": 0})
+    invoice = await details.load(invoice_number)
     if not invoice:
         raise HTTPException(status_code=404, detail="Factura no encontrada")
     
     if invoice.get("payment_status") != "por_cobrar":
         raise HTTPException(status_code=400, detail="Esta factura no es una cuenta por cobrar")
     
-    # Get payment history for this invoice
-    payments = await db.fio_payments.find({
-        "invoice_number": invoice_number
-    }, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    # Payment history comes with the invoice
+    payments = invoice.pop("payments_history")
+    invoice.pop("returns_history")
     
     return {
         "invoice": invoice,
@@ -1174,12 +1483,13 @@ async def register_fio_payment(
     if not payment_method:
         raise HTTPException(status_code=400, detail="La forma de pago seleccionada no existe o no está activa")
     
-    # Validate payment amount
-    current_balance = invoice.get("balance", invoice["total"])
-    if payment.amount <= 0:
+    # Validate payment amount (exact, in cents)
+    amount = to_money(payment.amount)
+    current_balance = to_money(invoice.get("balance", invoice["total"]))
+    if amount <= 0:
         raise HTTPException(status_code=400, detail="El monto del abono debe ser mayor a 0")
-    if payment.amount > current_balance:
-        raise HTTPException(status_code=400, detail=f"El monto del abono (${payment.amount:,.2f}) excede el saldo pendiente (${current_balance:,.2f})")
+    if amount > current_balance:
+        raise HTTPException(status_code=400, detail=f"El monto del abono (${amount:,.2f}) excede el saldo pendiente (${current_balance:,.2f})")
     
     # Generate payment ID
     import uuid
@@ -1189,11 +1499,11 @@ async def register_fio_payment(
     payment_dict = {
         "payment_id": payment_id,
         "invoice_number": invoice_number,
-        "amount": payment.amount,
+        "amount": amount,
         "payment_method": payment.payment_method,
         "notes": payment.notes,
         "created_by": current_user.email,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.fio_payments.insert_one(payment_dict)
@@ -1202,8 +1512,8 @@ async def register_fio_payment(
     payment_response = {k: v for k, v in payment_dict.items() if k != '_id'}
     
     # Update invoice balance
-    new_amount_paid = invoice.get("amount_paid", 0) + payment.amount
-    new_balance = invoice["total"] - new_amount_paid
+    new_amount_paid = to_money(invoice.get("amount_paid")) + amount
+    new_balance = to_money(invoice["total"]) - new_amount_paid
     
     # If fully paid, update payment_status
     update_data = {
@@ -1244,78 +1554,412 @@ async def get_invoice_payments(invoice_number: str, current_user: User = Depends
 
 @api_router.post("/purchases", response_model=Purchase)
 async def create_purchase(purchase_data: PurchaseCreate, current_user: User = Depends(get_current_user)):
-    total = sum(item.total for item in purchase_data.items)
+    location = purchase_data.location or DEFAULT_LOCATION
+    await require_locations(location)
+    items = [money_fields(item.model_dump(), "purchases") for item in purchase_data.items]
+    total = money_sum(item["total"] for item in items)
     
     purchase_dict = {
         "supplier_name": purchase_data.supplier_name,
-        "items": [item.model_dump() for item in purchase_data.items],
+        "items": items,
         "total": total,
+        "location": location,
         "created_by": current_user.email,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.purchases.insert_one(purchase_dict)
     
-    # Update inventory and create movements
-    for item in purchase_data.items:
-        await db.products.update_one(
-            {"barcode": item.barcode},
-            {"$inc": {"stock": item.quantity}}
-        )
-        
-        movement_dict = {
+    # Update stock and average cost in one bulk write, then record the movements
+    lines = [(item.barcode, item.quantity, item.unit_cost) for item in purchase_data.items]
+    await apply_costed_stock(db, lines)
+    await receive_layers(db, lines)
+    await db.inventory_movements.insert_many([
+        {
             "barcode": item.barcode,
             "product_name": item.product_name,
             "movement_type": "purchase",
             "quantity": item.quantity,
             "reference": purchase_data.supplier_name,
+            "location": location,
             "created_by": current_user.email,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
-        await db.inventory_movements.insert_one(movement_dict)
+        for item in purchase_data.items
+    ])
+    await adjust_levels(db, location_deltas(location, basket_quantities(purchase_data.items)))
+    
+    await barcode_index.reload(db, [item.barcode for item in purchase_data.items])
     
-    return Purchase(**{**purchase_dict, "created_at": datetime.fromisoformat(purchase_dict["created_at"])})
+    return Purchase(**purchase_dict)
 
 @api_router.get("/purchases", response_model=List[Purchase])
-async def get_purchases(current_user: User = Depends(get_current_user)):
-    purchases = await db.purchases.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for purch in purchases:
-        if isinstance(purch.get('created_at'), str):
-            purch['created_at'] = datetime.fromisoformat(purch['created_at'])
-    return purchases
+async def get_purchases(params: ListParams = Depends(), current_user: User = Depends(get_current_user)):
+    return await paginate(db.purchases, {}, Purchase, params)
+
+@api_router.post("/supplier-returns", response_model=SupplierReturn)
+async def create_supplier_return(return_data: SupplierReturnCreate, current_user: User = Depends(get_current_user)):
+    """Devolver mercancía a un proveedor: descuenta stock y retira las unidades a su costo"""
+    if any(item.quantity <= 0 for item in return_data.items):
+        raise HTTPException(status_code=400, detail="La devolución debe tener cantidades mayores a 0")
+    location = return_data.location or DEFAULT_LOCATION
+    await require_locations(location)
+    items = [money_fields(item.model_dump(), "supplier_returns") for item in return_data.items]
+    return_dict = {
+        "supplier_name": return_data.supplier_name,
+        "items": items,
+        "total": money_sum(item["total"] for item in items),
+        "reason": return_data.reason,
+        "location": location,
+        "created_by": current_user.email,
+        "created_at": datetime.now(timezone.utc)
+    }
+    
+    # Take the units first, all or nothing and never more than are on hand (at the
+    # location too once every unit has one); the document is written only after
+    quantities = basket_quantities(return_data.items)
+    levels_location = location if levels_seeded() else None
+    try:
+        await decrement_stock(db, quantities, location=levels_location)
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=f"Stock insuficiente: {e}")
+    try:
+        await db.supplier_returns.insert_one(return_dict)
+    except Exception:
+        await restore_stock(db, quantities, location=levels_location)
+        raise
+    
+    # One cost update per product, at the average cost of its returned lines
+    values = {}
+    for item in return_data.items:
+        values[item.barcode] = values.get(item.barcode, 0) + item.quantity * float(item.unit_cost)
+    await apply_costed_stock(db, [
+        (barcode, -quantity, values[barcode] / quantity) for barcode, quantity in quantities.items()
+    ], stock_applied=True)
+    if not levels_location:
+        await adjust_levels(db, location_deltas(location, quantities, -1))
+    await return_layers(db, [(item.barcode, item.quantity, item.unit_cost) for item in return_data.items])
+    await db.inventory_movements.insert_many([
+        {
+            "barcode": item.barcode,
+            "product_name": item.product_name,
+            "movement_type": "supplier_return",
+            "quantity": -item.quantity,
+            "unit_cost": item.unit_cost,
+            "reference": return_data.supplier_name,
+            "location": location,
+            "created_by": current_user.email,
+            "created_at": datetime.now(timezone.utc)
+        }
+        for item in return_data.items
+    ])
+    
+    await barcode_index.reload(db, [item.barcode for item in return_data.items])
+    
+    return SupplierReturn(**return_dict)
+
+@api_router.get("/supplier-returns", response_model=List[SupplierReturn])
+async def get_supplier_returns(params: ListParams = Depends(), current_user: User = Depends(get_current_user)):
+    return await paginate(db.supplier_returns, {}, SupplierReturn, params)
+
+@api_router.get("/purchases/suggestions")
+async def get_purchase_suggestions(
+    days: int = Query(SUGGESTION_WINDOW_DAYS, ge=7, le=365),
+    supplier: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Cantidades a pedir por proveedor según la venta diaria de los últimos `days` días"""
+    suggestions = await purchase_suggestions.get(db, days)
+    if supplier is not None:
+        suggestions = {
+            **suggestions,
+            "suppliers": [group for group in suggestions["suppliers"] if group["supplier_name"] == supplier]
+        }
+    return suggestions
 
 # ==================== INVENTORY ====================
 
 @api_router.get("/inventory", response_model=List[Product])
-async def get_inventory(current_user: User = Depends(get_current_user)):
-    products = await db.products.find({}, {"_id": 0}).to_list(1000)
-    for prod in products:
-        if isinstance(prod.get('created_at'), str):
-            prod['created_at'] = datetime.fromisoformat(prod['created_at'])
-    return products
+async def get_inventory(params: ListParams = Depends(), current_user: User = Depends(get_current_user)):
+    return await paginate(db.products, {}, Product, params, exclude=SYNC_EXCLUDED_FIELDS["products"])
 
 @api_router.get("/inventory/movements", response_model=List[InventoryMovement])
 async def get_inventory_movements(
+    request: Request,
     barcode: Optional[str] = None,
+    location: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    params: ListParams = Depends(),
+    current_user: User = Depends(get_current_user)
+):
+    query = {}
+    if barcode:
+        query["barcode"] = barcode
+    if location:
+        # Movements from before locations belong to the default one
+        query["location"] = {"$in": [location, None]} if location == DEFAULT_LOCATION else location
+    query.update(date_range_query("created_at", start_date, end_date))
+    
+    if wants_ndjson(request):
+        return stream_ndjson(db.inventory_movements, query, InventoryMovement, params)
+    return await paginate(db.inventory_movements, query, InventoryMovement, params)
+
+@api_router.get("/inventory/levels", response_model=List[StockLevel])
+async def get_stock_levels(
+    location: Optional[str] = None,
+    barcode: Optional[str] = None,
+    params: ListParams = Depends(),
     current_user: User = Depends(get_current_user)
 ):
+    """Existencias por ubicación (el total del producto sigue en products.stock)"""
     query = {}
+    if location:
+        query["location"] = location
     if barcode:
         query["barcode"] = barcode
-    if start_date or end_date:
-        query["created_at"] = {}
-        if start_date:
-            query["created_at"]["$gte"] = start_date
-        if end_date:
-            query["created_at"]["$lte"] = end_date
-    
-    movements = await db.inventory_movements.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for mov in movements:
-        if isinstance(mov.get('created_at'), str):
-            mov['created_at'] = datetime.fromisoformat(mov['created_at'])
-    return movements
+    return await paginate(db.stock_levels, query, StockLevel, params)
+
+@api_router.post("/inventory/transfer")
+async def transfer_between_locations(transfer: StockTransferCreate, current_user: User = Depends(get_current_user)):
+    """Trasladar unidades entre ubicaciones en una sola operación (todo o nada)"""
+    if transfer.from_location == transfer.to_location:
+        raise HTTPException(status_code=400, detail="El origen y el destino deben ser distintos")
+    await require_locations(transfer.from_location, transfer.to_location)
+    quantities = basket_quantities(transfer.items)
+    names = {
+        product["barcode"]: product["name"]
+        async for product in db.products.find({"barcode": {"$in": list(quantities)}}, {"_id": 0, "barcode": 1, "name": 1})
+    }
+    missing = sorted(set(quantities) - set(names))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Productos no encontrados: {', '.join(missing)}")
+    
+    try:
+        await transfer_stock(db, transfer.from_location, transfer.to_location, quantities)
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=f"Stock insuficiente en {transfer.from_location}: {e}")
+    
+    now = datetime.now(timezone.utc)
+    reference = f"{transfer.from_location} -> {transfer.to_location}"
+    await db.inventory_movements.insert_many([
+        {
+            "barcode": barcode,
+            "product_name": names[barcode],
+            "movement_type": movement_type,
+            "quantity": sign * quantity,
+            "reference": reference,
+            "location": location,
+            "created_by": current_user.email,
+            "created_at": now
+        }
+        for barcode, quantity in quantities.items()
+        for movement_type, sign, location in (
+            ("transfer_out", -1, transfer.from_location),
+            ("transfer_in", 1, transfer.to_location),
+        )
+    ])
+    return {
+        "from_location": transfer.from_location,
+        "to_location": transfer.to_location,
+        "items": [{"barcode": barcode, "quantity": quantity} for barcode, quantity in quantities.items()]
+    }
+
+# ==================== TRANSFERS ====================
+
+async def transfer_or_404(transfer_number: str) -> dict:
+    transfer = await db.stock_transfers.find_one({"transfer_number": transfer_number}, {"_id": 0})
+    if not transfer:
+        raise HTTPException(status_code=404, detail="Traslado no encontrado")
+    return transfer
+
+@api_router.post("/transfers", response_model=Transfer)
+async def create_stock_transfer(transfer_data: TransferCreate, current_user: User = Depends(get_current_user)):
+    """Crear un traslado en borrador (o despacharlo de una vez con `dispatch`)"""
+    if transfer_data.from_location == transfer_data.to_location:
+        raise HTTPException(status_code=400, detail="El origen y el destino deben ser distintos")
+    await require_locations(transfer_data.from_location, transfer_data.to_location)
+    quantities = basket_quantities(transfer_data.items)
+    names = {
+        product["barcode"]: product["name"]
+        async for product in db.products.find({"barcode": {"$in": list(quantities)}}, {"_id": 0, "barcode": 1, "name": 1})
+    }
+    missing = sorted(set(quantities) - set(names))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Productos no encontrados: {', '.join(missing)}")
+    
+    transfer = await create_transfer(
+        db, transfer_data.from_location, transfer_data.to_location, quantities, names,
+        current_user.email, transfer_data.notes
+    )
+    if not transfer_data.dispatch:
+        return Transfer(**transfer)
+    try:
+        transfer = await dispatch_transfer(db, transfer["transfer_number"], current_user.email)
+    except InsufficientStock as e:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Traslado {transfer['transfer_number']} guardado como borrador; stock insuficiente en {transfer_data.from_location}: {e}"
+        )
+    return Transfer(**transfer)
+
+@api_router.get("/transfers", response_model=List[Transfer])
+async def get_stock_transfers(
+    status: Optional[str] = Query(None, pattern="^(draft|in_transit|received)$"),
+    location: Optional[str] = None,
+    params: ListParams = Depends(),
+    current_user: User = Depends(get_current_user)
+):
+    query = {}
+    if status:
+        query["status"] = status
+    if location:
+        query["$or"] = [{"from_location": location}, {"to_location": location}]
+    return await paginate(db.stock_transfers, query, Transfer, params)
+
+@api_router.get("/transfers/{transfer_number}", response_model=Transfer)
+async def get_stock_transfer(transfer_number: str, current_user: User = Depends(get_current_user)):
+    return Transfer(**await transfer_or_404(transfer_number))
+
+@api_router.post("/transfers/{transfer_number}/dispatch", response_model=Transfer)
+async def dispatch_stock_transfer(transfer_number: str, current_user: User = Depends(get_current_user)):
+    """Descontar el origen: las unidades quedan en tránsito hasta recibirlas"""
+    try:
+        transfer = await dispatch_transfer(db, transfer_number, current_user.email)
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=f"Stock insuficiente en el origen: {e}")
+    if not transfer:
+        current = await transfer_or_404(transfer_number)
+        raise HTTPException(status_code=409, detail=f"El traslado ya no es un borrador ({current['status']})")
+    return Transfer(**transfer)
+
+@api_router.post("/transfers/{transfer_number}/receive", response_model=Transfer)
+async def receive_stock_transfer(
+    transfer_number: str,
+    receipt: Optional[TransferReceive] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Recibir en el destino todo lo pendiente o solo las cantidades indicadas"""
+    current = await transfer_or_404(transfer_number)
+    if current["status"] != IN_TRANSIT:
+        raise HTTPException(status_code=409, detail=f"El traslado no está en tránsito ({current['status']})")
+    pending = outstanding(current)
+    quantities = basket_quantities(receipt.items) if receipt and receipt.items else pending
+    excess = sorted(barcode for barcode, quantity in quantities.items() if quantity > pending.get(barcode, 0))
+    if excess:
+        raise HTTPException(status_code=400, detail=f"Cantidad mayor a la pendiente: {', '.join(excess)}")
+    
+    try:
+        transfer = await receive_transfer(db, transfer_number, quantities, current_user.email)
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=f"Stock insuficiente en tránsito: {e}")
+    if not transfer:
+        # Another receipt or a state change won the race
+        raise HTTPException(status_code=409, detail="El traslado cambió mientras se recibía; consulte de nuevo")
+    return Transfer(**transfer)
+
+@api_router.get("/inventory/low-stock")
+async def get_low_stock(category: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Productos bajo su stock mínimo, con la cantidad sugerida a pedir"""
+    return low_stock_products.items(category)
+
+@api_router.get("/inventory/as-of")
+async def get_inventory_as_of(
+    date: str,
+    barcode: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Existencias según los movimientos en una fecha (fin del día si no trae hora)"""
+    instant = parse_date_param(date, end=True) + timedelta(microseconds=1)
+    snapshot_at, stock = await stock_at(db, instant, barcode)
+    if barcode:
+        stock.setdefault(barcode, 0)
+    names = {
+        product["barcode"]: product["name"]
+        async for product in db.products.find({"barcode": {"$in": list(stock)}}, {"_id": 0, "barcode": 1, "name": 1})
+    }
+    return {
+        "date": date,
+        "snapshot_at": snapshot_at,
+        "items": [
+            {"barcode": code, "product_name": names.get(code), "stock": quantity}
+            for code, quantity in sorted(stock.items())
+        ]
+    }
+
+def kardex_period(start_date: Optional[str], end_date: Optional[str]):
+    start = parse_date_param(start_date) if start_date else None
+    end = parse_date_param(end_date, end=True) + timedelta(microseconds=1) if end_date else None
+    return start, end
+
+async def kardex_response(request: Request, rows, report_format: str, filename: str):
+    if report_format == "xlsx":
+        return await stream_xlsx(rows, f"{filename}.xlsx")
+    return stream_json(rows, ndjson=wants_ndjson(request))
+
+@api_router.get("/inventory/kardex")
+async def get_kardex(
+    request: Request,
+    barcodes: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    report_format: str = Query("json", alias="format", pattern="^(json|xlsx)$"),
+    current_user: User = Depends(get_current_user)
+):
+    """Kardex de varios productos (códigos separados por coma) o de todos"""
+    require_native_dates()
+    start, end = kardex_period(start_date, end_date)
+    codes = [code.strip() for code in barcodes.split(",") if code.strip()] if barcodes else None
+    rows = kardex_rows(db, codes, start, end)
+    return await kardex_response(request, rows, report_format, "kardex")
+
+@api_router.get("/inventory/kardex/{barcode}")
+async def get_product_kardex(
+    request: Request,
+    barcode: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    report_format: str = Query("json", alias="format", pattern="^(json|xlsx)$"),
+    current_user: User = Depends(get_current_user)
+):
+    """Kardex de un producto: saldo inicial, movimientos con saldo y saldo final"""
+    require_native_dates()
+    start, end = kardex_period(start_date, end_date)
+    if not await db.products.find_one({"barcode": barcode}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    rows = kardex_rows(db, [barcode], start, end)
+    return await kardex_response(request, rows, report_format, f"kardex_{barcode}")
+
+@api_router.get("/inventory/reconciliation")
+async def get_inventory_reconciliation(current_user: User = Depends(get_current_user)):
+    """Última conciliación de products.stock contra los movimientos"""
+    report = await db.stock_reconciliations.find_one({}, {"_id": 0}, sort=[("checked_at", -1)])
+    if not report:
+        raise HTTPException(status_code=404, detail="Aún no hay conciliaciones")
+    return report
+
+@api_router.get("/inventory/reconciliation/drift", response_model=List[StockDrift])
+async def get_inventory_drift(
+    run_id: Optional[str] = None,
+    barcode: Optional[str] = None,
+    params: ListParams = Depends(),
+    current_user: User = Depends(get_current_user)
+):
+    """Todas las diferencias de una conciliación (por defecto la última)"""
+    if run_id is None:
+        report = await db.stock_reconciliations.find_one({}, {"_id": 0, "run_id": 1}, sort=[("checked_at", -1)])
+        if not report or "run_id" not in report:
+            raise HTTPException(status_code=404, detail="Aún no hay conciliaciones")
+        run_id = report["run_id"]
+    query = {"run_id": run_id}
+    if barcode:
+        query["barcode"] = barcode
+    return await paginate(db.stock_drift, query, StockDrift, params)
+
+@api_router.post("/inventory/reconciliation")
+async def run_inventory_reconciliation(current_user: User = Depends(get_current_user)):
+    """Conciliar ahora"""
+    return await reconcile(db)
 
 # ==================== REPORTS ====================
 
@@ -1326,40 +1970,94 @@ async def get_sales_report(
     current_user: User = Depends(get_current_user)
 ):
     query = {"status": "completed"}
-    if start_date or end_date:
-        query["created_at"] = {}
-        if start_date:
-            query["created_at"]["$gte"] = start_date
-        if end_date:
-            query["created_at"]["$lte"] = end_date
+    query.update(date_range_query("created_at", start_date, end_date))
     
-    invoices = await db.invoices.find(query, {"_id": 0}).to_list(1000)
+    invoices = await db.invoices.find(query, INVOICE_PROJECTION).to_list(1000)
     
-    total_sales = sum(inv["total"] for inv in invoices)
-    total_tax = sum(inv["total_tax"] for inv in invoices)
+    # Totals over every matching invoice, not just the ones listed
+    totals = await db.invoices.aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": None,
+            "total_invoices": {"$sum": 1},
+            "total_sales": {"$sum": "$total"},
+            "total_tax": {"$sum": "$total_tax"}
+        }}
+    ]).to_list(1)
+    summary = totals[0] if totals else {"total_invoices": 0, "total_sales": ZERO, "total_tax": ZERO}
     
     return {
         "invoices": invoices,
         "summary": {
-            "total_invoices": len(invoices),
-            "total_sales": total_sales,
-            "total_tax": total_tax
+            "total_invoices": summary["total_invoices"],
+            "total_sales": summary["total_sales"],
+            "total_tax": summary["total_tax"]
         }
     }
 
+@api_router.get("/reports/sales/timeline")
+async def get_sales_timeline(
+    group_by: str = Query("day", pattern="^(day|week|month)$"),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Ventas agrupadas por día, semana o mes (agregadas en Mongo)"""
+    query = {"status": "completed"}
+    query.update(date_range_query("created_at", start_date, end_date))
+    
+    pipeline = [
+        {"$match": query},
+        {"$group": {
+            "_id": bucket_expr("created_at", group_by),
+            "total_invoices": {"$sum": 1},
+            "total_sales": {"$sum": "$total"},
+            "total_tax": {"$sum": "$total_tax"}
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {
+            "_id": 0,
+            "period": "$_id",
+            "total_invoices": 1,
+            "total_sales": 1,
+            "total_tax": 1
+        }}
+    ]
+    buckets = await db.invoices.aggregate(pipeline).to_list(None)
+    return {"group_by": group_by, "buckets": buckets}
+
+@api_router.get("/reports/valuation")
+async def get_valuation_report(
+    method: str = Query("fifo", pattern="^(fifo|average)$"),
+    category: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Valor del inventario por producto: capas FIFO o costo promedio (purchase_price)"""
+    report = await valuation(db, method, category)
+    return Response(content=to_json(report), media_type="application/json")
+
 @api_router.get("/reports/inventory")
 async def get_inventory_report(current_user: User = Depends(get_current_user)):
     products = await db.products.find({}, {"_id": 0}).to_list(1000)
     
-    total_value = sum(p["purchase_price"] * p["stock"] for p in products)
-    low_stock = [p for p in products if p["stock"] < 10]
+    # Totals over every product, not just the ones listed
+    totals = await db.products.aggregate([
+        {"$group": {
+            "_id": None,
+            "total_products": {"$sum": 1},
+            "total_value": {"$sum": {"$multiply": [
+                {"$ifNull": ["$purchase_price", 0]}, {"$ifNull": ["$stock", 0]}
+            ]}}
+        }}
+    ]).to_list(1)
+    summary = totals[0] if totals else {"total_products": 0, "total_value": 0}
     
     return {
         "products": products,
         "summary": {
-            "total_products": len(products),
-            "total_value": total_value,
-            "low_stock_count": len(low_stock)
+            "total_products": summary["total_products"],
+            "total_value": summary["total_value"],
+            "low_stock_count": len(low_stock_products)
         }
     }
 
@@ -1372,21 +2070,36 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
     total_clients = await db.clients.count_documents({})
     total_invoices = await db.invoices.count_documents({"status": "completed"})
     
-    # Calculate total sales
-    invoices = await db.invoices.find({"status": "completed"}, {"_id": 0, "total": 1}).to_list(10000)
-    total_sales = sum(inv["total"] for inv in invoices)
-    
-    # Low stock products
-    low_stock = await db.products.count_documents({"stock": {"$lt": 10}})
+    # Calculate total sales (summed in Mongo, exact on Decimal128)
+    totals = await db.invoices.aggregate([
+        {"$match": {"status": "completed"}},
+        {"$group": {"_id": None, "total_sales": {"$sum": "$total"}}}
+    ]).to_list(1)
+    total_sales = to_money(totals[0]["total_sales"]) if totals else ZERO
     
     return {
         "total_products": total_products,
         "total_clients": total_clients,
         "total_invoices": total_invoices,
         "total_sales": total_sales,
-        "low_stock_products": low_stock
+        "low_stock_products": len(low_stock_products)
     }
 
+# ==================== CATALOG SYNC (POS TERMINALS) ====================
+
+@api_router.get("/sync/catalog")
+async def sync_catalog(
+    since: Optional[str] = None,
+    limit: int = Query(5000, ge=1, le=50000),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Cambios del catálogo (productos, categorías, listas de precios, IVA,
+    formas de pago y clientes) desde el token `since`; con has_more, el
+    token devuelto trae la página siguiente
+    """
+    return await get_catalog_changes(db, since, limit)
+
 # ==================== IMPORT ENDPOINTS ====================
 
 class ImportResult(BaseModel):
@@ -1435,7 +2148,8 @@ async def import_categories(file: UploadFile = File(...), current_user: User = D
             category_data = {
                 "name": str(row['name']),
                 "description": str(row.get('description', '')) if pd.notna(row.get('description')) else '',
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "sync_version": sync_stamp()
             }
             
             await db.categories.insert_one(category_data)
@@ -1443,6 +2157,8 @@ async def import_categories(file: UploadFile = File(...), current_user: User = D
         except Exception as e:
             errors.append({"row": index + 2, "error": str(e)})
     
+    catalog_cache.invalidate("categories")
+    
     return ImportResult(success=success_count, errors=errors, total=len(df))
 
 @api_router.post("/import/products", response_model=ImportResult)
@@ -1450,7 +2166,7 @@ async def import_products(file: UploadFile = File(...), current_user: User = Dep
     """
     Importar productos desde CSV o Excel
     Columnas requeridas: barcode, name, category, purchase_price, tax_rate
-    Columnas opcionales: description, price_default, price_mayorista, price_minorista
+    Columnas opcionales: description, price_default, price_mayorista, price_minorista, min_stock, reorder_qty
     """
     df = read_file(file)
     
@@ -1494,10 +2210,19 @@ async def import_products(file: UploadFile = File(...), current_user: User = Dep
                 "tax_rate": float(row['tax_rate']),
                 "prices": prices,
                 "stock": 0,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "min_stock": int(row['min_stock']) if pd.notna(row.get('min_stock')) else LOW_STOCK_THRESHOLD,
+                "reorder_qty": int(row['reorder_qty']) if pd.notna(row.get('reorder_qty')) else 0,
+                "created_at": datetime.now(timezone.utc),
+                "sync_version": sync_stamp(),
+                **search_fields(row['barcode'], row['name'])
             }
             
+            if product_data["min_stock"] < 0 or product_data["reorder_qty"] < 0:
+                errors.append({"row": index + 2, "error": "min_stock y reorder_qty no pueden ser negativos"})
+                continue
+            
             await db.products.insert_one(product_data)
+            barcode_index.put(product_data)
             success_count += 1
         except Exception as e:
             errors.append({"row": index + 2, "error": str(e)})
@@ -1548,7 +2273,8 @@ async def import_clients(file: UploadFile = File(...), current_user: User = Depe
                 "latitude": float(row['latitude']) if pd.notna(row.get('latitude')) else None,
                 "longitude": float(row['longitude']) if pd.notna(row.get('longitude')) else None,
                 "price_list": str(row.get('price_list', 'default')) if pd.notna(row.get('price_list')) else 'default',
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "sync_version": sync_stamp()
             }
             
             await db.clients.insert_one(client_data)
@@ -1582,7 +2308,7 @@ async def import_suppliers(file: UploadFile = File(...), current_user: User = De
                 "phone": str(row.get('phone', '')) if pd.notna(row.get('phone')) else None,
                 "email": str(row.get('email', '')) if pd.notna(row.get('email')) else None,
                 "address": str(row.get('address', '')) if pd.notna(row.get('address')) else None,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
             
             await db.suppliers.insert_one(supplier_data)
@@ -1590,6 +2316,8 @@ async def import_suppliers(file: UploadFile = File(...), current_user: User = De
         except Exception as e:
             errors.append({"row": index + 2, "error": str(e)})
     
+    catalog_cache.invalidate("suppliers")
+    
     return ImportResult(success=success_count, errors=errors, total=len(df))
 
 @api_router.get("/import/templates/{module_name}")
@@ -1673,7 +2401,7 @@ async def get_ticket_config(current_user: User = Depends(get_current_user)):
 async def update_ticket_config(config: TicketConfigUpdate, current_user: User = Depends(get_current_user)):
     """Actualizar o crear la configuración del ticket"""
     update_data = {k: v for k, v in config.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
     # Check if config exists
     existing = await db.ticket_config.find_one({})
@@ -1690,7 +2418,7 @@ async def update_ticket_config(config: TicketConfigUpdate, current_user: User =
             "address": "",
             "ticket_width": 80,
             "footer_message": "¡Gracias por su compra!",
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }
         default_config.update(update_data)
         await db.ticket_config.insert_one(default_config)
@@ -1700,31 +2428,19 @@ async def update_ticket_config(config: TicketConfigUpdate, current_user: User =
 
 # ==================== INVOICES ENHANCED (WITH PDF TICKETS) ====================
 
-@api_router.get("/pos/invoices")
-async def get_pos_invoices(
+def build_pos_invoices_query(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     client_document: Optional[str] = None,
     user_email: Optional[str] = None,
     invoice_number: Optional[str] = None,
-    status: Optional[str] = None,
-    page: int = Query(1, ge=1),
-    limit: int = Query(20, ge=1, le=100),
-    current_user: User = Depends(get_current_user)
-):
-    """Listar facturas POS con filtros y paginación"""
+    status: Optional[str] = None
+) -> dict:
+    """Construir el filtro de facturas POS (listado y exportación por lotes)"""
     query = {}
     
-    # Apply filters
-    if start_date:
-        if "created_at" not in query:
-            query["created_at"] = {}
-        query["created_at"]["$gte"] = start_date
-    
-    if end_date:
-        if "created_at" not in query:
-            query["created_at"] = {}
-        query["created_at"]["$lte"] = end_date + "T23:59:59"
+    # Apply filters (a date-only end_date covers the whole day)
+    query.update(date_range_query("created_at", start_date, end_date))
     
     if client_document:
         query["client_document"] = {"$regex": client_document, "$options": "i"}
@@ -1738,6 +2454,78 @@ async def get_pos_invoices(
     if status:
         query["status"] = status
     
+    return query
+
+async def load_ticket_config() -> dict:
+    """Obtener la configuración del ticket o la configuración por defecto"""
+    config = await db.ticket_config.find_one({}, {"_id": 0})
+    if not config:
+        config = {
+            "company_name": "Mi Empresa",
+            "nit": "",
+            "phone": "",
+            "email": "",
+            "address": "",
+            "ticket_width": 80,
+            "footer_message": "¡Gracias por su compra!"
+        }
+    return config
+
+def build_ticket_data(invoice: dict, returns: List[dict]) -> dict:
+    """Preparar los datos de una factura para el generador de tickets"""
+    return {
+        "invoice_number": invoice["invoice_number"],
+        "client_name": invoice.get("client_name", "Cliente General"),
+        "client_document": invoice.get("client_document", ""),
+        "items": invoice.get("items", []),
+        "subtotal": invoice.get("subtotal", 0),
+        "total_tax": invoice.get("total_tax", 0),
+        "total": invoice.get("total", 0),
+        "created_at": invoice.get("created_at"),
+        "created_by": invoice.get("created_by", ""),
+        "returns": returns  # Include returns data
+    }
+
+@api_router.post("/pos/reservations")
+async def create_reservation(reservation: ReservationCreate, current_user: User = Depends(get_current_user)):
+    """Apartar las unidades de una canasta por RESERVATION_TTL segundos (modo stock estricto)"""
+    if not STRICT_STOCK:
+        raise HTTPException(status_code=400, detail="Las reservas requieren el modo de stock estricto (STRICT_STOCK=1)")
+    try:
+        return await reserve(db, basket_quantities(reservation.items), reservation.basket_id)
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=f"Stock insuficiente: {e}")
+
+@api_router.delete("/pos/reservations/{basket_id}")
+async def delete_reservation(basket_id: str, current_user: User = Depends(get_current_user)):
+    """Liberar la reserva de una canasta"""
+    if not await release_reservation(db, basket_id):
+        raise HTTPException(status_code=404, detail="Reserva no encontrada o vencida")
+    return {"message": "Reserva liberada"}
+
+@api_router.post("/pos/sync")
+async def sync_offline_sales(batch: PosSyncRequest, current_user: User = Depends(get_current_user)):
+    """Registrar las ventas que el POS hizo sin conexión (se puede reintentar)"""
+    results = await sync_sales(db, [sale.model_dump() for sale in batch.sales], current_user.email)
+    await barcode_index.reload(db, {item.barcode for sale in batch.sales for item in sale.items})
+    summary = {status: sum(1 for r in results if r["status"] == status) for status in ("created", "duplicate", "error")}
+    return {**summary, "results": results}
+
+@api_router.get("/pos/invoices")
+async def get_pos_invoices(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    client_document: Optional[str] = None,
+    user_email: Optional[str] = None,
+    invoice_number: Optional[str] = None,
+    status: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """Listar facturas POS con filtros y paginación"""
+    query = build_pos_invoices_query(start_date, end_date, client_document, user_email, invoice_number, status)
+    
     # Get total count for pagination
     total = await db.invoices.count_documents(query)
     
@@ -1745,12 +2533,7 @@ async def get_pos_invoices(
     skip = (page - 1) * limit
     
     # Get invoices
-    invoices = await db.invoices.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    # Parse dates
-    for inv in invoices:
-        if isinstance(inv.get('created_at'), str):
-            inv['created_at'] = inv['created_at']
+    invoices = await db.invoices.find(query, INVOICE_PROJECTION).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
     
     return {
         "invoices": invoices,
@@ -1763,66 +2546,144 @@ async def get_pos_invoices(
     }
 
 @api_router.get("/pos/invoices/{invoice_number}")
-async def get_pos_invoice_detail(invoice_number: str, current_user: User = Depends(get_current_user)):
-    """Obtener detalle de una factura específica"""
-    invoice = await db.invoices.find_one({"invoice_number": invoice_number}, {"_id": 0})
+async def get_pos_invoice_detail(
+    invoice_number: str,
+    details: InvoiceDetailLoader = Depends(invoice_details),
+    current_user: User = Depends(get_current_user)
+):
+    """Obtener detalle de una factura específica (con abonos y devoluciones)"""
+    invoice = await details.load(invoice_number)
     if not invoice:
         raise HTTPException(status_code=404, detail="Factura no encontrada")
     return invoice
 
 @api_router.get("/pos/invoices/{invoice_number}/ticket")
-async def get_invoice_ticket(invoice_number: str, current_user: User = Depends(get_current_user)):
-    """Generar y descargar ticket PDF de una factura"""
-    # Get invoice
-    invoice = await db.invoices.find_one({"invoice_number": invoice_number}, {"_id": 0})
+async def get_invoice_ticket(
+    invoice_number: str,
+    ticket_format: str = Query("pdf", alias="format"),
+    details: InvoiceDetailLoader = Depends(invoice_details),
+    current_user: User = Depends(get_current_user)
+):
+    """Generar y descargar ticket de una factura (pdf, escpos o text)"""
+    if ticket_format not in ["pdf", "escpos", "text"]:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use 'pdf', 'escpos' o 'text'")
+    
+    # Get invoice (with its returns) and ticket config together
+    invoice, config = await asyncio.gather(details.load(invoice_number), load_ticket_config())
     if not invoice:
         raise HTTPException(status_code=404, detail="Factura no encontrada")
     
-    # Get ticket config
-    config = await db.ticket_config.find_one({}, {"_id": 0})
-    if not config:
-        config = {
-            "company_name": "Mi Empresa",
-            "nit": "",
-            "phone": "",
-            "email": "",
-            "address": "",
-            "ticket_width": 80,
-            "footer_message": "¡Gracias por su compra!"
-        }
-    
-    # Get returns for this invoice
-    returns = await db.returns.find({"invoice_number": invoice_number}, {"_id": 0}).to_list(100)
-    
-    # Create PDF generator
-    generator = TicketPDFGenerator(ticket_width=config.get("ticket_width", 80))
+    # The ticket lists returns oldest first
+    returns = invoice["returns_history"][::-1]
     
     # Prepare invoice data for the generator
-    invoice_data = {
-        "invoice_number": invoice["invoice_number"],
-        "client_name": invoice.get("client_name", "Cliente General"),
-        "client_document": invoice.get("client_document", ""),
-        "items": invoice.get("items", []),
-        "subtotal": invoice.get("subtotal", 0),
-        "total_tax": invoice.get("total_tax", 0),
-        "total": invoice.get("total", 0),
-        "created_at": invoice.get("created_at"),
-        "created_by": invoice.get("created_by", ""),
-        "returns": returns  # Include returns data
-    }
+    invoice_data = build_ticket_data(invoice, returns)
+    ticket_width = config.get("ticket_width", 80)
+    
+    # Thermal printer formats render in-process from the shared layout
+    if ticket_format == "escpos":
+        return Response(
+            render_escpos(build_ticket_layout(invoice_data, config), ticket_width),
+            media_type="application/octet-stream",
+            headers={
+                "Content-Disposition": f"attachment; filename=ticket_{invoice_number}.bin"
+            }
+        )
+    if ticket_format == "text":
+        return Response(
+            render_text(build_ticket_layout(invoice_data, config), ticket_width),
+            media_type="text/plain; charset=utf-8"
+        )
     
-    # Generate PDF
-    pdf_buffer = generator.generate_ticket(invoice_data, config)
+    # Generate PDF in the worker pool
+    try:
+        pdf_bytes = await ticket_pool.render(ticket_width, invoice_data, config)
+    except TicketPoolBusy:
+        raise HTTPException(status_code=503, detail="Cola de impresión llena, intente de nuevo")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Tiempo de generación del ticket agotado")
+    except BrokenProcessPool:
+        raise HTTPException(status_code=503, detail="El generador de tickets se reinició, intente de nuevo")
     
     # Return as downloadable PDF
     return StreamingResponse(
-        pdf_buffer,
+        io.BytesIO(pdf_bytes),
         media_type="application/pdf",
         headers={
             "Content-Disposition": f"attachment; filename=ticket_{invoice_number}.pdf"
         }
     )
 
+@api_router.get("/pos/tickets/batch")
+async def get_tickets_batch(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    client_document: Optional[str] = None,
+    user_email: Optional[str] = None,
+    invoice_number: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Exportar en un ZIP los tickets PDF de las facturas que cumplen el filtro"""
+    query = build_pos_invoices_query(start_date, end_date, client_document, user_email, invoice_number, status)
+    config = await load_ticket_config()
+    ticket_width = config.get("ticket_width", 80)
+    
+    async def render(invoice, returns):
+        # Batch renders share a few reserved slots of the pool; interactive prints keep the rest
+        data = build_ticket_data(invoice, returns)
+        while True:
+            try:
+                return invoice["invoice_number"], await ticket_pool.render_batch(ticket_width, data, config)
+            except TicketPoolBusy:
+                # Interactive prints filled the whole queue
+                await asyncio.sleep(0.05)
+            except (asyncio.TimeoutError, BrokenProcessPool):
+                # The pool is recreated on the next render; list the ticket as failed
+                return invoice["invoice_number"], None
+    
+    async def render_chunk(chunk, archive, errors):
+        # One bulk query for the returns of the whole chunk
+        returns_by_invoice = {}
+        numbers = [inv["invoice_number"] for inv in chunk]
+        async for ret in db.returns.find({"invoice_number": {"$in": numbers}}, {"_id": 0}):
+            returns_by_invoice.setdefault(ret["invoice_number"], []).append(ret)
+        
+        tasks = [render(inv, returns_by_invoice.get(inv["invoice_number"], [])) for inv in chunk]
+        for task in asyncio.as_completed(tasks):
+            number, pdf_bytes = await task
+            if pdf_bytes is None:
+                errors.append(number)
+                continue
+            yield archive.add(f"ticket_{number}.pdf", pdf_bytes)
+    
+    async def stream_archive():
+        archive = ZipStream()
+        errors = []
+        chunk = []
+        cursor = db.invoices.find(query, {"_id": 0}).sort("created_at", -1).batch_size(TICKET_BATCH_CHUNK)
+        async for invoice in cursor:
+            chunk.append(invoice)
+            if len(chunk) == TICKET_BATCH_CHUNK:
+                async for data in render_chunk(chunk, archive, errors):
+                    yield data
+                chunk = []
+        if chunk:
+            async for data in render_chunk(chunk, archive, errors):
+                yield data
+        if errors:
+            yield archive.add("errores.txt", ("Tickets no generados (tiempo agotado o error del generador):\n" + "\n".join(errors)).encode("utf-8"))
+        yield archive.close()
+    
+    filename = f"tickets_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(
+        stream_archive(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}"
+        }
+    )
+
 # Include the routers
 app.include_router(api_router)
 
@@ -1830,12 +2691,22 @@ app.include_router(api_router)
 rbac_router = create_rbac_router(db)
 app.include_router(rbac_router, prefix="/api")
 
+# Added before CORS so replayed responses also get the CORS headers
+app.add_middleware(
+    IdempotencyMiddleware,
+    db=db,
+    paths=[r"^/api/invoices$", r"^/api/returns$", r"^/api/purchases$", r"^/api/supplier-returns$",
+           r"^/api/transfers$", r"^/api/transfers/[^/]+/receive$", r"^/api/fios/[^/]+/payment$"],
+    identity=token_subject,
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, REPLAYED_HEADER],
 )
 
 logging.basicConfig(
@@ -1844,6 +2715,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# The event loop only keeps weak references to tasks
+background_tasks = set()
+
+def start_background(coro):
+    """Lanzar una tarea de fondo que vive hasta el apagado"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+@app.on_event("startup")
+async def start_ticket_pool():
+    ticket_pool.start()
+
+@app.on_event("startup")
+async def setup_collections():
+    await load_migration_state(db)
+    await setup_catalog_sync(db)
+    await setup_product_search(db)
+    await setup_list_indexes(db)
+    await setup_stock(db)
+    await setup_idempotency(db)
+    await setup_sequences(db)
+    await setup_pos_sync(db)
+    await setup_invoice_detail(db)
+    await setup_stock_snapshots(db)
+    await setup_purchase_suggestions(db)
+    await setup_stock_levels(db)
+    await setup_stock_transfers(db)
+    start_background(run_snapshot_scheduler(db))
+    start_background(run_reservation_sweeper(db))
+    await barcode_index.load(db)
+    start_background(barcode_index.run_refresh(db, BARCODE_INDEX_REFRESH))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    ticket_pool.shutdown()
     client.close()
\ No newline at end of file
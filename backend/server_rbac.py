@@ -12,6 +12,7 @@ from rbac import (
     DEFAULT_MODULES, DEFAULT_ROLES
 )
 from passlib.context import CryptContext
+from list_query import ListParams, paginate
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -100,7 +101,7 @@ def create_rbac_router(db: AsyncIOMotorDatabase) -> APIRouter:
             raise HTTPException(status_code=400, detail="Módulo ya existe")
         
         module_dict = module.model_dump()
-        module_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+        module_dict["created_at"] = datetime.now(timezone.utc)
         
         await db.system_modules.insert_one(module_dict)
         return SystemModule(**module_dict)
@@ -147,7 +148,7 @@ def create_rbac_router(db: AsyncIOMotorDatabase) -> APIRouter:
             raise HTTPException(status_code=400, detail="Rol ya existe")
         
         role_dict = role.model_dump()
-        role_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+        role_dict["created_at"] = datetime.now(timezone.utc)
         
         await db.roles.insert_one(role_dict)
         return Role(**role_dict)
@@ -223,7 +224,7 @@ def create_rbac_router(db: AsyncIOMotorDatabase) -> APIRouter:
         
         # Update or insert permission
         perm_dict = perm.model_dump()
-        perm_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+        perm_dict["created_at"] = datetime.now(timezone.utc)
         
         await db.role_permissions.update_one(
             {"role_name": perm.role_name, "module_slug": perm.module_slug},
@@ -271,15 +272,15 @@ def create_rbac_router(db: AsyncIOMotorDatabase) -> APIRouter:
         user_dict = user.model_dump(exclude={"password"})
         user_dict["hashed_password"] = hashed_password
         user_dict["roles"] = []
-        user_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-        user_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+        user_dict["created_at"] = datetime.now(timezone.utc)
+        user_dict["updated_at"] = datetime.now(timezone.utc)
         
         await db.users_extended.insert_one(user_dict)
         
         return UserExtended(**{k: v for k, v in user_dict.items() if k != "hashed_password"})
     
     @router.get("/users", response_model=List[UserExtended])
-    async def get_users_extended(search: str = None):
+    async def get_users_extended(search: str = None, params: ListParams = Depends()):
         """Listar todos los usuarios"""
         query = {}
         if search:
@@ -289,15 +290,7 @@ def create_rbac_router(db: AsyncIOMotorDatabase) -> APIRouter:
                 {"last_name": {"$regex": search, "$options": "i"}}
             ]}
         
-        users = await db.users_extended.find(query, {"_id": 0, "hashed_password": 0}).to_list(1000)
-        
-        for user in users:
-            if isinstance(user.get('created_at'), str):
-                user['created_at'] = datetime.fromisoformat(user['created_at'])
-            if isinstance(user.get('updated_at'), str):
-                user['updated_at'] = datetime.fromisoformat(user['updated_at'])
-        
-        return users
+        return await paginate(db.users_extended, query, UserExtended, params, exclude=["hashed_password"])
     
     @router.get("/users/{email}", response_model=UserExtended)
     async def get_user_extended(email: str):
@@ -324,7 +317,7 @@ def create_rbac_router(db: AsyncIOMotorDatabase) -> APIRouter:
         if not update_data:
             raise HTTPException(status_code=400, detail="No hay datos para actualizar")
         
-        update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+        update_data["updated_at"] = datetime.now(timezone.utc)
         
         result = await db.users_extended.update_one(
             {"email": email},
@@ -368,7 +361,7 @@ def create_rbac_router(db: AsyncIOMotorDatabase) -> APIRouter:
         # Update user roles
         await db.users_extended.update_one(
             {"email": email},
-            {"$set": {"roles": assignment, "updated_at": datetime.now(timezone.utc).isoformat()}}
+            {"$set": {"roles": assignment, "updated_at": datetime.now(timezone.utc)}}
         )
         
         return {"message": "Roles asignados", "roles": assignment}
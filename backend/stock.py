@@ -0,0 +1,343 @@
+"""
+Modo de stock estricto: sin ventas por encima de las existencias
+
+Con STRICT_STOCK=1 cada factura descuenta sus productos con actualizaciones
+condicionales (`stock - reserved >= cantidad`) enviadas en un solo
+bulk_write, y la canasta se aplica completa o no se aplica:
+
+- con replica set, dentro de una transacción que se aborta si algún
+  producto no alcanza
+- sin transacciones, cada actualización marca el producto con el id de la
+  operación y, si alguna falla, las aplicadas se revierten
+
+Con la ubicación de la venta, sus unidades en `stock_levels` también deben
+alcanzar: se descuentan en la misma transacción o compensación que el
+producto, así una sucursal sin unidades no vende las de otra.
+
+Las reservas de canasta (`stock_reservations`) apartan unidades en el
+contador `reserved` del producto durante RESERVATION_TTL segundos; una tarea
+de fondo libera las vencidas. Al facturar con `reservation_id`, las unidades
+reservadas por esa canasta cuentan como disponibles para ella.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Iterable, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from catalog_sync import sync_stamp
+
+logger = logging.getLogger(__name__)
+
+STRICT_STOCK = os.environ.get("STRICT_STOCK", "0") == "1"
+RESERVATION_TTL = int(os.environ.get("RESERVATION_TTL", 120))
+RESERVATION_SWEEP_INTERVAL = float(os.environ.get("RESERVATION_SWEEP_INTERVAL", 5))
+
+# Set at startup by setup_stock()
+_transactions = False
+
+
+class InsufficientStock(Exception):
+    """Productos sin existencias suficientes: {barcode: disponibles}"""
+
+    def __init__(self, available: Dict[str, int]):
+        super().__init__(", ".join(f"{barcode} ({units} disponibles)" for barcode, units in available.items()))
+        self.available = available
+
+
+def basket_quantities(items: Iterable) -> Dict[str, int]:
+    """Cantidades por código de barras (una canasta puede repetir productos)"""
+    quantities = {}
+    for item in items:
+        barcode = item["barcode"] if isinstance(item, dict) else item.barcode
+        quantity = item["quantity"] if isinstance(item, dict) else item.quantity
+        quantities[barcode] = quantities.get(barcode, 0) + quantity
+    return quantities
+
+
+async def setup_stock(db: AsyncIOMotorDatabase):
+    """Índices de reservas y detección de soporte de transacciones"""
+    global _transactions
+    await db.stock_reservations.create_index("basket_id", unique=True)
+    await db.stock_reservations.create_index("expires_at")
+    hello = await db.client.admin.command("hello")
+    _transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+
+
+def supports_transactions() -> bool:
+    """True si Mongo admite transacciones (replica set o sharding), según setup_stock()"""
+    return _transactions
+
+
+def _available_expr(needed: int) -> dict:
+    return {"$expr": {"$gte": [{"$subtract": ["$stock", {"$ifNull": ["$reserved", 0]}]}, needed]}}
+
+
+async def _apply_all(db: AsyncIOMotorDatabase, updates: Dict[str, tuple], location: Optional[str] = None,
+                     taken: Optional[Dict[str, int]] = None):
+    """
+    Aplicar {barcode: (unidades necesarias, $inc)} todo o nada
+
+    Con `location`, además descuenta {barcode: unidades} de `taken` en esa
+    ubicación de `stock_levels` (solo si alcanzan) dentro de la misma
+    operación. Lanza InsufficientStock si algún producto no tiene
+    `stock - reserved` suficiente o su ubicación no alcanza; en ese caso
+    nada queda modificado.
+    """
+    if not updates:
+        return
+    taken = taken if location else {}
+    version = sync_stamp()
+    now = datetime.now(timezone.utc)
+
+    def operations(extra=None):
+        return [
+            UpdateOne(
+                {"barcode": barcode, **_available_expr(needed)},
+                {"$inc": inc, "$set": {"sync_version": version}, **(extra or {})}
+            )
+            for barcode, (needed, inc) in updates.items()
+        ]
+
+    def level_operations(extra=None):
+        return [
+            UpdateOne(
+                {"barcode": barcode, "location": location, "stock": {"$gte": quantity}},
+                {"$inc": {"stock": -quantity}, "$set": {"updated_at": now}, **(extra or {})}
+            )
+            for barcode, quantity in taken.items()
+        ]
+
+    if _transactions:
+        async def apply(session):
+            result = await db.products.bulk_write(operations(), ordered=False, session=session)
+            levels = await db.stock_levels.bulk_write(level_operations(), ordered=False, session=session) \
+                if taken else None
+            if result.matched_count < len(updates) or (levels is not None and levels.matched_count < len(taken)):
+                # Aborts the transaction; re-raised below with the available units
+                raise InsufficientStock({})
+
+        try:
+            async with await db.client.start_session() as session:
+                await session.with_transaction(apply)
+            return
+        except InsufficientStock:
+            pass
+    else:
+        op_id = uuid.uuid4().hex
+        mark = {"$push": {"stock_ops": op_id}}
+        result = await db.products.bulk_write(operations(mark), ordered=False)
+        levels = await db.stock_levels.bulk_write(level_operations(mark), ordered=False) if taken else None
+        if result.matched_count == len(updates) and (levels is None or levels.matched_count == len(taken)):
+            await db.products.update_many({"stock_ops": op_id}, {"$pull": {"stock_ops": op_id}})
+            if levels is not None:
+                await db.stock_levels.update_many({"stock_ops": op_id}, {"$pull": {"stock_ops": op_id}})
+            return
+        # Compensate: revert exactly the products and levels this operation touched
+        await db.products.bulk_write([
+            UpdateOne(
+                {"barcode": barcode, "stock_ops": op_id},
+                {"$inc": {field: -delta for field, delta in inc.items()}, "$pull": {"stock_ops": op_id}}
+            )
+            for barcode, (_, inc) in updates.items()
+        ], ordered=False)
+        if levels is not None:
+            await db.stock_levels.bulk_write([
+                UpdateOne({"barcode": barcode, "location": location, "stock_ops": op_id},
+                          {"$inc": {"stock": quantity}, "$pull": {"stock_ops": op_id}})
+                for barcode, quantity in taken.items()
+            ], ordered=False)
+
+    raise InsufficientStock(await _shortages(
+        db, {barcode: needed for barcode, (needed, _) in updates.items()}, location, taken
+    ))
+
+
+async def _shortages(db: AsyncIOMotorDatabase, needed: Dict[str, int], location: Optional[str] = None,
+                     taken: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    available = {barcode: 0 for barcode in needed}
+    async for product in db.products.find(
+        {"barcode": {"$in": list(needed)}}, {"_id": 0, "barcode": 1, "stock": 1, "reserved": 1}
+    ):
+        available[product["barcode"]] = product.get("stock", 0) - product.get("reserved", 0)
+    short = {barcode: units for barcode, units in available.items() if units < needed[barcode]}
+    if taken:
+        # Units at the sale's location cap what the product total allows
+        at_location = {barcode: 0 for barcode in taken}
+        async for level in db.stock_levels.find(
+            {"barcode": {"$in": list(taken)}, "location": location}, {"_id": 0, "barcode": 1, "stock": 1}
+        ):
+            at_location[level["barcode"]] = level["stock"]
+        for barcode, units in at_location.items():
+            available[barcode] = min(available.get(barcode, units), units)
+            if units < taken[barcode]:
+                short[barcode] = available[barcode]
+    # Stock may have come back since the update failed; report the whole basket then
+    return short or {barcode: units for barcode, units in available.items() if needed.get(barcode, 0) > 0}
+
+
+async def decrement_stock(db: AsyncIOMotorDatabase, quantities: Dict[str, int], held: Optional[Dict[str, int]] = None,
+                          location: Optional[str] = None):
+    """
+    Descontar una canasta completa o ninguna unidad
+
+    held: unidades reservadas por esta canasta (ya reclamadas con
+    claim_reservation); se descuentan de `reserved` junto con el stock.
+    location: ubicación de la venta; sus unidades en `stock_levels` se
+    descuentan en la misma operación y también deben alcanzar.
+    """
+    held = held or {}
+    updates = {}
+    for barcode, quantity in quantities.items():
+        own = held.get(barcode, 0)
+        inc = {"stock": -quantity}
+        if own:
+            inc["reserved"] = -own
+        updates[barcode] = (quantity - own, inc)
+    # Reserved units of products not bought are released too
+    for barcode, own in held.items():
+        if barcode not in quantities:
+            updates[barcode] = (-own, {"reserved": -own})
+    await _apply_all(db, updates, location, quantities)
+
+
+async def restore_stock(db: AsyncIOMotorDatabase, quantities: Dict[str, int], held: Optional[Dict[str, int]] = None,
+                        basket_id: Optional[str] = None, location: Optional[str] = None):
+    """
+    Devolver unidades descontadas por una factura que no se pudo guardar
+
+    Deshace decrement_stock completo: con `held` las unidades reservadas
+    vuelven a `reserved`, con `location` las unidades vuelven a esa
+    ubicación y, con `basket_id`, la reserva de la canasta se guarda de
+    nuevo (con RESERVATION_TTL desde ahora) para poder reintentar.
+    """
+    held = held or {}
+    version = sync_stamp()
+    await db.products.bulk_write([
+        UpdateOne(
+            {"barcode": barcode},
+            {"$inc": {field: units for field, units in (("stock", quantities.get(barcode, 0)),
+                                                          ("reserved", held.get(barcode, 0))) if units},
+             "$set": {"sync_version": version}}
+        )
+        for barcode in set(quantities) | set(held)
+    ], ordered=False)
+    if location and quantities:
+        now = datetime.now(timezone.utc)
+        await db.stock_levels.bulk_write([
+            UpdateOne({"barcode": barcode, "location": location},
+                      {"$inc": {"stock": quantity}, "$set": {"updated_at": now}}, upsert=True)
+            for barcode, quantity in quantities.items()
+        ], ordered=False)
+    if basket_id:
+        await restore_reservation(db, basket_id, held)
+
+
+async def restore_reservation(db: AsyncIOMotorDatabase, basket_id: str, held: Dict[str, int]):
+    """
+    Volver a guardar una reserva reclamada cuyas unidades siguen en `reserved`
+
+    Con RESERVATION_TTL desde ahora, para que la canasta pueda reintentar.
+    """
+    if held:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=RESERVATION_TTL)
+        await _store_reservation(db, basket_id, held, expires_at)
+
+
+async def reserve(db: AsyncIOMotorDatabase, quantities: Dict[str, int], basket_id: Optional[str] = None,
+                  ttl: int = RESERVATION_TTL) -> dict:
+    """
+    Reservar (o reemplazar la reserva de) una canasta durante `ttl` segundos
+
+    Lanza InsufficientStock si no hay unidades libres; la reserva anterior
+    de la canasta se conserva en ese caso.
+    """
+    basket_id = basket_id or uuid.uuid4().hex
+    previous = await claim_reservation(db, basket_id)
+    updates = {}
+    for barcode in set(quantities) | set(previous):
+        delta = quantities.get(barcode, 0) - previous.get(barcode, 0)
+        if delta:
+            updates[barcode] = (delta, {"reserved": delta})
+
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+    try:
+        await _apply_all(db, updates)
+    except InsufficientStock:
+        if previous:
+            await _store_reservation(db, basket_id, previous, expires_at)
+        raise
+
+    if quantities:
+        await _store_reservation(db, basket_id, quantities, expires_at)
+    return {"basket_id": basket_id, "expires_at": expires_at, "items": quantities}
+
+
+async def _store_reservation(db, basket_id, quantities, expires_at):
+    await db.stock_reservations.insert_one({
+        "basket_id": basket_id,
+        "items": [{"barcode": barcode, "quantity": quantity} for barcode, quantity in quantities.items()],
+        "expires_at": expires_at,
+        "created_at": datetime.now(timezone.utc),
+    })
+
+
+async def claim_reservation(db: AsyncIOMotorDatabase, basket_id: str) -> Dict[str, int]:
+    """
+    Tomar la reserva de una canasta (si sigue vigente)
+
+    La reserva se borra de forma atómica, así la factura y el barrido de
+    vencidas nunca liberan las mismas unidades dos veces. Quien la toma
+    debe descontar o liberar `reserved`. Una reserva vencida que el barrido
+    aún no liberó se libera aquí y se trata como inexistente.
+    """
+    reservation = await db.stock_reservations.find_one_and_delete(
+        {"basket_id": basket_id, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    )
+    if reservation:
+        return basket_quantities(reservation["items"])
+    expired = await db.stock_reservations.find_one_and_delete({"basket_id": basket_id})
+    if expired:
+        await release_units(db, basket_quantities(expired["items"]))
+    return {}
+
+
+async def release_reservation(db: AsyncIOMotorDatabase, basket_id: str) -> bool:
+    held = await claim_reservation(db, basket_id)
+    await release_units(db, held)
+    return bool(held)
+
+
+async def release_units(db: AsyncIOMotorDatabase, held: Dict[str, int]):
+    """Liberar unidades reservadas ya reclamadas"""
+    if held:
+        version = sync_stamp()
+        await db.products.bulk_write([
+            UpdateOne({"barcode": barcode}, {"$inc": {"reserved": -quantity}, "$set": {"sync_version": version}})
+            for barcode, quantity in held.items()
+        ], ordered=False)
+
+
+async def release_expired(db: AsyncIOMotorDatabase) -> int:
+    """Liberar las reservas vencidas; devuelve cuántas se liberaron"""
+    released = 0
+    while True:
+        reservation = await db.stock_reservations.find_one_and_delete(
+            {"expires_at": {"$lte": datetime.now(timezone.utc)}}
+        )
+        if not reservation:
+            return released
+        await release_units(db, basket_quantities(reservation["items"]))
+        released += 1
+
+
+async def run_reservation_sweeper(db: AsyncIOMotorDatabase, interval: float = RESERVATION_SWEEP_INTERVAL):
+    """Tarea de fondo: liberar reservas vencidas cada `interval` segundos"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await release_expired(db)
+        except Exception as e:
+            logger.error(f"Error liberando reservas vencidas: {e}")
@@ -0,0 +1,184 @@
+"""
+Existencias por ubicación (tienda, bodega, sucursal)
+
+`stock_levels` guarda un documento por (barcode, location). `products.stock`
+sigue siendo el total del producto, como caché de la suma por ubicación:
+cada escritura que mueve stock aplica el mismo cambio al producto y a su
+ubicación, así quien solo necesita el total (POS, listados, modo estricto,
+reservas) sigue leyendo un campo del producto. Los traslados no cambian el
+total y solo tocan `stock_levels`.
+
+Las ubicaciones se registran en `locations`. DEFAULT_LOCATION existe siempre
+y es la de las peticiones sin `location` y los movimientos anteriores. En
+bases anteriores, `seed_stock_levels` asigna el stock existente a esa
+ubicación.
+"""
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from migrations import MIGRATION_BATCH, migration_completed
+from stock import InsufficientStock, supports_transactions
+
+DEFAULT_LOCATION = os.environ.get("DEFAULT_LOCATION", "principal")
+MIGRATION_ID = "stock_levels"
+
+# Set at startup by setup_stock_levels()
+_seeded = False
+
+
+async def setup_stock_levels(db: AsyncIOMotorDatabase):
+    global _seeded
+    await db.stock_levels.create_index([("barcode", 1), ("location", 1)], unique=True)
+    # Per-location listing, paginated by barcode
+    await db.stock_levels.create_index([("location", 1), ("barcode", 1), ("_id", 1)])
+    await db.locations.create_index("code", unique=True)
+    await db.locations.update_one(
+        {"code": DEFAULT_LOCATION},
+        {"$setOnInsert": {"name": DEFAULT_LOCATION.capitalize(), "created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    # Nothing to seed when no product holds stock yet (new database)
+    _seeded = await migration_completed(db, MIGRATION_ID) or \
+        not await db.products.find_one({"stock": {"$ne": 0}}, {"_id": 1})
+
+
+def levels_seeded() -> bool:
+    """
+    True si `stock_levels` tiene todo el stock (según setup_stock_levels())
+
+    Hasta que seed_stock_levels termina, el stock anterior no está en ninguna
+    ubicación y no se puede exigir por ubicación; los servidores lo notan al
+    reiniciar.
+    """
+    return _seeded
+
+
+async def unknown_locations(db: AsyncIOMotorDatabase, codes: Iterable[str]) -> List[str]:
+    """Códigos de `codes` que no están registrados en `locations`"""
+    codes = set(codes)
+    known = {
+        location["code"]
+        async for location in db.locations.find({"code": {"$in": list(codes)}}, {"_id": 0, "code": 1})
+    }
+    return sorted(codes - known)
+
+
+def location_deltas(location: str, quantities: Dict[str, int], sign: int = 1) -> Dict[Tuple[str, str], int]:
+    """{barcode: unidades} en una ubicación como {(barcode, location): cambio}"""
+    return {(barcode, location): sign * quantity for barcode, quantity in quantities.items()}
+
+
+async def adjust_levels(db: AsyncIOMotorDatabase, deltas: Dict[Tuple[str, str], int]):
+    """Sumar {(barcode, location): cambio} al stock de cada ubicación"""
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne({"barcode": barcode, "location": location},
+                  {"$inc": {"stock": delta}, "$set": {"updated_at": now}}, upsert=True)
+        for (barcode, location), delta in deltas.items() if delta
+    ]
+    if operations:
+        await db.stock_levels.bulk_write(operations, ordered=False)
+
+
+async def transfer_stock(db: AsyncIOMotorDatabase, source: str, target: str, quantities: Dict[str, int]):
+    """
+    Trasladar {barcode: unidades} de `source` a `target`, todo o nada
+
+    Un solo bulk_write descuenta en el origen (solo si alcanza) y suma en el
+    destino. Con replica set va en una transacción; sin transacciones, si
+    algún producto no alcanza se revierten las actualizaciones marcadas con
+    el id del traslado. Lanza InsufficientStock con lo disponible en el origen.
+    """
+    now = datetime.now(timezone.utc)
+
+    def operations(extra=None):
+        extra = extra or {}
+        return [
+            UpdateOne({"barcode": barcode, "location": source, "stock": {"$gte": quantity}},
+                      {"$inc": {"stock": -quantity}, "$set": {"updated_at": now}, **extra})
+            for barcode, quantity in quantities.items()
+        ] + [
+            UpdateOne({"barcode": barcode, "location": target},
+                      {"$inc": {"stock": quantity}, "$set": {"updated_at": now}, **extra}, upsert=True)
+            for barcode, quantity in quantities.items()
+        ]
+
+    def taken(result) -> int:
+        # Every destination update matches or upserts; the rest are origin matches
+        return result.matched_count + result.upserted_count - len(quantities)
+
+    if supports_transactions():
+        async def apply(session):
+            result = await db.stock_levels.bulk_write(operations(), ordered=False, session=session)
+            if taken(result) < len(quantities):
+                # Aborts the transaction; re-raised below with the available units
+                raise InsufficientStock({})
+
+        try:
+            async with await db.client.start_session() as session:
+                await session.with_transaction(apply)
+            return
+        except InsufficientStock:
+            pass
+    else:
+        op_id = uuid.uuid4().hex
+        result = await db.stock_levels.bulk_write(operations({"$push": {"transfer_ops": op_id}}), ordered=False)
+        if taken(result) == len(quantities):
+            await db.stock_levels.update_many({"transfer_ops": op_id}, {"$pull": {"transfer_ops": op_id}})
+            return
+        # Compensate: revert exactly the levels this transfer touched
+        await db.stock_levels.bulk_write([
+            UpdateOne({"barcode": barcode, "location": location, "transfer_ops": op_id},
+                      {"$inc": {"stock": delta}, "$pull": {"transfer_ops": op_id}})
+            for barcode, quantity in quantities.items()
+            for location, delta in ((source, quantity), (target, -quantity))
+        ], ordered=False)
+
+    available = {barcode: 0 for barcode in quantities}
+    async for level in db.stock_levels.find(
+        {"barcode": {"$in": list(quantities)}, "location": source}, {"_id": 0, "barcode": 1, "stock": 1}
+    ):
+        available[level["barcode"]] = level["stock"]
+    # Stock may have come back since the transfer failed; report every line then
+    raise InsufficientStock({barcode: units for barcode, units in available.items()
+                             if units < quantities[barcode]} or available)
+
+
+async def seed_stock_levels(db: AsyncIOMotorDatabase, batch_size: int = MIGRATION_BATCH,
+                            dry_run: bool = False) -> dict:
+    """
+    Asignar a DEFAULT_LOCATION el stock de cada producto que no está en ninguna ubicación
+
+    Lo que ya registraron las escrituras por ubicación se descuenta, así que
+    se puede ejecutar con el sistema en uso y repetir sin duplicar.
+    """
+    pipeline = [
+        {"$lookup": {"from": "stock_levels", "localField": "barcode", "foreignField": "barcode", "as": "levels",
+                     "pipeline": [{"$project": {"_id": 0, "stock": 1}}]}},
+        {"$project": {
+            "_id": 0,
+            "barcode": 1,
+            "location": {"$literal": DEFAULT_LOCATION},
+            "stock": {"$subtract": [{"$ifNull": ["$stock", 0]}, {"$sum": "$levels.stock"}]},
+            "updated_at": "$$NOW",
+        }},
+        {"$match": {"stock": {"$ne": 0}}},
+    ]
+    pending = await db.products.aggregate(pipeline + [{"$count": "products"}]).to_list(1)
+    seeded = {"stock_levels": pending[0]["products"] if pending else 0}
+    if dry_run:
+        return seeded
+
+    await db.products.aggregate(pipeline + [{"$merge": {
+        "into": "stock_levels",
+        "on": ["barcode", "location"],
+        "whenMatched": [{"$set": {"stock": {"$add": ["$stock", "$$new.stock"]}, "updated_at": "$$new.updated_at"}}],
+        "whenNotMatched": "insert",
+    }}]).to_list(None)
+    await db.migrations.update_one(
+        {"_id": MIGRATION_ID}, {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    return seeded
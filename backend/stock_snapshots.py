@@ -0,0 +1,262 @@
+"""
+Existencias a una fecha a partir de `inventory_movements`
+
+Cada día, al cerrar (medianoche en REPORT_TIMEZONE), se guarda una foto del
+stock de cada producto en `stock_snapshots`: la foto del día anterior más
+los movimientos del día. Una consulta a una fecha parte de la última foto
+anterior y suma solo los movimientos posteriores (como mucho un día), sin
+recorrer todo el historial; una fecha anterior a la primera foto parte de
+la primera foto posterior y resta los movimientos intermedios. Un día queda
+disponible cuando se registra en `stock_snapshot_days`, así nunca se lee una
+foto a medio escribir. `backfill_snapshots` (`scripts/migrate.py snapshots`)
+completa las fotos diarias hacia atrás hasta el primer movimiento, así
+ninguna consulta recorre más de un día de movimientos.
+
+La conciliación compara `products.stock` con lo que dicen la última foto y
+los movimientos posteriores y, una vez asignado todo el stock a ubicaciones,
+con la suma de `stock_levels` del producto (el total es una caché de esa
+suma que se escribe por separado). Cada ejecución guarda un resumen en
+`stock_reconciliations` (con las primeras RECONCILE_DRIFT_SAMPLE
+diferencias) y todas las diferencias, una por producto, en `stock_drift`
+con el `run_id` de la ejecución: con un descuadre masivo el resumen no
+crece más allá de la muestra. Una venta en curso (stock ya descontado, movimiento
+aún no escrito) puede aparecer como diferencia pasajera; la siguiente
+ejecución la descarta.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from migrations import MIGRATION_BATCH
+from stock_levels import levels_seeded
+from timestamps import instant_range_query, REPORT_TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+# How often the scheduler checks whether a day has closed
+STOCK_SNAPSHOT_INTERVAL = float(os.environ.get("STOCK_SNAPSHOT_INTERVAL", 3600))
+SNAPSHOT_WRITE_BATCH = 1000
+# Wait this long after midnight so writes of the closing day have landed
+SNAPSHOT_GRACE = timedelta(minutes=5)
+# Differences copied into the reconciliation summary; the full list is in stock_drift
+RECONCILE_DRIFT_SAMPLE = 100
+MIGRATION_ID = "stock_snapshots"
+STOCK_DRIFT_RETENTION_DAYS = int(os.environ.get("STOCK_DRIFT_RETENTION_DAYS", 30))
+
+
+async def setup_stock_snapshots(db: AsyncIOMotorDatabase):
+    await db.stock_snapshots.create_index([("as_of", 1), ("barcode", 1)], unique=True)
+    await db.stock_reconciliations.create_index("checked_at")
+    await db.stock_drift.create_index([("run_id", 1), ("barcode", 1), ("_id", 1)])
+    await db.stock_drift.create_index("checked_at", expireAfterSeconds=STOCK_DRIFT_RETENTION_DAYS * 24 * 3600)
+
+
+def last_midnight(now: Optional[datetime] = None, tz: str = REPORT_TIMEZONE) -> datetime:
+    """Última medianoche (zona del informe) como datetime UTC"""
+    local = (now or datetime.now(timezone.utc)).astimezone(ZoneInfo(tz))
+    return local.replace(hour=0, minute=0, second=0, microsecond=0).astimezone(timezone.utc)
+
+
+def _next_midnight(instant: datetime, tz: str = REPORT_TIMEZONE) -> datetime:
+    # Noon of the next local day avoids landing on a DST gap
+    local = instant.astimezone(ZoneInfo(tz)).replace(hour=12) + timedelta(days=1)
+    return last_midnight(local, tz)
+
+
+def _previous_midnight(midnight: datetime, tz: str = REPORT_TIMEZONE) -> datetime:
+    return last_midnight(midnight - timedelta(seconds=1), tz)
+
+
+async def latest_snapshot(db: AsyncIOMotorDatabase, before: Optional[datetime] = None) -> Optional[datetime]:
+    """Instante de la última foto completa (anterior o igual a `before`)"""
+    query = {"_id": {"$lte": before}} if before else {}
+    day = await db.stock_snapshot_days.find_one(query, sort=[("_id", -1)])
+    return day["_id"] if day else None
+
+
+async def earliest_snapshot(db: AsyncIOMotorDatabase, after: Optional[datetime] = None) -> Optional[datetime]:
+    """Instante de la primera foto completa (posterior a `after`)"""
+    query = {"_id": {"$gt": after}} if after else {}
+    day = await db.stock_snapshot_days.find_one(query, sort=[("_id", 1)])
+    return day["_id"] if day else None
+
+
+async def movement_totals(db: AsyncIOMotorDatabase, start: Optional[datetime], end: Optional[datetime],
+                          barcode: Optional[str] = None) -> Dict[str, int]:
+    """Suma de movimientos por producto en [start, end)"""
+    match = instant_range_query("created_at", start, end)
+    if barcode:
+        match["barcode"] = barcode
+    return {
+        row["_id"]: row["quantity"]
+        async for row in db.inventory_movements.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$barcode", "quantity": {"$sum": "$quantity"}}},
+        ])
+    }
+
+
+async def _snapshot_stock(db: AsyncIOMotorDatabase, as_of: Optional[datetime],
+                          barcode: Optional[str] = None) -> Dict[str, int]:
+    if as_of is None:
+        return {}
+    query = {"as_of": as_of, **({"barcode": barcode} if barcode else {})}
+    return {
+        snapshot["barcode"]: snapshot["stock"]
+        async for snapshot in db.stock_snapshots.find(query, {"_id": 0, "barcode": 1, "stock": 1})
+    }
+
+
+async def stock_at(db: AsyncIOMotorDatabase, instant: Optional[datetime] = None,
+                   barcode: Optional[str] = None) -> tuple:
+    """
+    Stock por producto según los movimientos, en `instant` (ahora si es None)
+
+    Devuelve (foto usada o None, {barcode: unidades}). Sin fotos anteriores
+    se parte de la primera foto posterior y se restan los movimientos entre
+    `instant` y ella; solo sin ninguna foto se suma todo el historial.
+    """
+    as_of = await latest_snapshot(db, instant)
+    if as_of is None and instant is not None:
+        later = await earliest_snapshot(db, instant)
+        if later is not None:
+            stock = await _snapshot_stock(db, later, barcode)
+            for code, quantity in (await movement_totals(db, instant, later, barcode)).items():
+                stock[code] = stock.get(code, 0) - quantity
+            return later, stock
+    stock = await _snapshot_stock(db, as_of, barcode)
+    for code, quantity in (await movement_totals(db, as_of, instant, barcode)).items():
+        stock[code] = stock.get(code, 0) + quantity
+    return as_of, stock
+
+
+async def take_snapshot(db: AsyncIOMotorDatabase, as_of: datetime) -> int:
+    """Guardar la foto de `as_of` desde la anterior; devuelve cuántos productos tiene"""
+    _, stock = await stock_at(db, as_of)
+    operations = [
+        UpdateOne({"as_of": as_of, "barcode": barcode}, {"$set": {"stock": quantity}}, upsert=True)
+        for barcode, quantity in stock.items()
+    ]
+    for start in range(0, len(operations), SNAPSHOT_WRITE_BATCH):
+        await db.stock_snapshots.bulk_write(operations[start:start + SNAPSHOT_WRITE_BATCH], ordered=False)
+    await db.stock_snapshot_days.update_one(
+        {"_id": as_of},
+        {"$set": {"products": len(stock), "created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    return len(stock)
+
+
+async def take_due_snapshots(db: AsyncIOMotorDatabase) -> int:
+    """Guardar las fotos de los días cerrados que faltan; devuelve cuántas se guardaron"""
+    due = last_midnight(datetime.now(timezone.utc) - SNAPSHOT_GRACE)
+    latest = await latest_snapshot(db)
+    # The first snapshot replays the whole history once; later ones a single day
+    as_of = _next_midnight(latest) if latest else due
+    taken = 0
+    while as_of <= due:
+        await take_snapshot(db, as_of)
+        taken += 1
+        as_of = _next_midnight(as_of)
+    return taken
+
+
+async def backfill_snapshots(db: AsyncIOMotorDatabase, batch_size: int = MIGRATION_BATCH,
+                             dry_run: bool = False) -> dict:
+    """
+    Guardar las fotos diarias anteriores a la primera, hasta el primer movimiento
+
+    Cada día se calcula desde la foto siguiente restando un día de
+    movimientos, del más reciente al más antiguo; una ejecución interrumpida
+    continúa desde la foto más antigua guardada. Requiere fechas nativas
+    (`scripts/migrate.py dates`). `batch_size` no aplica: cada día es un paso.
+    """
+    first = await db.inventory_movements.find_one(
+        {"created_at": {"$type": "date"}}, {"_id": 0, "created_at": 1}, sort=[("created_at", 1)]
+    )
+    earliest = await earliest_snapshot(db)
+    if earliest is None:
+        earliest = last_midnight(datetime.now(timezone.utc) - SNAPSHOT_GRACE)
+        if not dry_run:
+            await take_snapshot(db, earliest)
+    days = 0
+    as_of = _previous_midnight(earliest)
+    while first and as_of > first["created_at"]:
+        if not dry_run:
+            await take_snapshot(db, as_of)
+        days += 1
+        as_of = _previous_midnight(as_of)
+    if not dry_run:
+        await db.migrations.update_one(
+            {"_id": MIGRATION_ID}, {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+        )
+    return {"stock_snapshot_days": days}
+
+
+async def reconcile(db: AsyncIOMotorDatabase) -> dict:
+    """Comparar `products.stock` con la última foto más los movimientos posteriores y con sus ubicaciones"""
+    run_id = uuid.uuid4().hex
+    checked_at = datetime.now(timezone.utc)
+    as_of, expected = await stock_at(db)
+    levels = {
+        row["_id"]: row["stock"]
+        async for row in db.stock_levels.aggregate([{"$group": {"_id": "$barcode", "stock": {"$sum": "$stock"}}}])
+    } if levels_seeded() else None
+    sample = []
+    batch = []
+    drift_count = 0
+    products = 0
+    async for product in db.products.find({}, {"_id": 0, "barcode": 1, "name": 1, "stock": 1}):
+        products += 1
+        stock = product.get("stock", 0)
+        ledger = expected.get(product["barcode"], 0)
+        located = levels.get(product["barcode"], 0) if levels is not None else stock
+        if stock == ledger and stock == located:
+            continue
+        row = {
+            "barcode": product["barcode"],
+            "product_name": product.get("name"),
+            "stock": stock,
+            "expected": ledger,
+            "difference": stock - ledger,
+        }
+        if levels is not None:
+            row.update(levels=located, levels_difference=stock - located)
+        drift_count += 1
+        if len(sample) < RECONCILE_DRIFT_SAMPLE:
+            sample.append(row)
+        batch.append({**row, "run_id": run_id, "checked_at": checked_at})
+        if len(batch) == SNAPSHOT_WRITE_BATCH:
+            await db.stock_drift.insert_many(batch)
+            batch = []
+    if batch:
+        await db.stock_drift.insert_many(batch)
+    report = {
+        "run_id": run_id,
+        "checked_at": checked_at,
+        "snapshot_at": as_of,
+        "products": products,
+        "levels_checked": levels is not None,
+        "drift_count": drift_count,
+        "drift": sample,
+    }
+    await db.stock_reconciliations.insert_one(dict(report))
+    return report
+
+
+async def run_snapshot_scheduler(db: AsyncIOMotorDatabase, interval: float = STOCK_SNAPSHOT_INTERVAL):
+    """Tarea de fondo: fotos de los días cerrados y conciliación después de cada una"""
+    while True:
+        try:
+            if await take_due_snapshots(db):
+                report = await reconcile(db)
+                if report["drift_count"]:
+                    logger.warning(f"Stock descuadrado en {report['drift_count']} productos (ver /api/inventory/reconciliation)")
+        except Exception as e:
+            logger.error(f"Error guardando fotos de stock: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,206 @@
+"""
+Documentos de traslado entre ubicaciones o sucursales
+
+Un traslado (`stock_transfers`, número TRF-000001) pasa por tres estados:
+
+- draft: creado, todavía no mueve stock
+- in_transit: despachado; las unidades salen del origen hacia la ubicación
+  interna TRANSIT_LOCATION, así `products.stock` (el total) no cambia
+  mientras viajan
+- received: todas las líneas recibidas. La recepción puede ser parcial:
+  cada una suma `received_qty` por línea y pasa esas unidades de
+  TRANSIT_LOCATION al destino; el traslado sigue in_transit hasta completarse
+
+Cada paso toma primero el documento con una actualización condicional (solo
+un despacho o una recepción puede ganar) y luego mueve el stock con
+stock_levels.transfer_stock (todo o nada); si el stock no alcanza, el
+documento vuelve a como estaba. Los movimientos de cada paso se escriben en
+pares (transfer_out / transfer_in) con un solo insert_many.
+"""
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from sequences import TRANSFER_SEQUENCE, format_transfer_number, reserve_numbers
+from stock_levels import transfer_stock
+from stock import InsufficientStock
+
+TRANSIT_LOCATION = os.environ.get("TRANSIT_LOCATION", "en_transito")
+# Largest transfer accepted in one request
+TRANSFER_MAX_LINES = int(os.environ.get("TRANSFER_MAX_LINES", 1000))
+
+DRAFT = "draft"
+IN_TRANSIT = "in_transit"
+RECEIVED = "received"
+
+
+async def setup_stock_transfers(db: AsyncIOMotorDatabase):
+    await db.stock_transfers.create_index("transfer_number", unique=True)
+    await db.stock_transfers.create_index([("status", 1), ("created_at", -1)])
+
+
+async def create_transfer(db: AsyncIOMotorDatabase, from_location: str, to_location: str,
+                          quantities: Dict[str, int], names: Dict[str, str], created_by: str,
+                          notes: Optional[str] = None) -> dict:
+    """Guardar un traslado en borrador con una línea por producto"""
+    number = format_transfer_number((await reserve_numbers(db, TRANSFER_SEQUENCE))[0])
+    transfer = {
+        "transfer_number": number,
+        "from_location": from_location,
+        "to_location": to_location,
+        "status": DRAFT,
+        "items": [
+            {"barcode": barcode, "product_name": names[barcode], "quantity": quantity, "received_qty": 0}
+            for barcode, quantity in quantities.items()
+        ],
+        "notes": notes,
+        "receipts": [],
+        "created_by": created_by,
+        "created_at": datetime.now(timezone.utc),
+    }
+    await db.stock_transfers.insert_one(dict(transfer))
+    return transfer
+
+
+async def _write_movements(db: AsyncIOMotorDatabase, transfer: dict, quantities: Dict[str, int],
+                           source: str, target: str, created_by: str):
+    names = {line["barcode"]: line["product_name"] for line in transfer["items"]}
+    now = datetime.now(timezone.utc)
+    await db.inventory_movements.insert_many([
+        {
+            "barcode": barcode,
+            "product_name": names.get(barcode),
+            "movement_type": movement_type,
+            "quantity": sign * quantity,
+            "reference": transfer["transfer_number"],
+            "location": location,
+            "created_by": created_by,
+            "created_at": now,
+        }
+        for barcode, quantity in quantities.items()
+        for movement_type, sign, location in (("transfer_out", -1, source), ("transfer_in", 1, target))
+    ])
+
+
+async def dispatch_transfer(db: AsyncIOMotorDatabase, transfer_number: str, dispatched_by: str) -> Optional[dict]:
+    """
+    Despachar un borrador: descuenta el origen y deja las unidades en tránsito
+
+    Devuelve None si el traslado no existe o no está en borrador; lanza
+    InsufficientStock (y el traslado sigue en borrador) si el origen no alcanza.
+    """
+    transfer = await db.stock_transfers.find_one_and_update(
+        {"transfer_number": transfer_number, "status": DRAFT},
+        {"$set": {"status": IN_TRANSIT, "dispatched_at": datetime.now(timezone.utc), "dispatched_by": dispatched_by}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not transfer:
+        return None
+    quantities = {line["barcode"]: line["quantity"] for line in transfer["items"]}
+    try:
+        await transfer_stock(db, transfer["from_location"], TRANSIT_LOCATION, quantities)
+    except InsufficientStock:
+        await db.stock_transfers.update_one(
+            {"transfer_number": transfer_number, "status": IN_TRANSIT},
+            {"$set": {"status": DRAFT}, "$unset": {"dispatched_at": "", "dispatched_by": ""}}
+        )
+        raise
+    await _write_movements(db, transfer, quantities, transfer["from_location"], TRANSIT_LOCATION, dispatched_by)
+    return transfer
+
+
+def outstanding(transfer: dict) -> Dict[str, int]:
+    """Unidades por recibir de cada línea"""
+    return {
+        line["barcode"]: line["quantity"] - line.get("received_qty", 0)
+        for line in transfer["items"] if line["quantity"] > line.get("received_qty", 0)
+    }
+
+
+def _receivable_expr(barcodes: List[str], quantities: List[int]) -> dict:
+    """Todas las líneas pedidas existen y ninguna supera lo pendiente"""
+    return {"$and": [
+        {"$setIsSubset": [barcodes, "$items.barcode"]},
+        {"$allElementsTrue": [{"$map": {
+            "input": "$items",
+            "as": "line",
+            "in": {"$let": {
+                "vars": {"index": {"$indexOfArray": [barcodes, "$$line.barcode"]}},
+                "in": {"$or": [
+                    {"$lt": ["$$index", 0]},
+                    {"$lte": [{"$add": ["$$line.received_qty", {"$arrayElemAt": [quantities, "$$index"]}]},
+                              "$$line.quantity"]},
+                ]},
+            }},
+        }}]},
+    ]}
+
+
+def _receipt_update(barcodes: List[str], quantities: List[int], receipt: Optional[dict]) -> list:
+    """Sumar las cantidades a `received_qty`, registrar el recibo y recalcular el estado"""
+    receipts = {"$ifNull": ["$receipts", []]}
+    return [
+        {"$set": {
+            "items": {"$map": {
+                "input": "$items",
+                "as": "line",
+                "in": {"$let": {
+                    "vars": {"index": {"$indexOfArray": [barcodes, "$$line.barcode"]}},
+                    "in": {"$mergeObjects": ["$$line", {"received_qty": {"$add": [
+                        "$$line.received_qty",
+                        {"$cond": [{"$lt": ["$$index", 0]}, 0, {"$arrayElemAt": [quantities, "$$index"]}]},
+                    ]}}]},
+                }},
+            }},
+            "receipts": {"$concatArrays": [receipts, [{"$literal": receipt}]]} if receipt else receipts,
+        }},
+        {"$set": {"status": {"$cond": [
+            {"$allElementsTrue": [{"$map": {
+                "input": "$items", "as": "line", "in": {"$gte": ["$$line.received_qty", "$$line.quantity"]},
+            }}]},
+            RECEIVED,
+            IN_TRANSIT,
+        ]}}},
+        {"$set": {"received_at": {"$cond": [{"$eq": ["$status", RECEIVED]}, "$$NOW", "$$REMOVE"]}}},
+    ]
+
+
+async def receive_transfer(db: AsyncIOMotorDatabase, transfer_number: str, quantities: Dict[str, int],
+                           received_by: str) -> Optional[dict]:
+    """
+    Recibir {barcode: unidades} de un traslado en tránsito (parcial o total)
+
+    Devuelve None si el traslado no existe, no está en tránsito o alguna
+    cantidad supera lo pendiente; lanza InsufficientStock si las unidades no
+    están en tránsito (y la recepción se deshace).
+    """
+    barcodes, amounts = list(quantities), list(quantities.values())
+    receipt_id = uuid.uuid4().hex
+    receipt = {
+        "receipt_id": receipt_id,
+        "received_at": datetime.now(timezone.utc),
+        "received_by": received_by,
+        "items": [{"barcode": barcode, "quantity": quantity} for barcode, quantity in quantities.items()],
+    }
+    transfer = await db.stock_transfers.find_one_and_update(
+        {"transfer_number": transfer_number, "status": IN_TRANSIT, "$expr": _receivable_expr(barcodes, amounts)},
+        _receipt_update(barcodes, amounts, receipt),
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not transfer:
+        return None
+    try:
+        await transfer_stock(db, TRANSIT_LOCATION, transfer["to_location"], quantities)
+    except InsufficientStock:
+        undo = _receipt_update(barcodes, [-amount for amount in amounts], None)
+        undo[0]["$set"]["receipts"] = {"$filter": {
+            "input": "$receipts", "as": "receipt", "cond": {"$ne": ["$$receipt.receipt_id", receipt_id]},
+        }}
+        await db.stock_transfers.update_one({"transfer_number": transfer_number}, undo)
+        raise
+    await _write_movements(db, transfer, quantities, TRANSIT_LOCATION, transfer["to_location"], received_by)
+    return transfer
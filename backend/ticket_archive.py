@@ -0,0 +1,45 @@
+"""
+Archivo ZIP escrito en streaming para exportar lotes de tickets
+"""
+import zipfile
+from datetime import datetime
+
+
+class _BufferSink:
+    """Destino de escritura no posicionable que se vacía después de cada archivo"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class ZipStream:
+    """
+    ZIP generado incrementalmente: add() y close() devuelven los bytes
+    listos para enviar, sin mantener el archivo completo en memoria
+    """
+
+    def __init__(self):
+        self._sink = _BufferSink()
+        # PDFs are already compressed; storing keeps the event loop free of deflate work
+        self._zip = zipfile.ZipFile(self._sink, mode="w", compression=zipfile.ZIP_STORED)
+
+    def add(self, filename, data):
+        info = zipfile.ZipInfo(filename, date_time=datetime.now().timetuple()[:6])
+        self._zip.writestr(info, data)
+        return self._sink.drain()
+
+    def close(self):
+        self._zip.close()
+        return self._sink.drain()
@@ -0,0 +1,84 @@
+"""
+Renderizado de tickets en texto de ancho fijo y ESC/POS para impresoras térmicas
+"""
+import textwrap
+from ticket_layout import CENTER, LEFT, NOTE, RULE, LINE_HEIGHT
+
+# Blank line before lines spaced at least this much in the PDF layout
+BLANK_LINE_BEFORE = LINE_HEIGHT * 1.5
+
+# Characters per line with the printer's default font A (12 dots wide)
+COLUMNS = {58: 32, 80: 48}
+QTY_COLUMNS = 5
+
+# ESC/POS commands
+ESC = b"\x1b"
+GS = b"\x1d"
+INIT = ESC + b"@"
+CODEPAGE_PC850 = ESC + b"t\x02"
+ALIGN_LEFT = ESC + b"a\x00"
+ALIGN_CENTER = ESC + b"a\x01"
+BOLD_ON = ESC + b"E\x01"
+BOLD_OFF = ESC + b"E\x00"
+DOUBLE_HEIGHT = GS + b"!\x01"
+NORMAL_SIZE = GS + b"!\x00"
+FEED_AND_CUT = ESC + b"d\x04" + GS + b"V\x42\x00"
+
+
+def _columns(ticket_width):
+    return COLUMNS.get(ticket_width, COLUMNS[80])
+
+
+def _format_line(line, cols):
+    """Convertir una línea del diseño en una o más líneas de texto sin alinear"""
+    if line.kind == RULE:
+        return ["-" * cols]
+    if line.kind in (CENTER, LEFT):
+        if len(line.text) <= cols:
+            return [line.text]
+        return textwrap.wrap(line.text, cols)
+    if line.kind == NOTE:
+        return [(" " * QTY_COLUMNS + line.text)[:cols]]
+    # ROW: quantity/label, product name (truncated to fit) and right-aligned amount
+    left = line.left.ljust(QTY_COLUMNS)
+    available = max(0, cols - len(left) - len(line.right) - 1)
+    return [f"{left}{line.text[:available].ljust(available)} {line.right}"]
+
+
+def render_text(blocks, ticket_width=80):
+    """Renderizar el diseño como texto de ancho fijo (str)"""
+    cols = _columns(ticket_width)
+    out = []
+    for block in blocks:
+        for line in block:
+            if line.before >= BLANK_LINE_BEFORE:
+                out.append("")
+            for text in _format_line(line, cols):
+                out.append(text.center(cols).rstrip() if line.kind == CENTER else text)
+    return "\n".join(out) + "\n"
+
+
+def render_escpos(blocks, ticket_width=80):
+    """Renderizar el diseño como bytes ESC/POS listos para enviar a la impresora"""
+    cols = _columns(ticket_width)
+    out = bytearray(INIT + CODEPAGE_PC850)
+    for block in blocks:
+        for line in block:
+            if line.before >= BLANK_LINE_BEFORE:
+                out += b"\n"
+            if line.kind == CENTER:
+                out += ALIGN_CENTER
+            if line.bold:
+                out += BOLD_ON
+            if line.size >= 10:
+                out += DOUBLE_HEIGHT
+            for text in _format_line(line, cols):
+                out += text.encode("cp850", "replace") + b"\n"
+            if line.size >= 10:
+                out += NORMAL_SIZE
+            if line.bold:
+                out += BOLD_OFF
+            if line.kind == CENTER:
+                out += ALIGN_LEFT
+    out += FEED_AND_CUT
+    return bytes(out)
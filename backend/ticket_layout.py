@@ -0,0 +1,182 @@
+"""
+Modelo de diseño compartido para tickets (PDF, ESC/POS y texto plano)
+"""
+from datetime import datetime
+from typing import List, NamedTuple
+import textwrap
+
+# Vertical metrics in mm (used by the PDF renderer)
+LINE_HEIGHT = 4
+NOTE_HEIGHT = 3
+
+# Line kinds
+CENTER = "center"  # text centered
+LEFT = "left"      # text at the left margin
+ROW = "row"        # left column (qty/label), product column (text) and right-aligned amount
+NOTE = "note"      # small text under the product column
+RULE = "rule"      # separator line
+
+MAX_PRODUCT_NAME = 25
+
+
+class TicketLine(NamedTuple):
+    """Una línea del ticket, independiente del formato de salida"""
+    kind: str
+    text: str = ""
+    left: str = ""
+    right: str = ""
+    bold: bool = False
+    size: int = 7
+    before: float = 0  # mm advanced before drawing
+    after: float = 0   # mm advanced after drawing
+
+
+def build_ticket_layout(invoice_data, company_config) -> List[List[TicketLine]]:
+    """
+    Construir el diseño del ticket como una lista de bloques de líneas
+
+    invoice_data: dict con datos de la factura (incluye 'returns')
+    company_config: dict con configuración de empresa
+    """
+    blocks = [_company_header(company_config), _rule(), _invoice_info(invoice_data), _rule()]
+
+    if invoice_data.get('client_name'):
+        blocks.append(_client_info(invoice_data))
+        blocks.append(_rule())
+
+    blocks.append(_products_header())
+    blocks.extend(_product_block(item) for item in invoice_data.get('items', []))
+
+    returns = invoice_data.get('returns', [])
+    if returns:
+        blocks.append(_rule())
+        blocks.append(_returns_header())
+        for ret in returns:
+            blocks.extend(_product_block(item, returned=True) for item in ret.get('items', []))
+
+    blocks.append(_rule())
+    blocks.append(_totals(invoice_data))
+    blocks.append(_footer())
+    return blocks
+
+
+def block_height(block):
+    """Altura exacta de un bloque en mm"""
+    return sum(line.before + line.after for line in block)
+
+
+def continuation_header(invoice_number, page, pages):
+    """Encabezado de las páginas de continuación de un ticket largo"""
+    return [
+        TicketLine(CENTER, f"FACTURA: {invoice_number} (cont. {page}/{pages})", bold=True, size=8, after=LINE_HEIGHT),
+        TicketLine(RULE, before=LINE_HEIGHT * 0.5, after=LINE_HEIGHT * 0.5),
+    ]
+
+
+CONTINUATION_HEIGHT = block_height(continuation_header("", 1, 1))
+
+
+def paginate_layout(blocks, max_content_height):
+    """
+    Repartir los bloques en páginas de como máximo max_content_height mm
+
+    Los bloques nunca se parten; las páginas de continuación reservan
+    espacio para su encabezado (continuation_header).
+    """
+    pages = [[]]
+    used = 0
+    limit = max_content_height
+    for block in blocks:
+        height = block_height(block)
+        if pages[-1] and used + height > limit:
+            pages.append([])
+            used = 0
+            limit = max_content_height - CONTINUATION_HEIGHT
+        pages[-1].append(block)
+        used += height
+    return pages
+
+
+def format_date(created_at):
+    """Formatear la fecha de la factura como dd/mm/YYYY HH:MM"""
+    if isinstance(created_at, str):
+        try:
+            dt = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+            return dt.strftime('%d/%m/%Y %H:%M')
+        except ValueError:
+            return created_at
+    return created_at.strftime('%d/%m/%Y %H:%M') if created_at else 'N/A'
+
+
+def _rule():
+    return [TicketLine(RULE, before=LINE_HEIGHT * 0.5, after=LINE_HEIGHT * 0.5)]
+
+
+def _company_header(config):
+    lines = [TicketLine(CENTER, config.get('company_name', 'EMPRESA'), bold=True, size=10, after=LINE_HEIGHT)]
+    if config.get('nit'):
+        lines.append(TicketLine(CENTER, f"NIT: {config['nit']}", after=LINE_HEIGHT))
+    if config.get('phone'):
+        lines.append(TicketLine(CENTER, f"Tel: {config['phone']}", after=LINE_HEIGHT))
+    if config.get('email'):
+        lines.append(TicketLine(CENTER, config['email'], after=LINE_HEIGHT))
+    if config.get('address'):
+        # Wrap long addresses
+        for line in textwrap.wrap(config['address'], width=35):
+            lines.append(TicketLine(CENTER, line, after=LINE_HEIGHT))
+    return lines
+
+
+def _invoice_info(invoice_data):
+    lines = [
+        TicketLine(CENTER, f"FACTURA: {invoice_data.get('invoice_number', 'N/A')}", bold=True, size=8, after=LINE_HEIGHT),
+        TicketLine(CENTER, format_date(invoice_data.get('created_at')), after=LINE_HEIGHT),
+    ]
+    # Usuario que vendió
+    if invoice_data.get('created_by'):
+        lines.append(TicketLine(CENTER, f"Vendedor: {invoice_data['created_by']}", after=LINE_HEIGHT))
+    return lines
+
+
+def _client_info(invoice_data):
+    lines = [TicketLine(LEFT, f"Cliente: {invoice_data.get('client_name', 'N/A')}", after=LINE_HEIGHT)]
+    if invoice_data.get('client_document'):
+        lines.append(TicketLine(LEFT, f"Doc: {invoice_data['client_document']}", after=LINE_HEIGHT))
+    return lines
+
+
+def _products_header():
+    return [TicketLine(ROW, "PRODUCTO", left="CANT", right="TOTAL", bold=True, before=LINE_HEIGHT)]
+
+
+def _returns_header():
+    return [TicketLine(CENTER, "--- DEVOLUCIONES ---", bold=True, before=LINE_HEIGHT * 0.5, after=LINE_HEIGHT)]
+
+
+def _product_block(item, returned=False):
+    """Línea de producto más precio unitario; las devoluciones llevan signo negativo"""
+    sign = "-" if returned else ""
+    product_name = item.get('product_name', 'Producto')
+    if len(product_name) > MAX_PRODUCT_NAME:
+        product_name = product_name[:MAX_PRODUCT_NAME - 3] + '...'
+    unit_note = f"  @${item.get('unit_price', 0):,.2f} c/u" + (" (DEV)" if returned else "")
+    return [
+        TicketLine(ROW, product_name, left=f"{sign}{item.get('quantity', 0)}",
+                   right=f"{sign}${item.get('total', 0):,.2f}", before=LINE_HEIGHT),
+        TicketLine(NOTE, unit_note, size=6, before=NOTE_HEIGHT),
+    ]
+
+
+def _totals(invoice_data):
+    return [
+        TicketLine(ROW, left="SUBTOTAL:", right=f"${invoice_data.get('subtotal', 0):,.2f}", size=8, before=LINE_HEIGHT * 1.5),
+        TicketLine(ROW, left="IVA:", right=f"${invoice_data.get('total_tax', 0):,.2f}", size=8, before=LINE_HEIGHT),
+        TicketLine(ROW, left="TOTAL:", right=f"${invoice_data.get('total', 0):,.2f}", bold=True, size=10, before=LINE_HEIGHT * 1.2),
+    ]
+
+
+def _footer():
+    return [
+        TicketLine(CENTER, "¡Gracias por su compra!", size=6, before=LINE_HEIGHT * 2, after=LINE_HEIGHT),
+        TicketLine(CENTER, "Sistema Boltrex", size=6, after=LINE_HEIGHT),
+    ]
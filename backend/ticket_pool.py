@@ -0,0 +1,118 @@
+"""
+Pool de procesos para renderizar tickets PDF fuera del event loop
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from ticket_generator import TicketPDFGenerator
+
+# Pool configuration (overridable through the environment)
+TICKET_POOL_WORKERS = int(os.environ.get("TICKET_POOL_WORKERS", min(4, os.cpu_count() or 1)))
+TICKET_POOL_MAX_PENDING = int(os.environ.get("TICKET_POOL_MAX_PENDING", 64))
+TICKET_RENDER_TIMEOUT = float(os.environ.get("TICKET_RENDER_TIMEOUT", 10))
+# Share of the queue batch exports may use; the rest stays free for interactive prints
+TICKET_POOL_BATCH_PENDING = int(os.environ.get("TICKET_POOL_BATCH_PENDING", max(1, TICKET_POOL_MAX_PENDING // 4)))
+
+# Generators cached inside each worker process, keyed by ticket width
+_worker_generators = {}
+
+
+def _init_worker():
+    """Inicializar el proceso worker: fuentes y generadores se cargan una sola vez"""
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    for width in (58, 80):
+        _worker_generators[width] = TicketPDFGenerator(ticket_width=width)
+
+    # Warm up the font metrics cache used to center text
+    for font in ("Helvetica", "Helvetica-Bold"):
+        stringWidth("0", font, 7)
+
+
+def _render_ticket(ticket_width, invoice_data, company_config):
+    """Renderizar un ticket dentro del worker y devolver los bytes del PDF"""
+    generator = _worker_generators.get(ticket_width)
+    if generator is None:
+        generator = _worker_generators[ticket_width] = TicketPDFGenerator(ticket_width=ticket_width)
+    return generator.generate_ticket(invoice_data, company_config).getvalue()
+
+
+class TicketPoolBusy(Exception):
+    """La cola de renderizado está llena"""
+
+
+class TicketRenderPool:
+    """Cola acotada de renderizado de tickets sobre un ProcessPoolExecutor"""
+
+    def __init__(self, workers=TICKET_POOL_WORKERS, max_pending=TICKET_POOL_MAX_PENDING,
+                 timeout=TICKET_RENDER_TIMEOUT, batch_pending=TICKET_POOL_BATCH_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.batch_pending = min(batch_pending, max_pending)
+        self.pending = 0
+        self._executor = None
+        self._batch_slots = None
+
+    def start(self):
+        """Crear el pool de procesos (idempotente)"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker
+            )
+
+    def shutdown(self):
+        """Detener el pool sin esperar trabajos pendientes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, fn, *args):
+        """
+        Ejecutar fn(*args) en un worker respetando la cola y el timeout
+
+        Raises TicketPoolBusy si la cola está llena y asyncio.TimeoutError
+        si el worker no responde a tiempo.
+        """
+        if self.pending >= self.max_pending:
+            raise TicketPoolBusy()
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            job = self._executor.submit(fn, *args)
+            self.pending += 1
+            # The slot is held until the worker is done with the job, not just until
+            # we stop waiting: a timed-out render keeps its worker busy
+            job.add_done_callback(lambda _: self._release_from(loop))
+            return await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM); recreate the pool for the next request
+            self.shutdown()
+            raise
+
+    def _release_from(self, loop):
+        # Runs in the executor's thread once the job finishes or is cancelled
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(self._release)
+
+    def _release(self):
+        self.pending -= 1
+
+    async def render(self, ticket_width, invoice_data, company_config):
+        """Renderizar un ticket PDF y devolver sus bytes"""
+        return await self.submit(_render_ticket, ticket_width, invoice_data, company_config)
+
+    async def render_batch(self, ticket_width, invoice_data, company_config):
+        """
+        Renderizar un ticket de una exportación masiva
+
+        Espera turno entre los `batch_pending` cupos de exportación en lugar de
+        ocupar la cola, así las impresiones interactivas siempre tienen lugar.
+        """
+        if self._batch_slots is None:
+            self._batch_slots = asyncio.Semaphore(self.batch_pending)
+        async with self._batch_slots:
+            return await self.render(ticket_width, invoice_data, company_config)
@@ -0,0 +1,170 @@
+"""
+Fechas guardadas como Date nativo de BSON
+
+Las versiones anteriores guardaban las fechas como texto ISO
+(`datetime.isoformat()`). Las escrituras nuevas guardan `datetime` y
+`migrate_dates` convierte los documentos existentes por lotes (módulo
+`migrations`). Mientras la migración no termina, los filtros y agregaciones
+de este módulo aceptan los dos formatos (lectura dual); al completarse
+quedan en consultas simples sobre el tipo nativo.
+"""
+import logging
+import os
+from datetime import date, datetime, time, timezone, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from migrations import MigrationStep, run_migration, migration_completed, MIGRATION_BATCH
+
+logger = logging.getLogger(__name__)
+
+# Date fields of every collection written by the API
+DATE_FIELDS = {
+    "users": ["created_at", "updated_at"],
+    "categories": ["created_at"],
+    "price_lists": ["created_at"],
+    "products": ["created_at"],
+    "document_types": ["created_at"],
+    "clients": ["created_at"],
+    "suppliers": ["created_at"],
+    "tax_rates": ["effective_date", "created_at"],
+    "payment_methods": ["created_at"],
+    "invoices": ["created_at"],
+    "returns": ["created_at"],
+    "purchases": ["created_at"],
+    "supplier_returns": ["created_at"],
+    "inventory_movements": ["created_at"],
+    "fio_payments": ["created_at"],
+    "ticket_config": ["updated_at"],
+    "users_extended": ["created_at", "updated_at"],
+    "system_modules": ["created_at"],
+    "roles": ["created_at"],
+    "role_permissions": ["created_at"],
+}
+
+MIGRATION_ID = "native_dates"
+
+# Time zone used to cut report buckets (day, week, month)
+REPORT_TIMEZONE = os.environ.get("REPORT_TIMEZONE", "America/Bogota")
+
+# True until the migration has converted every document
+_legacy_reads = True
+
+
+def legacy_reads() -> bool:
+    return _legacy_reads
+
+
+async def load_migration_state(db: AsyncIOMotorDatabase):
+    """Desactivar la lectura dual si la migración ya terminó (al iniciar)"""
+    global _legacy_reads
+    _legacy_reads = not await migration_completed(db, MIGRATION_ID)
+
+
+def to_datetime(value) -> Optional[datetime]:
+    """Fecha leída de Mongo (Date o texto ISO) como datetime con zona UTC"""
+    if value is None or isinstance(value, datetime):
+        return value if value is None or value.tzinfo else value.replace(tzinfo=timezone.utc)
+    dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def parse_date_param(value: str, end: bool = False) -> datetime:
+    """
+    Parámetro de consulta (YYYY-MM-DD o ISO completo) a datetime UTC
+
+    Una fecha sin hora es un día local de REPORT_TIMEZONE, el mismo que usan
+    los informes por día; con end=True cubre el día completo.
+    """
+    try:
+        if len(value) == 10:
+            day = date.fromisoformat(value) + timedelta(days=1 if end else 0)
+            dt = datetime.combine(day, time.min, ZoneInfo(REPORT_TIMEZONE)).astimezone(timezone.utc)
+            return dt - timedelta(microseconds=1) if end else dt
+        return to_datetime(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Fecha inválida: {value}")
+
+
+def date_range_query(field: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> dict:
+    """
+    Filtro de rango de fechas para combinar con query.update()
+
+    Durante la migración también compara los documentos con fecha en texto;
+    Mongo no compara entre tipos, así que cada rama solo encuentra su formato.
+    """
+    native = {}
+    if start_date:
+        native["$gte"] = parse_date_param(start_date)
+    if end_date:
+        native["$lte"] = parse_date_param(end_date, end=True)
+    if not native:
+        return {}
+    if not _legacy_reads:
+        return {field: native}
+    legacy = {op: value.isoformat() for op, value in native.items()}
+    return {"$or": [{field: native}, {field: legacy}]}
+
+
+def instant_range_query(field: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    """Filtro [start, end) sobre datetimes UTC, con la misma lectura dual que date_range_query"""
+    native = {}
+    if start:
+        native["$gte"] = start
+    if end:
+        native["$lt"] = end
+    if not native:
+        return {}
+    if not _legacy_reads:
+        return {field: native}
+    legacy = {op: value.isoformat() for op, value in native.items()}
+    return {"$or": [{field: native}, {field: legacy}]}
+
+
+def date_expr(field: str):
+    """Expresión de agregación que devuelve `field` como Date"""
+    if not _legacy_reads:
+        return f"${field}"
+    return {"$cond": [
+        {"$eq": [{"$type": f"${field}"}, "string"]},
+        # Legacy values are UTC isoformat(); seconds precision is enough to bucket
+        {"$dateFromString": {"dateString": {"$substrBytes": [f"${field}", 0, 19]}, "timezone": "UTC"}},
+        f"${field}",
+    ]}
+
+
+def bucket_expr(field: str, unit: str, tz: str = REPORT_TIMEZONE) -> dict:
+    """Inicio del día, semana (lunes) o mes de `field` en la zona del informe"""
+    return {"$dateTrunc": {"date": date_expr(field), "unit": unit, "timezone": tz, "startOfWeek": "monday"}}
+
+
+def _convert_dates(collection, fields):
+    def convert(doc):
+        changes = {}
+        for field in fields:
+            value = doc.get(field)
+            if not isinstance(value, str):
+                continue
+            try:
+                changes[field] = to_datetime(value)
+            except ValueError:
+                logger.warning(f"{collection} {doc['_id']}: {field} no es una fecha ({value!r})")
+        return changes
+    return convert
+
+
+async def migrate_dates(db: AsyncIOMotorDatabase, batch_size: int = MIGRATION_BATCH, dry_run: bool = False) -> dict:
+    """Convertir las fechas en texto a Date nativo (ver migrations.run_migration)"""
+    global _legacy_reads
+    steps = {
+        collection: MigrationStep(
+            pending={"$or": [{field: {"$type": "string"}} for field in fields]},
+            projection={field: 1 for field in fields},
+            convert=_convert_dates(collection, fields),
+        )
+        for collection, fields in DATE_FIELDS.items()
+    }
+    converted = await run_migration(db, MIGRATION_ID, steps, batch_size, dry_run)
+    _legacy_reads = not await migration_completed(db, MIGRATION_ID)
+    return converted
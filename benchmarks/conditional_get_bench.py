@@ -0,0 +1,63 @@
+"""
+Benchmark: catalog endpoints with and without ETag revalidation
+
+For each endpoint, measures latency and bytes transferred for plain GETs
+versus GETs that send If-None-Match with the last ETag (304 responses).
+
+Usage:
+    REACT_APP_BACKEND_URL=http://localhost:8001 python benchmarks/conditional_get_bench.py
+"""
+import os
+import time
+import statistics
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001').rstrip('/')
+REQUESTS = 300
+ENDPOINTS = [
+    "/api/categories",
+    "/api/price-lists",
+    "/api/document-types",
+    "/api/tax-rates",
+    "/api/payment-methods",
+    "/api/suppliers",
+]
+
+
+def login():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": "admin@boltrex.com",
+        "password": "admin123"
+    })
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def measure(session, url, headers):
+    latencies = []
+    transferred = 0
+    status = None
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        response = session.get(url, headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000)
+        transferred += len(response.content)
+        status = response.status_code
+    return statistics.median(latencies), transferred / REQUESTS, status
+
+
+def main():
+    auth = login()
+    session = requests.Session()
+    print(f"{'endpoint':<24} {'full ms':>8} {'bytes':>8} {'304 ms':>8} {'bytes':>6}")
+    for endpoint in ENDPOINTS:
+        url = f"{BASE_URL}{endpoint}"
+        etag = session.get(url, headers=auth).headers.get("ETag")
+        full_ms, full_bytes, _ = measure(session, url, auth)
+        cond_ms, cond_bytes, status = measure(session, url, {**auth, "If-None-Match": etag or ""})
+        print(f"{endpoint:<24} {full_ms:8.2f} {full_bytes:8.0f} {cond_ms:8.2f} {cond_bytes:6.0f}"
+              f"{'' if status == 304 else '  (no 304: ' + str(status) + ')'}")
+
+
+if __name__ == "__main__":
+    main()
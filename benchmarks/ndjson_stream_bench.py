@@ -0,0 +1,74 @@
+"""
+Benchmark: JSON pages versus NDJSON streaming for inventory movements
+
+Reads the whole movements collection both ways and reports total time,
+time to first byte and the largest chunk the client had to hold. JSON
+mode follows X-Next-Cursor page by page; NDJSON mode is a single stream.
+Run the server under /usr/bin/time -v (or watch its RSS) to compare peak
+server memory.
+
+Usage:
+    REACT_APP_BACKEND_URL=http://localhost:8001 python benchmarks/ndjson_stream_bench.py
+"""
+import os
+import time
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001').rstrip('/')
+URL = f"{BASE_URL}/api/inventory/movements"
+
+
+def login():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": "admin@boltrex.com",
+        "password": "admin123"
+    })
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def read_pages(session, auth):
+    start = time.perf_counter()
+    first_byte = None
+    rows = 0
+    largest = 0
+    params = {}
+    while True:
+        response = session.get(URL, params=params, headers=auth)
+        response.raise_for_status()
+        first_byte = first_byte or time.perf_counter() - start
+        rows += len(response.json())
+        largest = max(largest, len(response.content))
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        params = {"cursor": cursor}
+    return rows, time.perf_counter() - start, first_byte, largest
+
+
+def read_stream(session, auth):
+    start = time.perf_counter()
+    first_byte = None
+    rows = 0
+    largest = 0
+    with session.get(URL, headers={**auth, "Accept": "application/x-ndjson"}, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            first_byte = first_byte or time.perf_counter() - start
+            if line:
+                rows += 1
+                largest = max(largest, len(line))
+    return rows, time.perf_counter() - start, first_byte or 0, largest
+
+
+def main():
+    auth = login()
+    session = requests.Session()
+    print(f"{'mode':<8} {'rows':>9} {'total s':>9} {'ttfb ms':>9} {'max chunk':>10}")
+    for mode, read in (("json", read_pages), ("ndjson", read_stream)):
+        rows, total, ttfb, largest = read(session, auth)
+        print(f"{mode:<8} {rows:9d} {total:9.2f} {ttfb * 1000:9.1f} {largest:10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark: indexed product search vs. the previous unanchored regex at 200k SKUs
+
+Seeds a scratch database (BENCH_DB_NAME, dropped at the end) with synthetic
+products and compares search_products() against the old
+{"$regex": q, "$options": "i"} query on barcode and name.
+
+Usage:
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/product_search_bench.py
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from product_search import search_fields, search_products, setup_product_search  # noqa: E402
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+BENCH_DB_NAME = os.environ.get("BENCH_DB_NAME", "boltrex_search_bench")
+NUM_PRODUCTS = 200_000
+QUERIES = ["arroz", "ACEITE gir", "café", "7701", "7701000123456", "leche desl", "xyz"]
+WORDS = ["Arroz", "Aceite", "Girasol", "Café", "Leche", "Deslactosada", "Azúcar", "Panela",
+         "Jabón", "Detergente", "Galletas", "Atún", "Frijol", "Lenteja", "Harina", "Sal"]
+
+
+async def seed(db):
+    await db.products.drop()
+    random.seed(1)
+    batch = []
+    for i in range(NUM_PRODUCTS):
+        barcode = f"7701{i:09d}"
+        name = " ".join(random.sample(WORDS, 3)) + f" {i % 1000}g"
+        batch.append({"barcode": barcode, "name": name, "category": "Bench", "purchase_price": 1.0,
+                      "tax_rate": 19, "prices": [], "stock": 0, **search_fields(barcode, name)})
+        if len(batch) == 5000:
+            await db.products.insert_many(batch)
+            batch = []
+    await setup_product_search(db)
+
+
+async def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+async def main():
+    db = AsyncIOMotorClient(MONGO_URL)[BENCH_DB_NAME]
+    print(f"🔍 Seeding {NUM_PRODUCTS} products...")
+    await seed(db)
+
+    print(f"\n{'query':<16} {'regex ms':>9} {'index ms':>9}")
+    for q in QUERIES:
+        legacy = {"$or": [{"barcode": {"$regex": q, "$options": "i"}}, {"name": {"$regex": q, "$options": "i"}}]}
+        regex_ms = await timed(lambda: db.products.find(legacy, {"_id": 0}).limit(20).to_list(20), repeat=5)
+        index_ms = await timed(lambda: search_products(db, q, 20))
+        print(f"{q:<16} {regex_ms:9.2f} {index_ms:9.2f}")
+
+    await db.client.drop_database(BENCH_DB_NAME)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""
+Benchmark: checkout throughput on a hot SKU, blind $inc vs strict stock
+
+Seeds a scratch database (BENCH_DB_NAME, dropped at the end) with one hot
+product and a few cold ones. Concurrent workers then attempt more sales than
+there is stock, each basket taking one hot unit plus one random cold unit:
+
+- blind: the previous per-item {"$inc": {"stock": -qty}}
+- strict: stock.decrement_stock (conditional batch, all-or-nothing)
+
+Reports sales per second, rejected baskets and oversold units. The strict
+mode uses a transaction on a replica set and compensation otherwise; run it
+against both deployments to compare.
+
+Usage:
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/stock_contention_bench.py
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+import stock  # noqa: E402
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+BENCH_DB_NAME = os.environ.get("BENCH_DB_NAME", "boltrex_stock_bench")
+HOT_STOCK = 2000
+ATTEMPTS = 2500
+COLD_SKUS = [f"COLD{i:03d}" for i in range(20)]
+CONCURRENCY = [1, 8, 32, 128]
+
+
+async def seed(db):
+    await db.products.drop()
+    await db.stock_reservations.drop()
+    await db.products.insert_many(
+        [{"barcode": "HOT", "stock": HOT_STOCK}] + [{"barcode": b, "stock": ATTEMPTS * 10} for b in COLD_SKUS]
+    )
+    await db.products.create_index("barcode")
+    await stock.setup_stock(db)
+
+
+async def blind_sale(db, basket):
+    for barcode, quantity in basket.items():
+        await db.products.update_one({"barcode": barcode}, {"$inc": {"stock": -quantity}})
+    return True
+
+
+async def strict_sale(db, basket):
+    try:
+        await stock.decrement_stock(db, basket)
+        return True
+    except stock.InsufficientStock:
+        return False
+
+
+async def run(db, sale, workers):
+    await seed(db)
+    remaining = [ATTEMPTS]
+    sold = [0]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            if await sale(db, {"HOT": 1, random.choice(COLD_SKUS): 1}):
+                sold[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    elapsed = time.perf_counter() - start
+    hot = await db.products.find_one({"barcode": "HOT"})
+    return sold[0] / elapsed, ATTEMPTS - sold[0], max(0, -hot["stock"])
+
+
+async def main():
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[BENCH_DB_NAME]
+    await seed(db)
+    print(f"🛒 {ATTEMPTS} baskets against {HOT_STOCK} hot units "
+          f"({'transactions' if stock._transactions else 'compensation'})")
+    print(f"\n{'mode':<8} {'workers':>7} {'sales/s':>9} {'rejected':>9} {'oversold':>9}")
+    for mode, sale in (("blind", blind_sale), ("strict", strict_sale)):
+        for workers in CONCURRENCY:
+            rate, rejected, oversold = await run(db, sale, workers)
+            print(f"{mode:<8} {workers:7d} {rate:9.0f} {rejected:9d} {oversold:9d}")
+    await client.drop_database(BENCH_DB_NAME)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Benchmark: PDF vs ESC/POS vs plain text ticket rendering (no server required)
+
+Usage:
+    python benchmarks/ticket_formats_bench.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from ticket_generator import TicketPDFGenerator  # noqa: E402
+from ticket_layout import build_ticket_layout  # noqa: E402
+from ticket_escpos import render_escpos, render_text  # noqa: E402
+
+CONFIG = {
+    "company_name": "Mi Empresa",
+    "nit": "900.123.456-7",
+    "phone": "+57 300 123 4567",
+    "email": "ventas@miempresa.com",
+    "address": "Calle 123 #45-67, Bogotá",
+    "ticket_width": 80,
+}
+
+
+def sample_invoice(num_items, num_returns=0):
+    items = [{
+        "barcode": f"{i:06d}",
+        "product_name": f"Producto de prueba {i}",
+        "quantity": 1 + i % 5,
+        "unit_price": 1500.0,
+        "total": 1500.0 * (1 + i % 5),
+    } for i in range(num_items)]
+    return {
+        "invoice_number": "INV-000001",
+        "client_name": "Juan Pérez",
+        "client_document": "123456789",
+        "items": items,
+        "subtotal": sum(i["total"] for i in items) / 1.19,
+        "total_tax": sum(i["total"] for i in items) * 0.19 / 1.19,
+        "total": sum(i["total"] for i in items),
+        "created_at": "2025-01-15T10:30:00+00:00",
+        "created_by": "admin@boltrex.com",
+        "returns": [{"items": items[:num_returns]}] if num_returns else [],
+    }
+
+
+def bench(label, fn, number):
+    seconds = timeit.timeit(fn, number=number) / number
+    print(f"  {label:<8} {seconds * 1e6:10.1f} µs")
+    return seconds
+
+
+def main():
+    generator = TicketPDFGenerator(ticket_width=80)
+    for num_items in (5, 30, 100):
+        invoice = sample_invoice(num_items, num_returns=num_items // 5)
+        print(f"\n📊 {num_items} items")
+        pdf = bench("pdf", lambda: generator.generate_ticket(invoice, CONFIG), 50)
+        escpos = bench("escpos", lambda: render_escpos(build_ticket_layout(invoice, CONFIG), 80), 2000)
+        bench("text", lambda: render_text(build_ticket_layout(invoice, CONFIG), 80), 2000)
+
+        pdf_size = len(generator.generate_ticket(invoice, CONFIG).getvalue())
+        escpos_size = len(render_escpos(build_ticket_layout(invoice, CONFIG), 80))
+        print(f"  speedup  {pdf / escpos:10.1f}x   size pdf={pdf_size}B escpos={escpos_size}B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Benchmark: PDF ticket rendering time vs. invoice size (no server required)
+
+Shows that the two-pass layout scales linearly up to 500-line invoices
+with returns, and how many continuation pages each size produces.
+
+Usage:
+    python benchmarks/ticket_pagination_bench.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ticket_generator import TicketPDFGenerator  # noqa: E402
+from ticket_formats_bench import CONFIG, sample_invoice  # noqa: E402
+
+
+def main():
+    generator = TicketPDFGenerator(ticket_width=80)
+    print(f"{'lines':>6} {'pages':>6} {'ms':>9} {'µs/line':>9}")
+    for num_items in (10, 50, 100, 250, 500):
+        invoice = sample_invoice(num_items, num_returns=num_items // 10)
+        number = max(3, 200 // num_items)
+        seconds = timeit.timeit(lambda: generator.generate_ticket(invoice, CONFIG), number=number) / number
+        pdf = generator.generate_ticket(invoice, CONFIG).getvalue()
+        pages = len(re.findall(rb"/Type /Page\b", pdf))
+        lines = num_items + num_items // 10
+        print(f"{lines:>6} {pages:>6} {seconds * 1e3:9.2f} {seconds * 1e6 / lines:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
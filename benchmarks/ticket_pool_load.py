@@ -0,0 +1,111 @@
+"""
+Load test: p99 latency of unrelated endpoints while tickets are being printed
+
+Runs two phases against a live server:
+1. Baseline: only GET /api/categories and GET /api/payment-methods
+2. Load: the same probes while TICKETS_PER_SECOND tickets are requested
+
+Usage:
+    REACT_APP_BACKEND_URL=http://localhost:8001 python benchmarks/ticket_pool_load.py INV-000001
+"""
+import os
+import sys
+import time
+import threading
+import statistics
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001').rstrip('/')
+TICKETS_PER_SECOND = 20
+PHASE_SECONDS = 15
+PROBE_ENDPOINTS = ["/api/categories", "/api/payment-methods"]
+
+
+def login():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": "admin@boltrex.com",
+        "password": "admin123"
+    })
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def probe(headers, stop, latencies):
+    """Hit unrelated endpoints in a tight loop and record latency (ms)"""
+    session = requests.Session()
+    i = 0
+    while not stop.is_set():
+        endpoint = PROBE_ENDPOINTS[i % len(PROBE_ENDPOINTS)]
+        start = time.perf_counter()
+        session.get(f"{BASE_URL}{endpoint}", headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000)
+        i += 1
+
+
+def print_tickets(headers, invoice_number, stop, results):
+    """Request TICKETS_PER_SECOND tickets per second, one thread per request"""
+    def one():
+        response = requests.get(f"{BASE_URL}/api/pos/invoices/{invoice_number}/ticket", headers=headers)
+        results.append(response.status_code)
+
+    interval = 1.0 / TICKETS_PER_SECOND
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        threading.Thread(target=one, daemon=True).start()
+        next_at += interval
+        time.sleep(max(0, next_at - time.perf_counter()))
+
+
+def run_phase(headers, invoice_number=None, probes=4):
+    stop = threading.Event()
+    latencies = []
+    ticket_results = []
+    threads = [threading.Thread(target=probe, args=(headers, stop, latencies)) for _ in range(probes)]
+    if invoice_number:
+        threads.append(threading.Thread(target=print_tickets, args=(headers, invoice_number, stop, ticket_results)))
+    for t in threads:
+        t.start()
+    time.sleep(PHASE_SECONDS)
+    stop.set()
+    for t in threads:
+        t.join()
+    return latencies, ticket_results
+
+
+def report(name, latencies):
+    print(f"{name:<10} n={len(latencies):<6} "
+          f"p50={percentile(latencies, 50):7.1f}ms "
+          f"p99={percentile(latencies, 99):7.1f}ms "
+          f"mean={statistics.mean(latencies) if latencies else 0:7.1f}ms")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    invoice_number = sys.argv[1]
+    headers = login()
+
+    print(f"🔍 Baseline ({PHASE_SECONDS}s)...")
+    baseline, _ = run_phase(headers)
+    print(f"🔍 Under load: {TICKETS_PER_SECOND} tickets/s ({PHASE_SECONDS}s)...")
+    loaded, tickets = run_phase(headers, invoice_number)
+
+    print("\n📊 Unrelated endpoint latency")
+    report("baseline", baseline)
+    report("tickets", loaded)
+    ok = sum(1 for code in tickets if code == 200)
+    print(f"\nTickets: {ok}/{len(tickets)} OK, "
+          f"{sum(1 for code in tickets if code == 503)} rejected (cola llena)")
+
+
+if __name__ == "__main__":
+    main()
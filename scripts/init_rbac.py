@@ -33,7 +33,7 @@ async def initialize_rbac():
         if not existing:
             mod_dict = mod.copy()
             mod_dict["is_active"] = True
-            mod_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+            mod_dict["created_at"] = datetime.now(timezone.utc)
             await db.system_modules.insert_one(mod_dict)
             print(f"  ✅ Creado módulo: {mod['name']}")
             modules_created += 1
@@ -52,7 +52,7 @@ async def initialize_rbac():
                 "name": role_data["name"],
                 "description": role_data["description"],
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
             await db.roles.insert_one(role)
             print(f"  ✅ Creado rol: {role_data['name']}")
@@ -73,7 +73,7 @@ async def initialize_rbac():
                         "update": permissions.update,
                         "delete": permissions.delete
                     },
-                    "created_at": datetime.now(timezone.utc).isoformat()
+                    "created_at": datetime.now(timezone.utc)
                 }
                 await db.role_permissions.insert_one(perm_doc)
                 print(f"    ✅ Permisos '{module_slug}' asignados a {role_data['name']}")
@@ -93,8 +93,8 @@ async def initialize_rbac():
                 "is_active": old_user.get("is_active", True),
                 "roles": ["Administrador"] if old_user.get("role") == "admin" else ["Vendedor"],
                 "hashed_password": old_user.get("hashed_password"),
-                "created_at": old_user.get("created_at", datetime.now(timezone.utc).isoformat()),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "created_at": old_user.get("created_at", datetime.now(timezone.utc)),
+                "updated_at": datetime.now(timezone.utc)
             }
             await db.users_extended.insert_one(extended_user)
             print(f"  ✅ Migrado usuario: {old_user['email']}")
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Run online data migrations
+
+- dates: text timestamps to native BSON dates
+- money: float amounts to Decimal128
+- returns: returned_qty of each invoice line, from the existing returns
+- costs: products' weighted-average purchase_price, replayed from past purchases
+- layers: initial FIFO cost layer (current stock at purchase_price) of each product
+- locations: existing stock of each product into the default location (stock_levels)
+- snapshots: daily stock snapshots back to the first inventory movement
+
+Safe to run while the API is serving traffic and safe to interrupt: the next
+run resumes from the last converted batch. Run it again until it reports
+completion; for dates, servers switch off the dual-read filters on their
+next restart.
+
+Usage:
+    python scripts/migrate.py dates|money|returns|costs|layers|locations|snapshots [--batch-size 1000] [--dry-run]
+"""
+import argparse
+import asyncio
+import sys
+import os
+sys.path.append('/app/backend')
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from pathlib import Path
+
+# Load environment
+ROOT_DIR = Path('/app/backend')
+load_dotenv(ROOT_DIR / '.env')
+
+import average_cost
+import cost_layers
+import invoice_returns
+import money
+import stock_levels
+import stock_snapshots
+import timestamps
+from migrations import migration_completed, MIGRATION_BATCH
+
+mongo_url = os.environ['MONGO_URL']
+db_name = os.environ['DB_NAME']
+
+MIGRATIONS = {
+    "dates": (timestamps.migrate_dates, timestamps.MIGRATION_ID),
+    "money": (money.migrate_money, money.MIGRATION_ID),
+    "returns": (invoice_returns.migrate_returned_qty, invoice_returns.MIGRATION_ID),
+    "costs": (average_cost.backfill_average_cost, average_cost.MIGRATION_ID),
+    "layers": (cost_layers.seed_cost_layers, cost_layers.MIGRATION_ID),
+    "locations": (stock_levels.seed_stock_levels, stock_levels.MIGRATION_ID),
+    "snapshots": (stock_snapshots.backfill_snapshots, stock_snapshots.MIGRATION_ID),
+}
+
+async def run(name, batch_size, dry_run):
+    client = AsyncIOMotorClient(mongo_url, tz_aware=True, type_registry=money.MONEY_TYPE_REGISTRY)
+    db = client[db_name]
+    migrate, migration_id = MIGRATIONS[name]
+    
+    print(f"🔄 Running migration '{name}'..." + (" (dry run)" if dry_run else ""))
+    converted = await migrate(db, batch_size=batch_size, dry_run=dry_run)
+    for collection, count in converted.items():
+        if count:
+            print(f"  {collection}: {count} documents converted")
+    
+    if await migration_completed(db, migration_id):
+        print("✅ Migration complete.")
+    elif not dry_run:
+        print("⚠️  Some documents remain (written during the run or not convertible). Run again.")
+    
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run online data migrations")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args.migration, args.batch_size, args.dry_run))
@@ -32,30 +32,30 @@ async def seed_database():
     
     # Seed Categories
     categories = [
-        {"name": "Electrónica", "description": "Dispositivos electrónicos y accesorios", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "Alimentos", "description": "Productos alimenticios", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "Bebidas", "description": "Bebidas y refrescos", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "Hogar", "description": "Artículos para el hogar", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "Otros", "description": "Otros productos", "created_at": datetime.now(timezone.utc).isoformat()}
+        {"name": "Electrónica", "description": "Dispositivos electrónicos y accesorios", "created_at": datetime.now(timezone.utc)},
+        {"name": "Alimentos", "description": "Productos alimenticios", "created_at": datetime.now(timezone.utc)},
+        {"name": "Bebidas", "description": "Bebidas y refrescos", "created_at": datetime.now(timezone.utc)},
+        {"name": "Hogar", "description": "Artículos para el hogar", "created_at": datetime.now(timezone.utc)},
+        {"name": "Otros", "description": "Otros productos", "created_at": datetime.now(timezone.utc)}
     ]
     await db.categories.insert_many(categories)
     print(f"✅ Created {len(categories)} categories")
     
     # Seed Document Types
     doc_types = [
-        {"code": "CC", "name": "Cédula de Ciudadanía", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"code": "NIT", "name": "NIT", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"code": "CE", "name": "Cédula de Extranjería", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"code": "PAS", "name": "Pasaporte", "created_at": datetime.now(timezone.utc).isoformat()}
+        {"code": "CC", "name": "Cédula de Ciudadanía", "created_at": datetime.now(timezone.utc)},
+        {"code": "NIT", "name": "NIT", "created_at": datetime.now(timezone.utc)},
+        {"code": "CE", "name": "Cédula de Extranjería", "created_at": datetime.now(timezone.utc)},
+        {"code": "PAS", "name": "Pasaporte", "created_at": datetime.now(timezone.utc)}
     ]
     await db.document_types.insert_many(doc_types)
     print(f"✅ Created {len(doc_types)} document types")
     
     # Seed Price Lists
     price_lists = [
-        {"name": "default", "description": "Lista de precios por defecto", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "mayorista", "description": "Precios para mayoristas", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "minorista", "description": "Precios para minoristas", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()}
+        {"name": "default", "description": "Lista de precios por defecto", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"name": "mayorista", "description": "Precios para mayoristas", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"name": "minorista", "description": "Precios para minoristas", "is_active": True, "created_at": datetime.now(timezone.utc)}
     ]
     await db.price_lists.insert_many(price_lists)
     print(f"✅ Created {len(price_lists)} price lists")
@@ -66,8 +66,8 @@ async def seed_database():
             "name": "IVA 19%",
             "rate": 19.0,
             "is_active": True,
-            "effective_date": datetime.now(timezone.utc).isoformat(),
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "effective_date": datetime.now(timezone.utc),
+            "created_at": datetime.now(timezone.utc)
         }
     ]
     await db.tax_rates.insert_many(tax_rates)
@@ -75,12 +75,12 @@ async def seed_database():
     
     # Seed Payment Methods
     payment_methods = [
-        {"name": "Efectivo", "description": "Pago en efectivo", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "Tarjeta de Crédito", "description": "Pago con tarjeta de crédito", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "Tarjeta de Débito", "description": "Pago con tarjeta débito", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "Transferencia", "description": "Transferencia bancaria", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "Nequi", "description": "Pago por Nequi", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"name": "Daviplata", "description": "Pago por Daviplata", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()}
+        {"name": "Efectivo", "description": "Pago en efectivo", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"name": "Tarjeta de Crédito", "description": "Pago con tarjeta de crédito", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"name": "Tarjeta de Débito", "description": "Pago con tarjeta débito", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"name": "Transferencia", "description": "Transferencia bancaria", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"name": "Nequi", "description": "Pago por Nequi", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"name": "Daviplata", "description": "Pago por Daviplata", "is_active": True, "created_at": datetime.now(timezone.utc)}
     ]
     await db.payment_methods.insert_many(payment_methods)
     print(f"✅ Created {len(payment_methods)} payment methods")
@@ -94,7 +94,7 @@ async def seed_database():
         "address": "",
         "ticket_width": 80,
         "footer_message": "¡Gracias por su compra!",
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc)
     }
     await db.ticket_config.insert_one(ticket_config)
     print("✅ Created default ticket config")
@@ -0,0 +1,84 @@
+"""
+Test module for catalog delta-sync endpoint
+Tests:
+- GET /api/sync/catalog - Full catalog on first sync (since=0)
+- GET /api/sync/catalog?since=<token> - Only changes after the token, including deletions
+- GET /api/sync/catalog?limit=1 - Paged full sync finishes without repeating documents
+"""
+import pytest
+import requests
+import os
+import time
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authentication headers for all tests"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": "admin@boltrex.com",
+        "password": "admin123"
+    })
+    assert response.status_code == 200, f"Login failed: {response.text}"
+    token = response.json()["access_token"]
+    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+
+class TestCatalogSync:
+    """Catalog delta-sync tests"""
+
+    def test_full_sync(self, auth_headers):
+        """Test GET /api/sync/catalog without token returns the full catalog"""
+        response = requests.get(f"{BASE_URL}/api/sync/catalog", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+
+        assert data["full"] is True
+        assert isinstance(data["token"], str)
+        for collection in ["products", "categories", "price_lists", "tax_rates", "payment_methods", "clients"]:
+            assert collection in data["changes"]
+            assert "upserts" in data["changes"][collection]
+            assert "deleted" in data["changes"][collection]
+
+    def test_delta_sync_insert_and_delete(self, auth_headers):
+        """Test created and deleted categories appear in the next delta"""
+        token = requests.get(f"{BASE_URL}/api/sync/catalog", headers=auth_headers).json()["token"]
+
+        name = f"TEST_Sync_{uuid.uuid4().hex[:8]}"
+        response = requests.post(f"{BASE_URL}/api/categories", json={"name": name}, headers=auth_headers)
+        assert response.status_code == 200
+
+        response = requests.get(f"{BASE_URL}/api/sync/catalog?since={token}", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["full"] is False
+        assert name in [c["name"] for c in data["changes"]["categories"]["upserts"]]
+
+        time.sleep(0.01)
+        response = requests.delete(f"{BASE_URL}/api/categories/{name}", headers=auth_headers)
+        assert response.status_code == 200
+
+        response = requests.get(f"{BASE_URL}/api/sync/catalog?since={token}", headers=auth_headers)
+        data = response.json()
+        assert name in data["changes"]["categories"]["deleted"]
+        assert name not in [c["name"] for c in data["changes"]["categories"]["upserts"]]
+
+    def test_full_sync_pages(self, auth_headers):
+        """Test a full sync paged with limit=1 advances and never repeats a category"""
+        seen = []
+        token = None
+        for _ in range(2000):
+            params = {"limit": 1, **({"since": token} if token else {})}
+            response = requests.get(f"{BASE_URL}/api/sync/catalog", params=params, headers=auth_headers)
+            assert response.status_code == 200
+            data = response.json()
+            assert data["full"] is True
+            seen += [c["name"] for c in data["changes"]["categories"]["upserts"]]
+            token = data["token"]
+            if not data["has_more"]:
+                break
+        else:
+            pytest.fail("Full sync did not finish")
+        assert len(seen) == len(set(seen))
@@ -6,10 +6,13 @@ Tests:
 - GET /api/pos/invoices/{invoice_number}/ticket - Generate and download PDF ticket
 - GET /api/ticket-config - Get ticket configuration
 - PUT /api/ticket-config - Update ticket configuration
+- POST /api/pos/sync - Sync offline POS sales in one batch
+- GET /api/invoices/{invoice_number}/returnable and POST /api/returns - Return limits per line
 """
 import pytest
 import requests
 import os
+import uuid
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
 
@@ -199,6 +202,8 @@ class TestPOSInvoices:
             assert "created_by" in data
             assert "created_at" in data
             assert "status" in data
+            assert isinstance(data["payments_history"], list)
+            assert isinstance(data["returns_history"], list)
         else:
             pytest.skip("No invoices found in database")
     
@@ -251,6 +256,63 @@ class TestPDFTicketGeneration:
         else:
             pytest.skip("No invoices found in database")
     
+    def test_download_ticket_escpos_and_text(self, auth_headers):
+        """Test GET /api/pos/invoices/{invoice_number}/ticket?format=escpos|text"""
+        list_response = requests.get(f"{BASE_URL}/api/pos/invoices", headers=auth_headers)
+        assert list_response.status_code == 200
+        invoices = list_response.json()["invoices"]
+
+        if invoices:
+            invoice_number = invoices[0]["invoice_number"]
+
+            # ESC/POS: raw bytes starting with printer init (ESC @)
+            response = requests.get(
+                f"{BASE_URL}/api/pos/invoices/{invoice_number}/ticket?format=escpos",
+                headers=auth_headers
+            )
+            assert response.status_code == 200
+            assert response.headers.get("content-type") == "application/octet-stream"
+            assert response.content[:2] == b'\x1b@'
+
+            # Plain text: fixed width lines including the invoice number
+            response = requests.get(
+                f"{BASE_URL}/api/pos/invoices/{invoice_number}/ticket?format=text",
+                headers=auth_headers
+            )
+            assert response.status_code == 200
+            assert response.headers.get("content-type").startswith("text/plain")
+            assert f"FACTURA: {invoice_number}" in response.text
+            assert all(len(line) <= 48 for line in response.text.splitlines())
+        else:
+            pytest.skip("No invoices found in database")
+
+    def test_download_ticket_invalid_format(self, auth_headers):
+        """Test GET /api/pos/invoices/{invoice_number}/ticket with unknown format"""
+        response = requests.get(
+            f"{BASE_URL}/api/pos/invoices/INV-000001/ticket?format=docx",
+            headers=auth_headers
+        )
+        assert response.status_code == 400
+
+    def test_download_tickets_batch_zip(self, auth_headers):
+        """Test GET /api/pos/tickets/batch - ZIP with one PDF per filtered invoice"""
+        import io
+        import zipfile
+
+        response = requests.get(
+            f"{BASE_URL}/api/pos/tickets/batch?status=completed&start_date=2024-01-01",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        assert response.headers.get("content-type") == "application/zip"
+
+        archive = zipfile.ZipFile(io.BytesIO(response.content))
+        assert archive.testzip() is None
+        for name in archive.namelist():
+            if name.endswith(".pdf"):
+                assert name.startswith("ticket_")
+                assert archive.read(name)[:4] == b'%PDF'
+
     def test_download_ticket_invoice_not_found(self, auth_headers):
         """Test GET /api/pos/invoices/{invoice_number}/ticket - Invoice not found"""
         response = requests.get(
@@ -283,6 +345,28 @@ class TestInvoiceFilters:
         data = response.json()
         assert "invoices" in data
     
+    def test_filter_by_invalid_date(self, auth_headers):
+        """Test a malformed date filter is rejected"""
+        response = requests.get(f"{BASE_URL}/api/pos/invoices?start_date=31-12-2024", headers=auth_headers)
+        assert response.status_code == 400
+    
+    def test_sales_timeline_by_month(self, auth_headers):
+        """Test GET /api/reports/sales/timeline buckets by month"""
+        response = requests.get(
+            f"{BASE_URL}/api/reports/sales/timeline?group_by=month&start_date=2024-01-01&end_date=2025-12-31",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["group_by"] == "month"
+        periods = [bucket["period"] for bucket in data["buckets"]]
+        assert periods == sorted(periods)
+    
+    def test_sales_timeline_invalid_unit(self, auth_headers):
+        """Test GET /api/reports/sales/timeline rejects unknown units"""
+        response = requests.get(f"{BASE_URL}/api/reports/sales/timeline?group_by=year", headers=auth_headers)
+        assert response.status_code == 422
+    
     def test_filter_by_user_email(self, auth_headers):
         """Test filtering invoices by user email"""
         response = requests.get(
@@ -316,6 +400,152 @@ class TestInvoiceFilters:
         assert data["pagination"]["limit"] == 10
 
 
+class TestPosSync:
+    """Test offline sales batch sync"""
+    
+    @pytest.fixture(scope="class")
+    def auth_headers(self):
+        """Get auth headers"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "admin@boltrex.com",
+            "password": "admin123"
+        })
+        token = response.json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    
+    def _sale(self, auth_headers, **overrides):
+        clients = requests.get(f"{BASE_URL}/api/clients", headers=auth_headers).json()
+        products = requests.get(f"{BASE_URL}/api/products", headers=auth_headers).json()
+        if not clients or not products:
+            pytest.skip("No clients or products")
+        product = products[0]
+        sale = {
+            "client_sale_id": uuid.uuid4().hex,
+            "client_document": clients[0]["document_number"],
+            "items": [{
+                "barcode": product["barcode"],
+                "product_name": product["name"],
+                "quantity": 1,
+                "unit_price": 10,
+                "tax_rate": 0,
+                "tax_amount": 0,
+                "subtotal": 10,
+                "total": 10
+            }],
+            "payment_status": "por_cobrar",
+            "sold_at": "2025-01-15T10:30:00Z"
+        }
+        sale.update(overrides)
+        return sale
+    
+    def test_sync_batch_and_retry(self, auth_headers):
+        """Test a batch creates consecutive invoices and a retry reports them as duplicates"""
+        sales = [self._sale(auth_headers) for _ in range(3)]
+        response = requests.post(f"{BASE_URL}/api/pos/sync", json={"sales": sales}, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        data = response.json()
+        assert data["created"] == 3
+        numbers = [int(r["invoice_number"].split("-")[1]) for r in data["results"]]
+        assert numbers == list(range(numbers[0], numbers[0] + 3))
+        
+        retry = requests.post(f"{BASE_URL}/api/pos/sync", json={"sales": sales}, headers=auth_headers).json()
+        assert retry["created"] == 0
+        assert [r["status"] for r in retry["results"]] == ["duplicate"] * 3
+        assert [r["invoice_number"] for r in retry["results"]] == [r["invoice_number"] for r in data["results"]]
+        
+        invoice = requests.get(f"{BASE_URL}/api/invoices/{data['results'][0]['invoice_number']}", headers=auth_headers).json()
+        assert invoice["created_at"].startswith("2025-01-15T10:30:00")
+    
+    def test_sync_reports_invalid_sales(self, auth_headers):
+        """Test invalid sales fail individually without blocking the rest"""
+        sales = [
+            self._sale(auth_headers),
+            self._sale(auth_headers, client_document="NO-EXISTE-999"),
+            self._sale(auth_headers, payment_status="pagado", payment_method=None),
+        ]
+        response = requests.post(f"{BASE_URL}/api/pos/sync", json={"sales": sales}, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        assert [r["status"] for r in response.json()["results"]] == ["created", "error", "error"]
+
+
+class TestReturnLimits:
+    """Test returns are checked against the invoice lines"""
+    
+    @pytest.fixture(scope="class")
+    def auth_headers(self):
+        """Get auth headers"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "admin@boltrex.com",
+            "password": "admin123"
+        })
+        token = response.json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    
+    @pytest.fixture(scope="class")
+    def invoice(self, auth_headers):
+        """Invoice selling the same product on two lines (1 + 2 units)"""
+        clients = requests.get(f"{BASE_URL}/api/clients", headers=auth_headers).json()
+        products = [p for p in requests.get(f"{BASE_URL}/api/products", headers=auth_headers).json() if p.get("stock", 0) > 2]
+        if not clients or not products:
+            pytest.skip("No clients or products with stock")
+        product = products[0]
+        line = {"barcode": product["barcode"], "product_name": product["name"], "unit_price": 10, "tax_rate": 0, "tax_amount": 0}
+        response = requests.post(f"{BASE_URL}/api/invoices", json={
+            "client_document": clients[0]["document_number"],
+            "items": [
+                {**line, "quantity": 1, "subtotal": 10, "total": 10},
+                {**line, "quantity": 2, "subtotal": 20, "total": 20}
+            ],
+            "payment_status": "por_cobrar"
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        return response.json()
+    
+    def _return(self, auth_headers, invoice, quantity):
+        item = invoice["items"][0]
+        return requests.post(f"{BASE_URL}/api/returns", json={
+            "invoice_number": invoice["invoice_number"],
+            "items": [{
+                "barcode": item["barcode"],
+                "product_name": item["product_name"],
+                "quantity": quantity,
+                "unit_price": 10,
+                "total": 10 * quantity
+            }]
+        }, headers=auth_headers)
+    
+    def _returnable(self, auth_headers, invoice):
+        response = requests.get(f"{BASE_URL}/api/invoices/{invoice['invoice_number']}/returnable", headers=auth_headers)
+        assert response.status_code == 200
+        return response.json()["items"][0]
+    
+    def test_returnable_adds_lines(self, auth_headers, invoice):
+        """Test lines of the same product are combined"""
+        line = self._returnable(auth_headers, invoice)
+        assert line["quantity"] == 3
+        assert line["returnable"] == 3
+    
+    def test_partial_return_then_over_return(self, auth_headers, invoice):
+        """Test a return spanning two lines succeeds and a later over-return fails"""
+        response = self._return(auth_headers, invoice, 2)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        assert self._returnable(auth_headers, invoice)["returnable"] == 1
+        
+        response = self._return(auth_headers, invoice, 2)
+        assert response.status_code == 400
+        assert "excede" in response.json()["detail"]
+        
+        detail = requests.get(f"{BASE_URL}/api/invoices/{invoice['invoice_number']}", headers=auth_headers).json()
+        assert detail["status"] == "partial_return"
+        assert detail["total"] == 10
+        assert detail["balance"] == 10
+    
+    def test_returnable_not_found(self, auth_headers):
+        """Test GET /api/invoices/{invoice_number}/returnable - Invoice not found"""
+        response = requests.get(f"{BASE_URL}/api/invoices/INV-999999/returnable", headers=auth_headers)
+        assert response.status_code == 404
+
+
 class TestUnauthorizedAccess:
     """Test unauthorized access to endpoints"""
     
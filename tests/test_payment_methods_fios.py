@@ -7,6 +7,7 @@ Tests:
 - GET /api/fios - List accounts receivable summary
 - GET /api/fios/{client_document} - Get client detail with pending invoices
 - POST /api/fios/{invoice_number}/payment - Register partial payment (abono)
+- Idempotency-Key header on invoice and payment creation
 """
 import pytest
 import requests
@@ -484,6 +485,42 @@ class TestFioPayments:
         # Verify invoice update
         assert data["invoice_update"]["new_balance"] == current_balance - payment_amount
     
+    def test_payments_settle_exactly(self, auth_headers):
+        """Test abonos that add up to the total close the invoice despite float rounding"""
+        clients = requests.get(f"{BASE_URL}/api/clients", headers=auth_headers).json()
+        products = [p for p in requests.get(f"{BASE_URL}/api/products", headers=auth_headers).json() if p.get("stock", 0) > 1]
+        payment_methods = requests.get(f"{BASE_URL}/api/payment-methods/active", headers=auth_headers).json()
+        if not clients or not products or not payment_methods:
+            pytest.skip("No clients, products with stock or active payment methods")
+        
+        product = products[0]
+        item = {"barcode": product["barcode"], "product_name": product["name"], "quantity": 1, "tax_rate": 0, "tax_amount": 0}
+        invoice_payload = {
+            "client_document": clients[0]["document_number"],
+            # 0.1 + 0.2 != 0.3 in binary floating point
+            "items": [
+                {**item, "unit_price": 0.1, "subtotal": 0.1, "total": 0.1},
+                {**item, "unit_price": 0.2, "subtotal": 0.2, "total": 0.2}
+            ],
+            "payment_status": "por_cobrar",
+            "payment_method": None
+        }
+        response = requests.post(f"{BASE_URL}/api/invoices", json=invoice_payload, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        invoice = response.json()
+        assert invoice["total"] == 0.3
+        
+        for amount in (0.1, 0.2):
+            response = requests.post(f"{BASE_URL}/api/fios/{invoice['invoice_number']}/payment", json={
+                "amount": amount,
+                "payment_method": payment_methods[0]["name"]
+            }, headers=auth_headers)
+            assert response.status_code == 200, f"Failed: {response.text}"
+        
+        update = response.json()["invoice_update"]
+        assert update["new_balance"] == 0
+        assert update["fully_paid"] is True
+    
     def test_payment_exceeds_balance_fails(self, auth_headers):
         """Test POST /api/fios/{invoice_number}/payment - Payment exceeds balance"""
         # Get accounts to find an invoice
@@ -645,3 +682,69 @@ class TestUnauthorizedAccess:
         """Test POST /api/fios/{invoice_number}/payment without auth"""
         response = requests.post(f"{BASE_URL}/api/fios/INV-000001/payment", json={"amount": 100, "payment_method": "Efectivo"})
         assert response.status_code in [401, 403]
+
+
+class TestIdempotencyKeys:
+    """Test Idempotency-Key on POST /api/invoices and /api/fios/{invoice_number}/payment"""
+    
+    def _invoice_payload(self, auth_headers):
+        clients = requests.get(f"{BASE_URL}/api/clients", headers=auth_headers).json()
+        products = [p for p in requests.get(f"{BASE_URL}/api/products", headers=auth_headers).json() if p.get("stock", 0) > 0]
+        if not clients or not products:
+            pytest.skip("No clients or products with stock")
+        product = products[0]
+        return {
+            "client_document": clients[0]["document_number"],
+            "items": [{
+                "barcode": product["barcode"],
+                "product_name": product["name"],
+                "quantity": 1,
+                "unit_price": 10,
+                "tax_rate": 0,
+                "tax_amount": 0,
+                "subtotal": 10,
+                "total": 10
+            }],
+            "payment_status": "por_cobrar",
+            "payment_method": None
+        }
+    
+    def test_retry_replays_invoice(self, auth_headers):
+        """Test a retried invoice with the same key returns the first invoice without creating another"""
+        payload = self._invoice_payload(auth_headers)
+        headers = {**auth_headers, "Idempotency-Key": uuid.uuid4().hex}
+        first = requests.post(f"{BASE_URL}/api/invoices", json=payload, headers=headers)
+        assert first.status_code == 200, f"Failed: {first.text}"
+        assert "Idempotent-Replayed" not in first.headers
+        
+        retry = requests.post(f"{BASE_URL}/api/invoices", json=payload, headers=headers)
+        assert retry.status_code == 200
+        assert retry.headers.get("Idempotent-Replayed") == "true"
+        assert retry.json()["invoice_number"] == first.json()["invoice_number"]
+    
+    def test_key_reused_with_other_body_fails(self, auth_headers):
+        """Test reusing a key with a different payload returns 422"""
+        payload = self._invoice_payload(auth_headers)
+        headers = {**auth_headers, "Idempotency-Key": uuid.uuid4().hex}
+        response = requests.post(f"{BASE_URL}/api/invoices", json=payload, headers=headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        
+        payload["items"][0]["unit_price"] = 20
+        response = requests.post(f"{BASE_URL}/api/invoices", json=payload, headers=headers)
+        assert response.status_code == 422
+    
+    def test_retry_replays_payment(self, auth_headers):
+        """Test a retried abono is applied only once"""
+        payment_methods = requests.get(f"{BASE_URL}/api/payment-methods/active", headers=auth_headers).json()
+        if not payment_methods:
+            pytest.skip("No active payment methods")
+        invoice = requests.post(f"{BASE_URL}/api/invoices", json=self._invoice_payload(auth_headers), headers=auth_headers)
+        assert invoice.status_code == 200, f"Failed: {invoice.text}"
+        
+        headers = {**auth_headers, "Idempotency-Key": uuid.uuid4().hex}
+        payment = {"amount": 4, "payment_method": payment_methods[0]["name"]}
+        url = f"{BASE_URL}/api/fios/{invoice.json()['invoice_number']}/payment"
+        responses = [requests.post(url, json=payment, headers=headers) for _ in range(2)]
+        assert all(r.status_code == 200 for r in responses)
+        assert responses[1].json() == responses[0].json()
+        assert responses[1].json()["invoice_update"]["new_balance"] == 6
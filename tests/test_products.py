@@ -0,0 +1,627 @@
+"""
+Test module for product search and barcode lookup endpoints
+Tests:
+- GET /api/products/search - Indexed search with exact barcode first
+- GET /api/products/{barcode} - Single barcode resolution
+- POST /api/products/lookup - Resolve a basket of barcodes in one call
+- limit/cursor/fields on list endpoints and NDJSON streaming
+- POST/DELETE /api/pos/reservations - Basket stock reservations
+- GET /api/inventory/as-of and /api/inventory/reconciliation - Stock history from movements
+- GET /api/inventory/kardex[/{barcode}] - Stock card with running balances (JSON/XLSX)
+- GET /api/inventory/low-stock - Products below their min_stock
+- GET /api/purchases/suggestions - Reorder quantities per supplier from sales velocity
+- POST /api/purchases and /api/supplier-returns - Weighted-average purchase_price
+- GET /api/reports/valuation - Inventory value by FIFO cost layers or average cost
+- /api/locations, /api/inventory/levels and /api/inventory/transfer - Stock per location
+"""
+import pytest
+import requests
+import os
+import uuid
+import json
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authentication headers for all tests"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": "admin@boltrex.com",
+        "password": "admin123"
+    })
+    assert response.status_code == 200, f"Login failed: {response.text}"
+    token = response.json()["access_token"]
+    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def test_product(auth_headers):
+    """Create a product with an accented name for search tests"""
+    categories = requests.get(f"{BASE_URL}/api/categories", headers=auth_headers).json()
+    if not categories:
+        pytest.skip("No categories found in database")
+
+    barcode = f"TEST{uuid.uuid4().hex[:8].upper()}"
+    response = requests.post(f"{BASE_URL}/api/products", json={
+        "barcode": barcode,
+        "name": "TEST Café Orgánico Molido",
+        "category": categories[0]["name"],
+        "purchase_price": 1000,
+        "tax_rate": 19,
+        "prices": [{"price_list_name": "default", "price": 1500}]
+    }, headers=auth_headers)
+    assert response.status_code == 200
+    yield response.json()
+    requests.delete(f"{BASE_URL}/api/products/{barcode}", headers=auth_headers)
+
+
+class TestProductSearch:
+    """Indexed product search tests"""
+
+    def test_search_accent_insensitive_prefix(self, auth_headers, test_product):
+        """Test 'cafe organ' finds 'Café Orgánico'"""
+        response = requests.get(f"{BASE_URL}/api/products/search?q=cafe%20organ", headers=auth_headers)
+        assert response.status_code == 200
+        barcodes = [p["barcode"] for p in response.json()]
+        assert test_product["barcode"] in barcodes
+
+    def test_search_exact_barcode_first(self, auth_headers, test_product):
+        """Test an exact barcode match is ranked first"""
+        response = requests.get(f"{BASE_URL}/api/products/search?q={test_product['barcode']}", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data[0]["barcode"] == test_product["barcode"]
+
+    def test_search_name_prefix_survives_limit(self, auth_headers, test_product):
+        """Test a name starting with the query is kept even with limit=1"""
+        response = requests.get(f"{BASE_URL}/api/products/search", params={"q": "test cafe organico", "limit": 1}, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data) == 1
+        assert data[0]["name"].lower().startswith("test caf")
+
+    def test_search_requires_query(self, auth_headers):
+        """Test GET /api/products/search without q"""
+        response = requests.get(f"{BASE_URL}/api/products/search", headers=auth_headers)
+        assert response.status_code == 422
+
+
+class TestBarcodeLookup:
+    """Barcode resolution tests"""
+
+    def test_get_product_by_barcode(self, auth_headers, test_product):
+        """Test GET /api/products/{barcode}"""
+        response = requests.get(f"{BASE_URL}/api/products/{test_product['barcode']}", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["name"] == test_product["name"]
+
+    def test_lookup_basket(self, auth_headers, test_product):
+        """Test POST /api/products/lookup with found and missing barcodes"""
+        response = requests.post(f"{BASE_URL}/api/products/lookup", json={
+            "barcodes": [test_product["barcode"], "NO_EXISTE_999"]
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert [p["barcode"] for p in data["products"]] == [test_product["barcode"]]
+        assert data["missing"] == ["NO_EXISTE_999"]
+
+    def test_lookup_reflects_update(self, auth_headers, test_product):
+        """Test the index is updated after PUT /api/products/{barcode}"""
+        barcode = test_product["barcode"]
+        response = requests.put(f"{BASE_URL}/api/products/{barcode}", json={"purchase_price": 1200}, headers=auth_headers)
+        assert response.status_code == 200
+
+        response = requests.get(f"{BASE_URL}/api/products/{barcode}", headers=auth_headers)
+        assert response.json()["purchase_price"] == 1200
+
+
+class TestListPagination:
+    """Cursor pagination and field selection on list endpoints"""
+
+    def test_products_cursor_pages_do_not_overlap(self, auth_headers, test_product):
+        """Test GET /api/products?limit=1 follows X-Next-Cursor"""
+        first = requests.get(f"{BASE_URL}/api/products?limit=1", headers=auth_headers)
+        assert first.status_code == 200
+        assert len(first.json()) == 1
+        cursor = first.headers.get("X-Next-Cursor")
+        assert cursor, "Expected a next cursor with at least two products"
+
+        second = requests.get(f"{BASE_URL}/api/products", params={"limit": 1, "cursor": cursor}, headers=auth_headers)
+        assert second.status_code == 200
+        assert second.json()[0]["barcode"] > first.json()[0]["barcode"]
+
+    def test_fields_projection(self, auth_headers, test_product):
+        """Test fields= returns only the requested fields"""
+        response = requests.get(f"{BASE_URL}/api/invoices?limit=5&fields=invoice_number,total", headers=auth_headers)
+        assert response.status_code == 200
+        for invoice in response.json():
+            assert set(invoice) == {"invoice_number", "total"}
+
+    def test_unknown_field_rejected(self, auth_headers):
+        """Test fields= with a field not in the model"""
+        response = requests.get(f"{BASE_URL}/api/products?fields=barcode,hashed_password", headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_invalid_cursor_rejected(self, auth_headers):
+        """Test a malformed cursor"""
+        response = requests.get(f"{BASE_URL}/api/invoices?cursor=not-a-cursor", headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_movements_ndjson_stream(self, auth_headers, test_product):
+        """Test Accept: application/x-ndjson on GET /api/inventory/movements"""
+        response = requests.get(
+            f"{BASE_URL}/api/inventory/movements?limit=20&fields=barcode,quantity",
+            headers={**auth_headers, "Accept": "application/x-ndjson"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines() if line]
+        assert len(lines) <= 20
+        for movement in lines:
+            assert set(movement) <= {"barcode", "quantity"}
+
+
+    def test_invoices_ndjson_hides_internal_fields(self, auth_headers):
+        """Test the NDJSON invoice stream sends only model fields"""
+        response = requests.get(
+            f"{BASE_URL}/api/invoices?limit=20",
+            headers={**auth_headers, "Accept": "application/x-ndjson"}
+        )
+        assert response.status_code == 200
+        for line in response.text.splitlines():
+            invoice = json.loads(line)
+            assert "invoice_number" in invoice
+            assert not {"_id", "stock_applied", "stock_claim", "returns_migrated", "synced_at"} & set(invoice)
+
+
+class TestStockReservations:
+    """Basket reservations (only when the server runs with STRICT_STOCK=1)"""
+
+    def test_reservation_rejects_oversell(self, auth_headers, test_product):
+        """Test POST /api/pos/reservations for more units than in stock"""
+        response = requests.post(f"{BASE_URL}/api/pos/reservations", json={
+            "items": [{"barcode": test_product["barcode"], "quantity": test_product["stock"] + 1}]
+        }, headers=auth_headers)
+        if response.status_code == 400:
+            pytest.skip("Server not running in strict stock mode")
+        assert response.status_code == 409
+        assert test_product["barcode"] in response.json()["detail"]
+
+    def test_short_invoice_keeps_reservation(self, auth_headers, test_product):
+        """Test an invoice rejected for stock leaves the basket's reservation in place"""
+        response = requests.post(f"{BASE_URL}/api/pos/reservations", json={
+            "items": [{"barcode": test_product["barcode"], "quantity": 1}]
+        }, headers=auth_headers)
+        if response.status_code == 400:
+            pytest.skip("Server not running in strict stock mode")
+        assert response.status_code == 200, f"Failed: {response.text}"
+        basket_id = response.json()["basket_id"]
+        clients = requests.get(f"{BASE_URL}/api/clients", headers=auth_headers).json()
+        if not clients:
+            pytest.skip("No clients found in database")
+
+        quantity = test_product["stock"] + 1
+        response = requests.post(f"{BASE_URL}/api/invoices", json={
+            "client_document": clients[0]["document_number"],
+            "items": [{
+                "barcode": test_product["barcode"], "product_name": test_product["name"],
+                "quantity": quantity, "unit_price": 10, "tax_rate": 0, "tax_amount": 0,
+                "subtotal": 10 * quantity, "total": 10 * quantity
+            }],
+            "payment_status": "por_cobrar",
+            "reservation_id": basket_id
+        }, headers=auth_headers)
+        assert response.status_code == 409
+
+        response = requests.delete(f"{BASE_URL}/api/pos/reservations/{basket_id}", headers=auth_headers)
+        assert response.status_code == 200
+
+    def test_release_unknown_reservation(self, auth_headers):
+        """Test DELETE /api/pos/reservations/{basket_id} for a missing basket"""
+        response = requests.delete(f"{BASE_URL}/api/pos/reservations/no-such-basket", headers=auth_headers)
+        assert response.status_code == 404
+
+
+class TestInventoryHistory:
+    """Stock at a point in time, rebuilt from snapshots and movements"""
+
+    @pytest.fixture(scope="class")
+    def purchased(self, auth_headers, test_product):
+        """Buy 3 units of the test product"""
+        response = requests.post(f"{BASE_URL}/api/purchases", json={
+            "supplier_name": "TEST Proveedor",
+            "items": [{
+                "barcode": test_product["barcode"],
+                "product_name": test_product["name"],
+                "quantity": 3,
+                "unit_cost": 1000,
+                "total": 3000
+            }]
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        return test_product
+
+    def _stock_as_of(self, auth_headers, barcode, date):
+        response = requests.get(f"{BASE_URL}/api/inventory/as-of", params={"date": date, "barcode": barcode}, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        items = response.json()["items"]
+        assert [item["barcode"] for item in items] == [barcode]
+        return items[0]["stock"]
+
+    def test_stock_as_of_dates(self, auth_headers, purchased):
+        """Test the purchase counts only after it happened"""
+        assert self._stock_as_of(auth_headers, purchased["barcode"], "2000-01-01") == 0
+        assert self._stock_as_of(auth_headers, purchased["barcode"], "2999-12-31") == 3
+
+    def test_stock_before_first_snapshot(self, auth_headers, purchased):
+        """Test a date before every snapshot is replayed back from a later one"""
+        response = requests.get(f"{BASE_URL}/api/inventory/as-of", params={
+            "date": "2000-01-01",
+            "barcode": purchased["barcode"]
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        body = response.json()
+        assert body["snapshot_at"] is None or body["snapshot_at"] > "2000-01-02"
+        assert body["items"] == [{"barcode": purchased["barcode"], "product_name": purchased["name"], "stock": 0}]
+
+    def test_invalid_date(self, auth_headers):
+        """Test GET /api/inventory/as-of with an invalid date"""
+        response = requests.get(f"{BASE_URL}/api/inventory/as-of", params={"date": "ayer"}, headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_reconciliation(self, auth_headers, purchased):
+        """Test stock moved only through movements has no drift"""
+        response = requests.post(f"{BASE_URL}/api/inventory/reconciliation", headers=auth_headers)
+        assert response.status_code == 200
+        report = response.json()
+        assert report["products"] > 0
+        assert len(report["drift"]) <= report["drift_count"]
+
+        drift = requests.get(f"{BASE_URL}/api/inventory/reconciliation/drift", params={
+            "run_id": report["run_id"],
+            "barcode": purchased["barcode"]
+        }, headers=auth_headers)
+        assert drift.status_code == 200
+        assert drift.json() == []
+
+        latest = requests.get(f"{BASE_URL}/api/inventory/reconciliation", headers=auth_headers)
+        assert latest.status_code == 200
+        assert "drift" in latest.json()
+
+    def test_kardex_running_balance(self, auth_headers, purchased):
+        """Test the stock card opens at 0 and closes with the purchased units"""
+        response = requests.get(f"{BASE_URL}/api/inventory/kardex/{purchased['barcode']}", params={
+            "start_date": "2000-01-01"
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        rows = response.json()
+        assert rows[0]["movement_type"] == "opening"
+        assert rows[0]["balance"] == 0
+        assert rows[1]["movement_type"] == "purchase"
+        assert rows[1]["quantity_in"] == 3
+        assert rows[-1]["movement_type"] == "closing"
+        assert rows[-1]["balance"] == 3
+
+    def test_kardex_multiple_products_xlsx(self, auth_headers, purchased):
+        """Test the multi-product stock card as a spreadsheet"""
+        response = requests.get(f"{BASE_URL}/api/inventory/kardex", params={
+            "barcodes": purchased["barcode"],
+            "format": "xlsx"
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/vnd.openxmlformats")
+        assert response.content[:2] == b"PK"
+
+    def test_kardex_unknown_product(self, auth_headers):
+        """Test GET /api/inventory/kardex/{barcode} for a missing product"""
+        response = requests.get(f"{BASE_URL}/api/inventory/kardex/NO-EXISTE-999", headers=auth_headers)
+        assert response.status_code == 404
+
+
+class TestLowStock:
+    """Per-product minimum stock"""
+
+    def _low_stock_barcodes(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/inventory/low-stock", headers=auth_headers)
+        assert response.status_code == 200
+        return [product["barcode"] for product in response.json()]
+
+    def test_min_stock_controls_low_stock(self, auth_headers, test_product):
+        """Test a product leaves the low-stock list when its minimum drops to 0"""
+        assert test_product["min_stock"] == 10
+        assert test_product["barcode"] in self._low_stock_barcodes(auth_headers)
+
+        response = requests.put(f"{BASE_URL}/api/products/{test_product['barcode']}", json={
+            "min_stock": 0,
+            "reorder_qty": 12
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["reorder_qty"] == 12
+        assert test_product["barcode"] not in self._low_stock_barcodes(auth_headers)
+
+    def test_negative_min_stock_rejected(self, auth_headers, test_product):
+        """Test PUT /api/products/{barcode} with a negative minimum"""
+        response = requests.put(f"{BASE_URL}/api/products/{test_product['barcode']}", json={
+            "min_stock": -1
+        }, headers=auth_headers)
+        assert response.status_code == 422
+
+
+class TestPurchaseSuggestions:
+    """Reorder suggestions grouped by supplier"""
+
+    def test_suggestion_uses_last_supplier(self, auth_headers, test_product):
+        """Test a product under its minimum is suggested under its last supplier"""
+        supplier_name = f"TEST Proveedor {uuid.uuid4().hex[:6]}"
+        response = requests.post(f"{BASE_URL}/api/suppliers", json={
+            "name": supplier_name,
+            "lead_time_days": 3
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        assert response.json()["lead_time_days"] == 3
+
+        response = requests.post(f"{BASE_URL}/api/purchases", json={
+            "supplier_name": supplier_name,
+            "items": [{
+                "barcode": test_product["barcode"],
+                "product_name": test_product["name"],
+                "quantity": 1,
+                "unit_cost": 1000,
+                "total": 1000
+            }]
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        response = requests.put(f"{BASE_URL}/api/products/{test_product['barcode']}", json={
+            "min_stock": 1000
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        stock = response.json()["stock"]
+
+        response = requests.get(f"{BASE_URL}/api/purchases/suggestions", params={
+            "supplier": supplier_name
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        groups = response.json()["suppliers"]
+        assert [group["supplier_name"] for group in groups] == [supplier_name]
+        assert groups[0]["lead_time_days"] == 3
+        item = next(item for item in groups[0]["items"] if item["barcode"] == test_product["barcode"])
+        assert item["reorder_point"] == 1000
+        assert item["suggested_qty"] >= 1000 - stock
+
+    def test_window_validation(self, auth_headers):
+        """Test GET /api/purchases/suggestions with a window too short"""
+        response = requests.get(f"{BASE_URL}/api/purchases/suggestions", params={"days": 1}, headers=auth_headers)
+        assert response.status_code == 422
+
+
+class TestAverageCost:
+    """purchase_price kept as the weighted-average cost"""
+
+    @pytest.fixture(scope="class")
+    def costed_product(self, auth_headers):
+        categories = requests.get(f"{BASE_URL}/api/categories", headers=auth_headers).json()
+        if not categories:
+            pytest.skip("No categories found in database")
+        barcode = f"TEST{uuid.uuid4().hex[:8].upper()}"
+        response = requests.post(f"{BASE_URL}/api/products", json={
+            "barcode": barcode,
+            "name": "TEST Costo Promedio",
+            "category": categories[0]["name"],
+            "purchase_price": 1000,
+            "tax_rate": 19,
+            "prices": [{"price_list_name": "default", "price": 2500}]
+        }, headers=auth_headers)
+        assert response.status_code == 200
+        yield response.json()
+        requests.delete(f"{BASE_URL}/api/products/{barcode}", headers=auth_headers)
+
+    def _line(self, product, quantity, unit_cost):
+        return {
+            "barcode": product["barcode"],
+            "product_name": product["name"],
+            "quantity": quantity,
+            "unit_cost": unit_cost,
+            "total": quantity * unit_cost
+        }
+
+    def _product(self, auth_headers, barcode):
+        response = requests.get(f"{BASE_URL}/api/products/{barcode}", headers=auth_headers)
+        assert response.status_code == 200
+        return response.json()
+
+    def test_purchases_and_supplier_return(self, auth_headers, costed_product):
+        """Test each purchase and return to supplier updates stock and average cost"""
+        barcode = costed_product["barcode"]
+        for unit_cost in (1200, 1800):
+            response = requests.post(f"{BASE_URL}/api/purchases", json={
+                "supplier_name": "TEST Proveedor",
+                "items": [self._line(costed_product, 10, unit_cost)]
+            }, headers=auth_headers)
+            assert response.status_code == 200, f"Failed: {response.text}"
+        product = self._product(auth_headers, barcode)
+        assert product["stock"] == 20
+        assert product["purchase_price"] == 1500
+
+        response = requests.post(f"{BASE_URL}/api/supplier-returns", json={
+            "supplier_name": "TEST Proveedor",
+            "items": [self._line(costed_product, 10, 1800)],
+            "reason": "Producto defectuoso"
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        assert response.json()["total"] == 18000
+        product = self._product(auth_headers, barcode)
+        assert product["stock"] == 10
+        assert product["purchase_price"] == 1200
+
+    def test_supplier_return_requires_items(self, auth_headers):
+        """Test POST /api/supplier-returns without lines"""
+        response = requests.post(f"{BASE_URL}/api/supplier-returns", json={
+            "supplier_name": "TEST Proveedor",
+            "items": []
+        }, headers=auth_headers)
+        assert response.status_code == 422
+
+    def test_fifo_valuation(self, auth_headers, costed_product):
+        """Test supplier returns take the layer of their own cost, so FIFO and average cost agree"""
+        response = requests.post(f"{BASE_URL}/api/supplier-returns", json={
+            "supplier_name": "TEST Proveedor",
+            "items": [self._line(costed_product, 5, 1200)]
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+
+        response = requests.get(f"{BASE_URL}/api/reports/valuation", params={
+            "method": "fifo",
+            "category": costed_product["category"]
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        report = response.json()
+        item = next(item for item in report["items"] if item["barcode"] == costed_product["barcode"])
+        # Bought 10 at 1200 and 10 at 1800; returned 10 at 1800 and 5 at 1200
+        assert item["units"] == 5
+        assert item["value"] == 6000
+        assert report["total_value"] >= item["value"]
+
+    def test_supplier_return_over_stock(self, auth_headers, costed_product):
+        """Test returning more units than on hand is rejected and leaves stock untouched"""
+        before = self._product(auth_headers, costed_product["barcode"])["stock"]
+        response = requests.post(f"{BASE_URL}/api/supplier-returns", json={
+            "supplier_name": "TEST Proveedor",
+            "items": [self._line(costed_product, before + 1, 1200)]
+        }, headers=auth_headers)
+        assert response.status_code == 409
+        assert costed_product["barcode"] in response.json()["detail"]
+        assert self._product(auth_headers, costed_product["barcode"])["stock"] == before
+
+        response = requests.get(f"{BASE_URL}/api/reports/valuation", params={
+            "method": "average",
+            "category": costed_product["category"]
+        }, headers=auth_headers)
+        average = next(item for item in response.json()["items"] if item["barcode"] == costed_product["barcode"])
+        assert average["value"] == item["value"]
+
+    def test_valuation_method_validation(self, auth_headers):
+        """Test GET /api/reports/valuation with an unknown method"""
+        response = requests.get(f"{BASE_URL}/api/reports/valuation", params={"method": "lifo"}, headers=auth_headers)
+        assert response.status_code == 422
+
+
+class TestLocations:
+    """Stock split per location"""
+
+    @pytest.fixture(scope="class")
+    def locations(self, auth_headers):
+        codes = []
+        for name in ("Bodega", "Sucursal"):
+            code = f"test-{uuid.uuid4().hex[:6]}"
+            response = requests.post(f"{BASE_URL}/api/locations", json={"code": code, "name": f"TEST {name}"}, headers=auth_headers)
+            assert response.status_code == 200, f"Failed: {response.text}"
+            codes.append(code)
+        return codes
+
+    def _levels(self, auth_headers, barcode):
+        response = requests.get(f"{BASE_URL}/api/inventory/levels", params={"barcode": barcode}, headers=auth_headers)
+        assert response.status_code == 200
+        return {level["location"]: level["stock"] for level in response.json()}
+
+    def test_purchase_and_transfer(self, auth_headers, test_product, locations):
+        """Test a purchase lands in its location and a transfer moves it without changing the total"""
+        source, target = locations
+        response = requests.post(f"{BASE_URL}/api/purchases", json={
+            "supplier_name": "TEST Proveedor",
+            "location": source,
+            "items": [{
+                "barcode": test_product["barcode"],
+                "product_name": test_product["name"],
+                "quantity": 5,
+                "unit_cost": 1000,
+                "total": 5000
+            }]
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        total = requests.get(f"{BASE_URL}/api/products/{test_product['barcode']}", headers=auth_headers).json()["stock"]
+
+        response = requests.post(f"{BASE_URL}/api/inventory/transfer", json={
+            "from_location": source,
+            "to_location": target,
+            "items": [{"barcode": test_product["barcode"], "quantity": 3}]
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+
+        levels = self._levels(auth_headers, test_product["barcode"])
+        assert levels[source] == 2
+        assert levels[target] == 3
+        product = requests.get(f"{BASE_URL}/api/products/{test_product['barcode']}", headers=auth_headers).json()
+        assert product["stock"] == total
+
+    def test_transfer_insufficient_stock(self, auth_headers, test_product, locations):
+        """Test a transfer larger than the origin's stock moves nothing"""
+        source, target = locations
+        before = self._levels(auth_headers, test_product["barcode"])
+        response = requests.post(f"{BASE_URL}/api/inventory/transfer", json={
+            "from_location": target,
+            "to_location": source,
+            "items": [{"barcode": test_product["barcode"], "quantity": 1000}]
+        }, headers=auth_headers)
+        assert response.status_code == 409
+        assert self._levels(auth_headers, test_product["barcode"]) == before
+
+    def test_unknown_location(self, auth_headers, test_product):
+        """Test POST /api/purchases with a location that does not exist"""
+        response = requests.post(f"{BASE_URL}/api/purchases", json={
+            "supplier_name": "TEST Proveedor",
+            "location": f"missing-{uuid.uuid4().hex[:6]}",
+            "items": [{
+                "barcode": test_product["barcode"],
+                "product_name": test_product["name"],
+                "quantity": 1,
+                "unit_cost": 1000,
+                "total": 1000
+            }]
+        }, headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_transfer_document_partial_receipt(self, auth_headers, test_product, locations):
+        """Test a transfer document: draft, dispatch to transit, two partial receipts"""
+        source, target = locations
+        barcode = test_product["barcode"]
+        before = self._levels(auth_headers, barcode)
+        response = requests.post(f"{BASE_URL}/api/transfers", json={
+            "from_location": source,
+            "to_location": target,
+            "items": [{"barcode": barcode, "quantity": 2}]
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        transfer = response.json()
+        assert transfer["status"] == "draft"
+        assert self._levels(auth_headers, barcode) == before
+        number = transfer["transfer_number"]
+
+        response = requests.post(f"{BASE_URL}/api/transfers/{number}/dispatch", headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        assert response.json()["status"] == "in_transit"
+        assert self._levels(auth_headers, barcode)[source] == before[source] - 2
+        response = requests.post(f"{BASE_URL}/api/transfers/{number}/dispatch", headers=auth_headers)
+        assert response.status_code == 409
+
+        response = requests.post(f"{BASE_URL}/api/transfers/{number}/receive", json={
+            "items": [{"barcode": barcode, "quantity": 3}]
+        }, headers=auth_headers)
+        assert response.status_code == 400
+        response = requests.post(f"{BASE_URL}/api/transfers/{number}/receive", json={
+            "items": [{"barcode": barcode, "quantity": 1}]
+        }, headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        assert response.json()["status"] == "in_transit"
+        assert response.json()["items"][0]["received_qty"] == 1
+
+        response = requests.post(f"{BASE_URL}/api/transfers/{number}/receive", headers=auth_headers)
+        assert response.status_code == 200, f"Failed: {response.text}"
+        transfer = response.json()
+        assert transfer["status"] == "received"
+        assert len(transfer["receipts"]) == 2
+        assert self._levels(auth_headers, barcode)[target] == before[target] + 2
+
+        response = requests.get(f"{BASE_URL}/api/transfers", params={"status": "received", "location": target}, headers=auth_headers)
+        assert response.status_code == 200
+        assert number in [t["transfer_number"] for t in response.json()]